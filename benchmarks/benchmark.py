@@ -0,0 +1,294 @@
+'''Times wtsrc commands on generated workspaces of increasing size
+
+Every workspace is built offline: N bare repos on disk serve as file:// remotes, a manifest repo lists them in groups
+and .tsrc/config.yml is written the way tsrc init writes it. The commands run from this checkout of wtsrc, not the
+installed one, so two checkouts can be compared by saving their results and passing one to --compare.
+
+    python benchmarks/benchmark.py --sizes 10,100,1000 --output results.json
+    python benchmarks/benchmark.py --compare results.json
+'''
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+import yaml
+
+WTSRC_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# how many repos each generated group holds
+GROUP_SIZE = 10
+
+# files committed to every repo so status and sync have something to look at
+SEED_FILES = 20
+
+# loads the three yml models in a fresh process and prints how long it took
+MODEL_LOAD = '''
+import json, time
+start = time.perf_counter()
+from wtsrc.ManifestModel import ManifestModel
+from wtsrc.TsrcConfigModel import TsrcConfigModel
+from wtsrc.WtsrcProjectModel import WtsrcProjectModel
+ManifestModel.load()
+TsrcConfigModel.load()
+WtsrcProjectModel.load()
+print(json.dumps(time.perf_counter() - start))
+'''
+
+
+def git(*args, cwd=None):
+    subprocess.run(['git'] + list(args), cwd=cwd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def commit_all(repo_dir, message):
+    git('add', '-A', cwd=repo_dir)
+    git('-c', 'user.name=bench', '-c', 'user.email=bench@localhost', 'commit', '-q', '-m', message, cwd=repo_dir)
+
+
+def init_repo(repo_dir):
+    os.makedirs(repo_dir)
+    git('init', '-q', cwd=repo_dir)
+    # the manifest and tsrc expect master regardless of the local init.defaultBranch
+    git('symbolic-ref', 'HEAD', 'refs/heads/master', cwd=repo_dir)
+
+
+def repo_name(i):
+    return "repos/r{:04d}".format(i)
+
+
+def make_seed(work_dir):
+    '''One bare repo that every remote is copied from, copying is much faster than creating each repo with git'''
+    src = os.path.join(work_dir, 'seed')
+    init_repo(src)
+    for i in range(SEED_FILES):
+        sub_dir = os.path.join(src, 'dir{}'.format(i % 4))
+        os.makedirs(sub_dir, exist_ok=True)
+        with open(os.path.join(sub_dir, 'file{}.txt'.format(i)), 'w') as file:
+            file.write("line\n" * 100)
+    commit_all(src, "seed")
+    bare = os.path.join(work_dir, 'seed.git')
+    git('clone', '-q', '--bare', src, bare)
+    return bare
+
+
+def make_manifest(remotes_dir, work_dir, size):
+    repos = [repo_name(i) for i in range(size)]
+    groups = {}
+    for start in range(0, size, GROUP_SIZE):
+        groups["g{:03d}".format(start // GROUP_SIZE)] = {'repos': repos[start:start + GROUP_SIZE]}
+
+    manifest = {
+        'repos': [{'dest': repo, 'url': "file://" + os.path.join(remotes_dir, repo + '.git'), 'branch': 'master'}
+                  for repo in repos],
+        'groups': groups,
+    }
+
+    src = os.path.join(work_dir, 'manifest-src')
+    init_repo(src)
+    with open(os.path.join(src, 'manifest.yml'), 'w') as file:
+        yaml.dump(manifest, file)
+    with open(os.path.join(src, 'wtsrc.yml'), 'w') as file:
+        yaml.dump({'commands': {}, 'actions': {}}, file)
+    commit_all(src, "manifest")
+    git('clone', '-q', '--bare', src, os.path.join(remotes_dir, 'manifest.git'))
+    return repos
+
+
+def clone(remotes_dir, ws_dir, repo):
+    '''Clones from the path (hardlinks, so it is quick) and then points origin at the file:// url like tsrc does'''
+    remote = os.path.join(remotes_dir, repo + '.git')
+    dest = os.path.join(ws_dir, repo)
+    git('clone', '-q', remote, dest)
+    git('remote', 'set-url', 'origin', "file://" + remote, cwd=dest)
+
+
+def make_workspace(work_dir, size):
+    '''Builds the remotes and a cloned workspace for size repos under work_dir, returns the workspace directory'''
+    if os.path.exists(work_dir):
+        shutil.rmtree(work_dir)
+    os.makedirs(work_dir)
+    remotes_dir = os.path.join(work_dir, 'remotes')
+    ws_dir = os.path.join(work_dir, 'ws')
+
+    seed = make_seed(work_dir)
+    repos = make_manifest(remotes_dir, work_dir, size)
+    for repo in repos:
+        shutil.copytree(seed, os.path.join(remotes_dir, repo + '.git'))
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 4) as pool:
+        list(pool.map(lambda repo: clone(remotes_dir, ws_dir, repo), repos))
+        pool.submit(clone, remotes_dir, os.path.join(ws_dir, '.tsrc'), 'manifest').result()
+
+    config = {
+        'manifest_url': "file://" + os.path.join(remotes_dir, 'manifest.git'),
+        'manifest_branch': 'master',
+        'repo_groups': [],
+        'shallow_clones': False,
+        'clone_all_repos': False,
+        'singular_remote': None,
+    }
+    with open(os.path.join(ws_dir, '.tsrc', 'config.yml'), 'w') as file:
+        yaml.dump(config, file)
+    return ws_dir, repos
+
+
+def environment():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = WTSRC_ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    env.pop('WTSRC_TRACE', None)
+    return env
+
+
+def time_wtsrc(ws_dir, args):
+    '''Runs wtsrc from this checkout in the workspace, returns (seconds, exit code)'''
+    start = time.perf_counter()
+    p = subprocess.run([sys.executable, '-c', 'import wtsrc; wtsrc.run()'] + args, cwd=ws_dir, env=environment(),
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start, p.returncode
+
+
+def check_failure_detection(ws_dir):
+    '''Runs a command that fails in every repo, a harness that doesn't see that would time failed runs as valid'''
+    seconds, exit_code = time_wtsrc(ws_dir, ['foreach', '-c', 'git rev-parse no-such-ref'])
+    if exit_code == 0:
+        click.secho("A failing wtsrc run was reported as successful, the results could not be trusted", fg='red')
+        sys.exit(1)
+
+
+def time_model_load(ws_dir, cold):
+    if cold:
+        shutil.rmtree(os.path.join(ws_dir, '.tsrc', 'wtsrc_cache'), ignore_errors=True)
+    p = subprocess.run([sys.executable, '-c', MODEL_LOAD], cwd=ws_dir, env=environment(),
+                       stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+    if p.returncode != 0:
+        return None, p.returncode
+    return json.loads(p.stdout.strip().splitlines()[-1]), 0
+
+
+def benchmarks(repos, jobs):
+    '''The name and the timing function of every benchmark, create_config is last because it switches the branch'''
+    jobs = ['--jobs', str(jobs)]
+    return [
+        ('model load (cold)', lambda ws, run: time_model_load(ws, cold=True)),
+        ('model load (warm)', lambda ws, run: time_model_load(ws, cold=False)),
+        ('status', lambda ws, run: time_wtsrc(ws, ['status', '--repo', 'all'] + jobs)),
+        ('foreach', lambda ws, run: time_wtsrc(ws, ['foreach', '-c', 'git rev-parse HEAD'] + jobs)),
+        ('sync', lambda ws, run: time_wtsrc(ws, ['sync', '--native'] + jobs)),
+        ('create_config', lambda ws, run: time_wtsrc(
+            ws, ['create-config', '--branch', 'bench-{}'.format(run)] + [a for r in repos for a in ('-r', r)] + jobs)),
+    ]
+
+
+def summarize(name, size, times, failures):
+    return {
+        'benchmark': name,
+        'repos': size,
+        'runs': [round(t, 4) for t in times],
+        'failures': failures,
+        'min': round(min(times), 4) if times else None,
+        'median': round(statistics.median(times), 4) if times else None,
+    }
+
+
+def log_compare(results, baseline):
+    '''Prints the median of every benchmark next to the baseline's'''
+    old = {(r['benchmark'], r['repos']): r['median'] for r in baseline['results']}
+    click.echo("")
+    click.echo("{:<20} {:>6} {:>10} {:>10} {:>8}".format("benchmark", "repos", "baseline", "median", "change"))
+    for r in results:
+        before = old.get((r['benchmark'], r['repos']))
+        if before and r['median']:
+            change = "{:+.0f}%".format((r['median'] / before - 1) * 100)
+            color = 'red' if r['median'] > before * 1.1 else 'green' if r['median'] < before * 0.9 else 'reset'
+        else:
+            change, color = "-", 'reset'
+        click.secho("{:<20} {:>6} {:>10} {:>10} {:>8}".format(
+            r['benchmark'], r['repos'], "{:.3f}s".format(before) if before else "-",
+            "{:.3f}s".format(r['median']) if r['median'] else "-", change), fg=color)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=WTSRC_ROOT, stderr=subprocess.DEVNULL,
+                                       universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@click.command()
+@click.option('--sizes', default="10,100,1000", help="comma separated repo counts to generate workspaces for")
+@click.option('--repeat', '-n', default=3, type=int, help="how many times every benchmark is run")
+@click.option('--jobs', '-j', default=8, type=int, help="passed to the commands that run repos in parallel")
+@click.option('--only', multiple=True, help="run only the named benchmarks")
+@click.option('--output', '-o', default="benchmark-results.json", help="where the results are saved as json")
+@click.option('--compare', type=click.Path(exists=True, dir_okay=False), default=None,
+              help="results of an earlier run to compare the medians against")
+@click.option('--work-dir', default=None, help="where the workspaces are generated, a temporary directory by default")
+@click.option('--keep', is_flag=True, default=False, help="keep the generated workspaces")
+def main(sizes, repeat, jobs, only, output, compare, work_dir, keep):
+    '''Generates workspaces of each size and times the wtsrc commands on them'''
+    from wtsrc.version import __version__
+
+    temp_dir = work_dir is None
+    work_dir = os.path.abspath(work_dir or tempfile.mkdtemp(prefix='wtsrc-bench-'))
+    results = []
+
+    try:
+        for size in [int(s) for s in sizes.split(',')]:
+            click.secho("Generating a workspace with {} repos".format(size), fg='cyan')
+            start = time.perf_counter()
+            ws_dir, repos = make_workspace(os.path.join(work_dir, str(size)), size)
+            click.echo("    done in {:.1f}s".format(time.perf_counter() - start))
+            check_failure_detection(ws_dir)
+
+            for name, func in benchmarks(repos, jobs):
+                if only and name not in only:
+                    continue
+                times = []
+                failures = 0
+                for run in range(repeat):
+                    seconds, exit_code = func(ws_dir, run)
+                    if exit_code == 0:
+                        times.append(seconds)
+                    else:
+                        failures += 1
+                result = summarize(name, size, times, failures)
+                results.append(result)
+                median = "{:.3f}s".format(result['median']) if times else "failed"
+                click.echo("    {:<20} {}{}".format(name, median, " ({} failed)".format(failures) if failures else ""))
+    finally:
+        if temp_dir and not keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        elif keep:
+            click.echo("The workspaces were kept in {}".format(work_dir))
+
+    report = {
+        'version': __version__,
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'repeat': repeat,
+        'jobs': jobs,
+        'results': results,
+    }
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    click.echo("Results saved to {}".format(output))
+
+    if compare:
+        with open(compare) as file:
+            log_compare(results, json.load(file))
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, WTSRC_ROOT)
+    main()
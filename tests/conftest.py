@@ -0,0 +1,58 @@
+import os
+import subprocess
+import pytest
+import yaml
+
+
+def git(*args, cwd=None):
+    subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test@localhost'] + list(args), cwd=cwd,
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def make_repo(path, files=None):
+    os.makedirs(path)
+    git('init', '-q', cwd=path)
+    git('symbolic-ref', 'HEAD', 'refs/heads/master', cwd=path)
+    for name, text in (files or {'README': "readme\n"}).items():
+        os.makedirs(os.path.dirname(os.path.join(path, name)) or path, exist_ok=True)
+        with open(os.path.join(path, name), 'w') as file:
+            file.write(text)
+    git('add', '-A', cwd=path)
+    git('commit', '-q', '-m', 'init', cwd=path)
+
+
+def reset_models():
+    '''Forgets the models and resolved paths a test loaded, every test starts from its own workspace'''
+    from wtsrc.ManifestModel import ManifestModel
+    from wtsrc.TsrcConfigModel import TsrcConfigModel
+    from wtsrc.WtsrcProjectModel import WtsrcProjectModel
+    from wtsrc.WtsrcUtils import invalidate_workspace_context
+    ManifestModel.instance = None
+    TsrcConfigModel.instance = None
+    WtsrcProjectModel.instance = None
+    invalidate_workspace_context()
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    '''A workspace with three repos in the manifest, the cwd is its root'''
+    root = tmp_path / 'ws'
+    repos = ['libs/a', 'libs/b', 'apps/c']
+    for repo in repos:
+        make_repo(str(root / repo), {'src/main.txt': "hello {}\n".format(repo)})
+
+    manifest = {
+        'repos': [{'dest': repo, 'url': 'file:///remotes/{}.git'.format(repo), 'branch': 'master'} for repo in repos],
+        'groups': {'libs': {'repos': ['libs/a', 'libs/b']}},
+    }
+    manifest_dir = root / '.tsrc' / 'manifest'
+    make_repo(str(manifest_dir), {'manifest.yml': yaml.dump(manifest), 'wtsrc.yml': yaml.dump({'commands': {}})})
+    with open(str(root / '.tsrc' / 'config.yml'), 'w') as file:
+        yaml.dump({'manifest_url': 'file:///remotes/manifest.git', 'manifest_branch': 'master'}, file)
+
+    # the model cache is kept out of the workspace so the tests don't see each other's models
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.chdir(str(root))
+    reset_models()
+    yield root
+    reset_models()
@@ -0,0 +1,41 @@
+import asyncio
+import threading
+import time
+from wtsrc.WtsrcAsync import get_executor, run, run_sync
+from wtsrc.WtsrcSettings import DEFAULT_JOBS
+
+
+def sleeps(commands):
+    '''A coroutine running the sleeps through the module level run, it returns the limit of the executor they used'''
+
+    async def all_of_them():
+        await asyncio.gather(*[run(['sleep', '0.1']) for _ in range(commands)])
+        return get_executor().jobs
+
+    return all_of_them()
+
+
+def test_run_sync_limits_its_own_commands():
+    start = time.perf_counter()
+    assert run_sync(sleeps(4), jobs=2) == 2
+    # two at a time, so the four sleeps take two rounds
+    assert time.perf_counter() - start >= 0.2
+
+
+def test_jobs_do_not_leak_into_later_calls():
+    run_sync(sleeps(1), jobs=1)
+    assert run_sync(sleeps(1)) == DEFAULT_JOBS
+
+
+def test_concurrent_calls_keep_their_own_limit():
+    seen = {}
+
+    def call(jobs):
+        seen[jobs] = run_sync(sleeps(3), jobs=jobs)
+
+    threads = [threading.Thread(target=call, args=(jobs,)) for jobs in (1, 5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert seen == {1: 1, 5: 5}
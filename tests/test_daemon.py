@@ -0,0 +1,56 @@
+import sys
+import time
+import pytest
+import wtsrc.WtsrcGitStatus
+from wtsrc.WtsrcDaemon import WorkspaceState
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith('linux'), reason="the daemon watches repos with inotify")
+
+REPOS = ['libs/a', 'libs/b', 'apps/c']
+
+
+@pytest.fixture
+def git_runs(monkeypatch):
+    '''The repos git status ran in'''
+    runs = []
+    run = wtsrc.WtsrcGitStatus.run
+
+    async def counting_run(cmd, cwd=None, **kwargs):
+        runs.append(cwd)
+        return await run(cmd, cwd=cwd, **kwargs)
+
+    monkeypatch.setattr(wtsrc.WtsrcGitStatus, 'run', counting_run)
+    return runs
+
+
+def read_statuses(state):
+    statuses = state.read_statuses(REPOS)
+    # the watcher's thread needs a moment for the events git or the test caused
+    time.sleep(0.2)
+    return statuses
+
+
+def test_unchanged_repos_are_not_read_again(workspace, git_runs):
+    state = WorkspaceState(str(workspace), 4)
+    # only inotify may decide, not the status cache
+    state.cache = None
+    read_statuses(state)
+    assert len(git_runs) == 3
+
+    del git_runs[:]
+    read_statuses(state)
+    assert git_runs == []
+
+
+def test_changed_repo_is_read_again(workspace, git_runs):
+    state = WorkspaceState(str(workspace), 4)
+    state.cache = None
+    read_statuses(state)
+
+    del git_runs[:]
+    with open(str(workspace / 'libs' / 'b' / 'src' / 'main.txt'), 'a') as file:
+        file.write("more\n")
+    time.sleep(0.2)
+    statuses = read_statuses(state)
+    assert git_runs == [str(workspace / 'libs' / 'b')]
+    assert statuses[1].unstaged == 1
@@ -0,0 +1,49 @@
+import pytest
+import wtsrc.WtsrcGrep
+from wtsrc.WtsrcGrep import grep_repos
+
+REPOS = ['libs/a', 'libs/b', 'apps/c']
+
+
+def break_index(workspace, repo):
+    with open(str(workspace / repo / '.git' / 'index'), 'w') as file:
+        file.write("not an index")
+
+
+def test_names_only_keeps_stderr_out_of_the_names(workspace, capsys, monkeypatch):
+    # git writes its trace to stderr while it prints the names
+    monkeypatch.setenv('GIT_TRACE', '1')
+    break_index(workspace, 'libs/b')
+    count, failures = grep_repos(REPOS, 'hello', ['-l'], [], 4)
+    assert count == 2
+    assert sorted(capsys.readouterr().out.splitlines()) == ['apps/c/src/main.txt', 'libs/a/src/main.txt']
+    assert [f.repo for f in failures] == ['libs/b']
+    assert 'index' in failures[0].output
+
+
+def test_matches_and_errors(workspace, capsys):
+    break_index(workspace, 'apps/c')
+    count, failures = grep_repos(REPOS, 'hello', [], [], 4)
+    assert count == 2
+    assert sorted(capsys.readouterr().out.splitlines()) == ['libs/a/src/main.txt:1:hello libs/a',
+                                                            'libs/b/src/main.txt:1:hello libs/b']
+    assert [f.repo for f in failures] == ['apps/c']
+
+
+def test_max_count_stops_the_other_repos(workspace, capsys):
+    count, failures = grep_repos(REPOS, 'hello', [], [], 1, max_count=1)
+    assert count == 1
+    assert failures == []
+
+
+def test_an_unexpected_error_is_not_swallowed(workspace, monkeypatch):
+    grep_repo = wtsrc.WtsrcGrep.grep_repo
+
+    async def failing_grep_repo(repo, *args):
+        if repo == 'libs/b':
+            raise RuntimeError("broken")
+        return await grep_repo(repo, *args)
+
+    monkeypatch.setattr(wtsrc.WtsrcGrep, 'grep_repo', failing_grep_repo)
+    with pytest.raises(RuntimeError):
+        grep_repos(REPOS, 'hello', [], [], 4)
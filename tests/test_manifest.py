@@ -0,0 +1,31 @@
+from wtsrc.ManifestModel import ManifestModel
+
+
+def manifest():
+    return ManifestModel({
+        'repos': [
+            {'dest': 'libs/a', 'url': 'git@example.com:libs/a.git'},
+            {'dest': 'libs/b', 'url': 'git@example.com:libs/b.git'},
+            {'dest': 'apps/c', 'url': 'git@example.com:apps/c.git'},
+        ],
+        'groups': {'libs': {'repos': ['libs/a', 'libs/b']}},
+    })
+
+
+def test_get_repo_by_url():
+    model = manifest()
+    assert model.get_repo_by_url('git@example.com:apps/c.git')['dest'] == 'apps/c'
+    assert model.get_repo_by_url('git@example.com:apps/d.git') is None
+
+
+def test_match_repos():
+    model = manifest()
+    assert model.match_repos('libs/*') == ['libs/a', 'libs/b']
+    assert model.match_repos('*/c') == ['apps/c']
+    assert model.match_repos('Libs/*') == []
+
+
+def test_load_indexes_the_workspace_manifest(workspace):
+    model = ManifestModel.load()
+    assert model.get_repo_by_url('file:///remotes/libs/b.git')['dest'] == 'libs/b'
+    assert model.match_repos('apps/*') == ['apps/c']
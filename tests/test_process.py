@@ -0,0 +1,24 @@
+from wtsrc.WtsrcAsync import run, run_sync
+from wtsrc.WtsrcProcess import BufferSink, FileSink
+
+
+def test_file_sink_appends_the_output(tmp_path):
+    log_file = str(tmp_path / 'command.log')
+    with open(log_file, 'w') as file:
+        file.write("before\n")
+    sink = FileSink(log_file)
+    result = run_sync(run(['sh', '-c', 'echo out; echo err >&2'], sinks=[sink]))
+    assert result.exit_code == 0
+    assert sink.file.closed
+    with open(log_file) as file:
+        assert file.read() == "before\nout\nerr\n"
+
+
+def test_every_sink_gets_the_same_output(tmp_path):
+    buffer = BufferSink()
+    sink = FileSink(str(tmp_path / 'command.log'))
+    result = run_sync(run(['printf', 'a\\xc3\\xa9b'], sinks=[buffer, sink], keep_output=False))
+    assert result.output == ""
+    assert buffer.getvalue() == "aéb"
+    with open(str(tmp_path / 'command.log'), encoding='utf-8') as file:
+        assert file.read() == "aéb"
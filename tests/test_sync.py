@@ -0,0 +1,28 @@
+import subprocess
+from conftest import git
+from wtsrc.WtsrcSync import pinned_ref, sync_repos
+
+
+def head(path):
+    return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=path, check=True, stdout=subprocess.PIPE,
+                          universal_newlines=True).stdout.strip()
+
+
+def test_pinned_repo_is_not_a_failure(workspace, tmp_path):
+    repo_dir = str(workspace / 'libs' / 'a')
+    git('clone', '-q', '--bare', repo_dir, str(tmp_path / 'a.git'))
+    git('remote', 'add', 'origin', str(tmp_path / 'a.git'), cwd=repo_dir)
+    sha1 = head(repo_dir)
+    git('checkout', '-q', '--detach', sha1, cwd=repo_dir)
+
+    # without the pin a detached repo has no upstream to fast-forward to
+    assert not sync_repos(['libs/a'], 1)[0].succeeded()
+    result = sync_repos(['libs/a'], 1, pins={'libs/a': pinned_ref({'dest': 'libs/a', 'sha1': sha1})})[0]
+    assert result.succeeded()
+    assert head(repo_dir) == sha1
+
+
+def test_pinned_ref():
+    assert pinned_ref({'dest': 'a', 'tag': 'v1.0'}) == 'v1.0'
+    assert pinned_ref({'dest': 'a', 'branch': 'master'}) is None
+    assert pinned_ref(None) is None
@@ -0,0 +1,44 @@
+import threading
+from wtsrc.WtsrcUtils import atomic_write
+
+
+def test_atomic_write_from_threads_at_once(tmp_path):
+    path = str(tmp_path / 'file.txt')
+    texts = ["{}\n".format(n) * 10000 for n in range(8)]
+    errors = []
+    start = threading.Barrier(len(texts))
+
+    def write(text):
+        start.wait()
+        try:
+            with atomic_write(path) as file:
+                file.write(text)
+        except OSError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(text,)) for text in texts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    # whichever thread finished last, the file is one whole text
+    with open(path) as file:
+        assert file.read() in texts
+    assert [p.name for p in tmp_path.iterdir()] == ['file.txt']
+
+
+def test_atomic_write_keeps_the_old_file_when_the_block_fails(tmp_path):
+    path = str(tmp_path / 'file.txt')
+    with atomic_write(path) as file:
+        file.write("old")
+    try:
+        with atomic_write(path) as file:
+            file.write("new")
+            raise RuntimeError()
+    except RuntimeError:
+        pass
+    with open(path) as file:
+        assert file.read() == "old"
+    assert [p.name for p in tmp_path.iterdir()] == ['file.txt']
@@ -1,5 +1,6 @@
-import yaml
+import fnmatch
 import wtsrc.WtsrcLogger as log
+from wtsrc.WtsrcModelCache import load_yaml
 from wtsrc.WtsrcSettings import MANIFEST_FILE
 from wtsrc.WtsrcUtils import find_file_in_manifest_dir, find_manifest_directory, obj_dump
 
@@ -9,6 +10,23 @@ class ManifestModel:
 
     def __init__(self, data:dict):
         self.data = data
+        self.index()
+
+
+    def index(self):
+        '''Builds the lookups by dest, url and group once so the queries don't scan the repo list'''
+        self.repos_by_dest = {}
+        self.repos_by_url = {}
+        for repo in self.data.get('repos', []):
+            if 'dest' in repo:
+                self.repos_by_dest[repo['dest']] = repo
+            if 'url' in repo:
+                self.repos_by_url[repo['url']] = repo
+
+        self.groups = {}
+        for name, group in (self.data.get('groups') or {}).items():
+            self.groups[name] = group or {}
+        self.group_repos = {}
 
 
     def log(self):
@@ -21,32 +39,65 @@ class ManifestModel:
         log.decrease_indent()
 
 
+    def get_repo_dests(self):
+        '''Returns the workspace relative path of every repo in the manifest'''
+        return list(self.repos_by_dest)
+
+
+    def get_repo(self, repo_name):
+        '''Returns the manifest entry of the repo with the dest or None'''
+        return self.repos_by_dest.get(repo_name, None)
+
+
+    def get_repo_by_url(self, url):
+        '''Returns the manifest entry of the repo with the url or None'''
+        return self.repos_by_url.get(url, None)
+
+
     def has_repo(self, repo_name):
-        found = False
-        if 'repos' in self.data:
-            for repo in self.data['repos']:
-                if 'dest' in repo and repo_name == repo['dest']:
-                    found = True
-                    break
-        return found
+        return repo_name in self.repos_by_dest
+
+
+    def repos_in_group(self, group_name):
+        '''Returns the dests of the repos in the group, including the ones of the groups it includes'''
+        if group_name not in self.groups:
+            log.fatal("The group {g} doesn't exist".format(g=group_name))
+
+        if group_name not in self.group_repos:
+            dests = []
+            self.collect_group(group_name, dests, set())
+            self.group_repos[group_name] = dests
+        return list(self.group_repos[group_name])
+
+
+    def collect_group(self, group_name, dests, visited):
+        if group_name in visited or group_name not in self.groups:
+            return
+        visited.add(group_name)
+        group = self.groups[group_name]
+        for dest in group.get('repos', []):
+            if dest not in dests:
+                dests.append(dest)
+        for included in group.get('includes', []):
+            self.collect_group(included, dests, visited)
+
+
+    def match_repos(self, pattern):
+        '''Returns the dests that match the glob pattern, for example libs/*'''
+        return [dest for dest in self.repos_by_dest if fnmatch.fnmatchcase(dest, pattern)]
 
 
     def update_branch(self, repo_name, branch_name):
-        updated = False
-        if 'repos' in self.data:
-            for repo in self.data['repos']:
-                if 'dest' in repo and repo_name == repo['dest']:
-                    repo['branch'] = branch_name
-                    updated = True
-                    break
-
-        if not updated:
+        repo = self.get_repo(repo_name)
+        if not repo:
             log.fatal("The repo {r} doesn't exist".format(r=repo_name))
+        repo['branch'] = branch_name
 
 
     def save(self):
         file_path = find_file_in_manifest_dir(MANIFEST_FILE)
         if file_path:
+            import yaml
             with open(file_path, 'w') as file:
                 yaml.dump(self.data, file)
         else:
@@ -59,9 +110,8 @@ class ManifestModel:
             file_path = find_file_in_manifest_dir(MANIFEST_FILE)
             if file_path:
                 log.perhaps_print("Attempting to load project model: {}".format(file_path))
-                with open(file_path) as file:
-                    yml_data = yaml.load(file, Loader=yaml.FullLoader)
-                    ManifestModel.instance = ManifestModel(yml_data)
+                yml_data = load_yaml(file_path)
+                ManifestModel.instance = ManifestModel(yml_data)
             else:
                 log.fatal("The tsrc manifest file could not be found")
-        return ManifestModel.instance
\ No newline at end of file
+        return ManifestModel.instance
@@ -1,5 +1,5 @@
-import yaml
 import wtsrc.WtsrcLogger as log
+from wtsrc.WtsrcModelCache import load_yaml
 from wtsrc.WtsrcSettings import CONFIG_FILE
 from wtsrc.WtsrcUtils import find_file_in_tsrc_dir, find_tsrc_directory, obj_dump
 
@@ -21,6 +21,7 @@ class TsrcConfigModel:
     def save(self):
         file_path = find_file_in_tsrc_dir(CONFIG_FILE)
         if file_path:
+            import yaml
             with open(file_path, 'w') as file:
                 yaml.dump(self.data, file)
         else:
@@ -33,9 +34,8 @@ class TsrcConfigModel:
             file_path = find_file_in_tsrc_dir(CONFIG_FILE)
             if file_path:
                 log.perhaps_print("Attempting to load project model: {}".format(file_path))
-                with open(file_path) as file:
-                    yml_data = yaml.load(file, Loader=yaml.FullLoader)
-                    TsrcConfigModel.instance = TsrcConfigModel(yml_data)
+                yml_data = load_yaml(file_path)
+                TsrcConfigModel.instance = TsrcConfigModel(yml_data)
             else:
                 log.fatal("The tsrc config file could not be found")
         return TsrcConfigModel.instance
@@ -0,0 +1,115 @@
+import glob
+import hashlib
+import json
+import os
+import wtsrc.WtsrcLogger as log
+from wtsrc.WtsrcSettings import ACTION_CACHE_DIRECTORY, ACTION_CACHE_MAX_BYTES
+from wtsrc.WtsrcUtils import atomic_write, find_project_root
+
+
+def hash_file(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def expand(patterns, cwd):
+    '''Returns the files matched by the glob patterns relative to cwd, sorted so the hash doesn't depend on the order'''
+    files = set()
+    for pattern in patterns:
+        for path in glob.glob(os.path.join(cwd, pattern), recursive=True):
+            if os.path.isfile(path):
+                files.add(os.path.relpath(path, cwd))
+    return sorted(files)
+
+
+class ActionCache:
+    '''Remembers the output of actions that declare inputs so they can be skipped while the inputs don't change
+
+    An entry is keyed on the action's commands and the hash of every input file, it records the hash of every
+    output file and the output that was printed. The least recently used entries are deleted past max_bytes.
+    '''
+
+    def __init__(self, cache_dir, max_bytes=ACTION_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+
+    @classmethod
+    def for_workspace(cls):
+        root = find_project_root()
+        if not root:
+            return None
+        return ActionCache(os.path.join(root, ACTION_CACHE_DIRECTORY))
+
+
+    def key(self, action, cwd):
+        '''The hash of the action's name, commands, and the path and content of every input file'''
+        sha = hashlib.sha256()
+        sha.update(action.name.encode('utf-8'))
+        for step in action.action.steps:
+            sha.update("\0{n}\0{r}\0{d}".format(n=step.name, r=step.run, d=",".join(step.depends_on)).encode('utf-8'))
+        for pattern in action.inputs:
+            sha.update("\0{}".format(pattern).encode('utf-8'))
+        for path in expand(action.inputs, cwd):
+            sha.update("\0{p}\0{h}".format(p=path, h=hash_file(os.path.join(cwd, path))).encode('utf-8'))
+        return sha.hexdigest()
+
+
+    def entry_file(self, key):
+        return os.path.join(self.cache_dir, key + '.json')
+
+
+    def lookup(self, key, cwd):
+        '''Returns the cached output when there is an entry for the key and its outputs are unchanged'''
+        entry_file = self.entry_file(key)
+        try:
+            with open(entry_file, encoding='utf-8') as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+
+        for path, sha in entry['outputs'].items():
+            full_path = os.path.join(cwd, path)
+            if not os.path.isfile(full_path) or hash_file(full_path) != sha:
+                log.perhaps_print("The output {} changed since the cached run".format(path))
+                return None
+
+        # the mtime tells the eviction when the entry was last used
+        os.utime(entry_file)
+        return entry['stdout']
+
+
+    def store(self, key, action, cwd, stdout):
+        outputs = {path: hash_file(os.path.join(cwd, path)) for path in expand(action.outputs, cwd)}
+        entry = {'action': action.name, 'outputs': outputs, 'stdout': stdout}
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with atomic_write(self.entry_file(key), encoding='utf-8') as file:
+                json.dump(entry, file)
+        except OSError as e:
+            log.warning("Could not cache the result of {a}: {e}".format(a=action.name, e=e))
+            return
+        self.evict()
+
+
+    def evict(self):
+        '''Deletes the least recently used entries until the cache fits in max_bytes'''
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith('.json'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
@@ -0,0 +1,156 @@
+import wtsrc.WtsrcLogger as log
+from wtsrc.WtsrcSettings import DEFAULT_JOBS, WTSRC_FILE
+
+
+class Step:
+    '''One shell command of an action, it only starts once the steps it depends on succeeded'''
+
+    def __init__(self, name, run, depends_on):
+        self.name = name
+        self.run = run
+        self.depends_on = depends_on
+
+
+    @classmethod
+    def create_from_data(cls, description:str, index:int, data):
+        '''A step is either a plain command string or a dict with run, an optional name and depends_on'''
+        if isinstance(data, str):
+            return Step("step{}".format(index + 1), data, [])
+
+        if not isinstance(data, dict) or not isinstance(data.get('run', None), str):
+            log.fatal("{d} step {i} needs a 'run' command".format(d=description, i=index + 1))
+
+        depends_on = data.get('depends_on', [])
+        if isinstance(depends_on, str):
+            depends_on = [depends_on]
+        if not isinstance(depends_on, list):
+            log.fatal("{d} step {i} - 'depends_on' is not a list".format(d=description, i=index + 1))
+
+        return Step(str(data.get('name', "step{}".format(index + 1))), data['run'], [str(d) for d in depends_on])
+
+
+class ActionPlan:
+    '''The steps of a pre/post action or of an action, checked once when wtsrc.yml is loaded'''
+
+    def __init__(self, description:str, steps:list):
+        self.description = description
+        self.steps = steps
+        self.check()
+
+
+    @classmethod
+    def create_from_data(cls, description:str, data):
+        '''data is the single command string wtsrc.yml always allowed or a list of steps'''
+        if data is None:
+            return None
+        if isinstance(data, str):
+            return ActionPlan(description, [Step("step1", data, [])])
+        if isinstance(data, list) and data:
+            return ActionPlan(description, [Step.create_from_data(description, i, d) for i, d in enumerate(data)])
+        log.fatal("{d} must be a command or a list of steps in {f}".format(d=description, f=WTSRC_FILE))
+
+
+    def check(self):
+        '''Makes sure the names are unique, the dependencies exist and there is no cycle'''
+        names = {}
+        for step in self.steps:
+            if step.name in names:
+                log.fatal("{d} has more than one step named '{s}'".format(d=self.description, s=step.name))
+            names[step.name] = step
+
+        for step in self.steps:
+            for dependency in step.depends_on:
+                if dependency not in names:
+                    log.fatal("{d} step '{s}' depends on unknown step '{u}'".format(d=self.description, s=step.name, u=dependency))
+
+        # order the steps so every step comes after what it depends on
+        self.ordered = []
+        state = {}
+
+        def visit(step, path):
+            if state.get(step.name) == 'done':
+                return
+            if state.get(step.name) == 'visiting':
+                log.fatal("{d} has a dependency cycle: {c}".format(d=self.description, c=" -> ".join(path + [step.name])))
+            state[step.name] = 'visiting'
+            for dependency in step.depends_on:
+                visit(names[dependency], path + [step.name])
+            state[step.name] = 'done'
+            self.ordered.append(step)
+
+        for step in self.steps:
+            visit(step, [])
+
+
+    def is_single_command(self):
+        return len(self.steps) == 1
+
+
+    def __str__(self):
+        if self.is_single_command():
+            return self.steps[0].run
+        return ", ".join(step.name for step in self.steps)
+
+
+    def log(self):
+        for step in self.steps:
+            after = " (after {})".format(", ".join(step.depends_on)) if step.depends_on else ""
+            log.print("{n}: {r}{a}".format(n=step.name, r=step.run, a=after))
+
+
+    def execute(self, cwd, jobs=DEFAULT_JOBS, capture=False):
+        '''Runs the steps in cwd, independent ones at the same time, returns (True when all succeeded, output)
+
+        A single command keeps the terminal so it can be interactive unless capture is set, then its output is
+        shown and also returned. The output of concurrent steps is always buffered and printed as one block per step.
+        '''
+        from wtsrc.WtsrcAsync import Executor, run_attached, run_sync
+
+        executor = Executor(jobs)
+        if self.is_single_command():
+            result = run_attached(self.steps[0].run, cwd=cwd, executor=executor, capture=capture)
+            return result.exit_code == 0, result.output
+
+        return run_sync(self.run_steps(cwd, executor))
+
+
+    async def run_steps(self, cwd, executor):
+        import asyncio
+
+        tasks = {}
+        blocks = []
+
+        def log_block(lines, color):
+            blocks.append(lines[0])
+            blocks.extend("    " + line for line in lines[1:])
+            with log.batch():
+                log.print(lines[0], color=color)
+                log.increase_indent()
+                for line in lines[1:]:
+                    log.print(line)
+                log.decrease_indent()
+
+        async def run_step(step):
+            # awaiting the dependency tasks means a failure is seen by every step after it
+            for dependency in step.depends_on:
+                if not await tasks[dependency]:
+                    log.warning("{s} skipped because {d} failed".format(s=step.name, d=dependency))
+                    return False
+
+            result = await executor.run(step.run, cwd=cwd)
+            succeeded = result.exit_code == 0
+            if log.is_json():
+                log.event('step', action=self.description, step=step.name, command=step.run,
+                          exit_code=result.exit_code, duration=round(result.duration, 3), output=result.output)
+                blocks.append(result.output)
+                return succeeded
+
+            heading = "* {n}: {r} ({t:.2f}s)".format(n=step.name, r=step.run, t=result.duration)
+            log_block([heading] + result.output.splitlines(), 'green' if succeeded else 'red')
+            return succeeded
+
+        for step in self.ordered:
+            tasks[step.name] = asyncio.ensure_future(run_step(step))
+
+        results = await asyncio.gather(*tasks.values())
+        return all(results), "\n".join(blocks) + "\n"
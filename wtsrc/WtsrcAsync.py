@@ -0,0 +1,174 @@
+import asyncio
+import codecs
+import contextvars
+import os
+import signal
+import time
+import wtsrc.WtsrcLogger as log
+import wtsrc.WtsrcTrace as trace
+from wtsrc.WtsrcProcess import READ_SIZE, BufferSink
+from wtsrc.WtsrcSettings import DEFAULT_JOBS
+
+
+class CommandResult:
+    '''The outcome of a command run by the Executor'''
+
+    def __init__(self, exit_code, output, duration, timed_out=False):
+        self.exit_code = exit_code
+        self.output = output
+        self.duration = duration
+        self.timed_out = timed_out
+
+
+class Executor:
+    '''Runs commands as asyncio subprocesses with an explicit cwd, at most jobs of them at the same time'''
+
+    def __init__(self, jobs=DEFAULT_JOBS):
+        self.jobs = max(1, jobs)
+        self.semaphore = None
+        self.loop = None
+
+
+    def get_semaphore(self):
+        # every run_sync starts a new loop and a semaphore can only be used from the loop it was created in
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.semaphore = asyncio.Semaphore(self.jobs)
+            self.loop = loop
+        return self.semaphore
+
+
+    async def run(self, cmd, cwd=None, timeout=None, sinks=None, capture=True, keep_output=True, error_sinks=None):
+        '''Runs cmd (a shell string or an argument list) in cwd
+
+        With capture the merged stdout/stderr is decoded and handed to the sinks and returned in the result,
+        unless keep_output is off for output too big to keep in memory that the sinks take care of.
+        With error_sinks stderr goes to those instead, for output whose format stderr would break.
+        Without capture the command shares the terminal so it can be interactive.
+        A command that runs longer than timeout seconds is killed, so is one whose task gets cancelled.
+        '''
+        async with self.get_semaphore():
+            name = cmd if isinstance(cmd, str) else " ".join(cmd)
+            with trace.span(name, 'command', concurrent=True, cwd=os.path.abspath(cwd or os.curdir)):
+                start = time.perf_counter()
+                pipe = asyncio.subprocess.PIPE if capture else None
+                stderr = (pipe if error_sinks is not None else asyncio.subprocess.STDOUT) if capture else None
+                # captured commands get their own process group so a kill also reaches the children holding the pipe,
+                # interactive ones have to stay in the terminal's group to receive its input and ctrl-c
+                new_group = capture and os.name == 'posix'
+                if isinstance(cmd, str):
+                    spawn = asyncio.create_subprocess_shell(cmd, cwd=cwd, env=os.environ, stdout=pipe, stderr=stderr,
+                                                            start_new_session=new_group)
+                else:
+                    spawn = asyncio.create_subprocess_exec(*cmd, cwd=cwd, env=os.environ, stdout=pipe, stderr=stderr,
+                                                           start_new_session=new_group)
+                spawn = asyncio.ensure_future(spawn)
+                try:
+                    proc = await asyncio.shield(spawn)
+                except asyncio.CancelledError:
+                    # cancelled while the process was being started, it still has to be killed and waited for
+                    await self.kill(await spawn, new_group)
+                    raise
+
+                buffer = BufferSink()
+                sinks = list(sinks or []) + ([buffer] if keep_output else [])
+                error_sinks = list(error_sinks or []) + ([buffer] if keep_output else [])
+                try:
+                    await asyncio.wait_for(self.communicate(proc, sinks, capture, error_sinks), timeout)
+                except asyncio.TimeoutError:
+                    await self.kill(proc, new_group)
+                    return CommandResult(None, buffer.getvalue(), time.perf_counter() - start, timed_out=True)
+                except asyncio.CancelledError:
+                    await self.kill(proc, new_group)
+                    raise
+                finally:
+                    # a file sink has to be flushed and closed, whatever the command ended with
+                    for sink in set(sinks + error_sinks):
+                        sink.close()
+
+                return CommandResult(proc.returncode, buffer.getvalue(), time.perf_counter() - start)
+
+
+    @staticmethod
+    async def communicate(proc, sinks, capture, error_sinks):
+        if capture:
+            streams = [Executor.read_stream(proc.stdout, sinks)]
+            if proc.stderr:
+                streams.append(Executor.read_stream(proc.stderr, error_sinks))
+            await asyncio.gather(*streams)
+        await proc.wait()
+
+
+    @staticmethod
+    async def read_stream(stream, sinks):
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        while True:
+            chunk = await stream.read(READ_SIZE)
+            text = decoder.decode(chunk, final=not chunk)
+            if text:
+                for sink in sinks:
+                    sink.write(text)
+            if not chunk:
+                break
+
+
+    @staticmethod
+    async def kill(proc, group):
+        if proc.returncode is None:
+            try:
+                if group:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                else:
+                    proc.kill()
+            except ProcessLookupError:
+                pass
+            await proc.wait()
+
+
+# the executor of the module level run, run_sync gives every call its own so calls running at the same time
+# (in the daemon's threads or in the tests) never change each other's limit
+current_executor = contextvars.ContextVar('current_executor', default=None)
+
+# used by run outside of run_sync
+default_executor = Executor()
+
+
+def get_executor():
+    return current_executor.get() or default_executor
+
+
+async def run(cmd, cwd=None, timeout=None, sinks=None, capture=True, keep_output=True, error_sinks=None):
+    '''Runs the command on the executor of the current run_sync call, see Executor.run'''
+    return await get_executor().run(cmd, cwd=cwd, timeout=timeout, sinks=sinks, capture=capture,
+                                    keep_output=keep_output, error_sinks=error_sinks)
+
+
+def run_sync(coro, jobs=DEFAULT_JOBS):
+    '''Runs a coroutine to completion from the synchronous click commands
+
+    The commands it runs through the module level run get an executor of their own that lets jobs of them run at once.
+    '''
+    async def with_executor():
+        # the tasks it starts copy the context, so they all share this executor
+        current_executor.set(Executor(jobs))
+        return await coro
+
+    return asyncio.run(with_executor())
+
+
+def run_attached(cmd, cwd=None, executor=None, capture=False):
+    '''Runs one command for the user to watch and returns its CommandResult
+
+    The command gets the terminal unless capture is set, or the log format is json where its output becomes events.
+    '''
+    from wtsrc.WtsrcProcess import TerminalSink
+
+    log.print("Running Command: ", nl=False)
+    log.print(cmd, 'green')
+    executor = executor or get_executor()
+    if capture or log.is_json():
+        result = run_sync(executor.run(cmd, cwd=cwd, sinks=[TerminalSink(source=cmd)]))
+    else:
+        result = run_sync(executor.run(cmd, cwd=cwd, capture=False))
+    log.event('command', command=cmd, cwd=cwd, exit_code=result.exit_code, duration=round(result.duration, 3))
+    return result
@@ -0,0 +1,136 @@
+import time
+import wtsrc.WtsrcLogger as log
+from wtsrc.WtsrcAsync import run, run_sync
+from wtsrc.WtsrcParallel import RepoResult, for_each_repo, sort_by_repo
+from wtsrc.WtsrcSettings import MANIFEST_FILE
+
+
+class RepoBranch:
+    '''Creates the configuration branch in one repo and remembers what it did so it can be undone'''
+
+    def __init__(self, repo, repo_dir, branch):
+        self.repo = repo
+        self.repo_dir = repo_dir
+        self.branch = branch
+        self.original = None
+        self.created = False
+        self.pushed = False
+        self.output = []
+
+
+    async def git(self, *args):
+        '''Runs a git command in the repo, keeps its output and returns True when it succeeded'''
+        result = await run(['git'] + list(args), cwd=self.repo_dir)
+        self.output.append("$ git {}".format(" ".join(args)))
+        self.output.append(result.output.rstrip())
+        return result.exit_code == 0
+
+
+    async def current_ref(self):
+        '''The branch that is checked out, or the sha when the head is detached'''
+        result = await run(['git', 'symbolic-ref', '--quiet', '--short', 'HEAD'], cwd=self.repo_dir)
+        if result.exit_code != 0:
+            result = await run(['git', 'rev-parse', 'HEAD'], cwd=self.repo_dir)
+        return result.output.strip() if result.exit_code == 0 else None
+
+
+    async def create(self, push=True):
+        self.original = await self.current_ref()
+        self.created = await self.git('checkout', '-b', self.branch)
+        if self.created and push:
+            await self.push()
+        return self.created and (self.pushed or not push)
+
+
+    async def push(self):
+        self.pushed = await self.git('push', '--set-upstream', 'origin', self.branch)
+        return self.pushed
+
+
+    async def rollback(self):
+        '''Deletes the branch on the remote and locally and goes back to the original branch'''
+        ok = True
+        if self.pushed:
+            ok = await self.git('push', 'origin', '--delete', self.branch) and ok
+        if self.created:
+            if self.original:
+                ok = await self.git('checkout', self.original) and ok
+            ok = await self.git('branch', '-D', self.branch) and ok
+        return ok
+
+
+    def result(self, succeeded, start):
+        return RepoResult(self.repo, 0 if succeeded else 1, "\n".join(self.output), time.perf_counter() - start,
+                          command='create-config')
+
+
+class ConfigTransaction:
+    '''Branches and pushes a set of repos concurrently, then the manifest - everything is undone if any step fails'''
+
+    def __init__(self, repos, branch, jobs):
+        self.repos = repos
+        self.branch = branch
+        self.jobs = jobs
+        self.repo_branches = {}
+
+
+    async def create_in_repo(self, repo, repo_dir):
+        start = time.perf_counter()
+        repo_branch = RepoBranch(repo, repo_dir, self.branch)
+        self.repo_branches[repo] = repo_branch
+        return repo_branch.result(await repo_branch.create(), start)
+
+
+    async def rollback_repo(self, repo, repo_dir):
+        start = time.perf_counter()
+        repo_branch = self.repo_branches[repo]
+        return repo_branch.result(await repo_branch.rollback(), start)
+
+
+    def create_branches(self):
+        '''Creates and pushes the branch in every repo at the same time, returns the repos that failed'''
+        results = sort_by_repo(for_each_repo(self.repos, self.create_in_repo, self.jobs), self.repos)
+        for result in results:
+            if result.succeeded():
+                log.print("Created {b} in {r} ({t:.2f}s)".format(b=self.branch, r=result.repo, t=result.duration))
+            else:
+                result.log()
+        return [r.repo for r in results if not r.succeeded()]
+
+
+    def commit_manifest(self, manifest, manifest_dir):
+        '''Branches the manifest repo, saves the updated manifest and pushes it'''
+        repo_branch = RepoBranch('manifest', manifest_dir, self.branch)
+        self.repo_branches['manifest'] = repo_branch
+
+        async def commit():
+            ok = await repo_branch.create(push=False)
+            if ok:
+                for repo in self.repos:
+                    manifest.update_branch(repo, self.branch)
+                manifest.save()
+                ok = (await repo_branch.git('add', MANIFEST_FILE)
+                      and await repo_branch.git('commit', '-m', 'creating configuration {0}'.format(self.branch))
+                      and await repo_branch.push())
+                if not ok:
+                    # put back the manifest file the failed commit left in the working tree
+                    await repo_branch.git('checkout', 'HEAD', '--', MANIFEST_FILE)
+            return ok
+
+        ok = run_sync(commit())
+        if not ok:
+            repo_branch.result(False, time.perf_counter()).log()
+        return ok
+
+
+    def rollback(self):
+        '''Undoes every branch that was created, including the manifest'''
+        log.warning("Rolling back the branch {b} in {n} repos".format(b=self.branch, n=len(self.repo_branches)))
+        if 'manifest' in self.repo_branches:
+            run_sync(self.repo_branches['manifest'].rollback())
+
+        repos = [repo for repo in self.repos if repo in self.repo_branches]
+        for result in for_each_repo(repos, self.rollback_repo, self.jobs):
+            if not result.succeeded():
+                log.warning("Could not fully roll back {r}, check it by hand".format(r=result.repo))
+                result.log()
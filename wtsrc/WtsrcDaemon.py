@@ -0,0 +1,255 @@
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+import wtsrc.WtsrcLogger as log
+from wtsrc.WtsrcSettings import (CONFIG_FILE, DAEMON_LOG_FILE, DAEMON_SOCKET, DAEMON_TIMEOUT, DEFAULT_JOBS,
+                                 MANIFEST_DIRECTORY, MANIFEST_FILE, TSRC_DIRECTORY, WTSRC_FILE)
+from wtsrc.WtsrcUtils import find_project_root
+
+# bump when a request or response changes, a client and daemon that don't agree leave each other alone
+PROTOCOL_VERSION = 1
+
+
+def socket_path(root):
+    # relative to the cwd when that is shorter, unix socket paths can only be about 100 bytes long
+    path = os.path.join(root, DAEMON_SOCKET)
+    relative = os.path.relpath(path)
+    return relative if len(relative) < len(path) else path
+
+
+def request(name, **args):
+    '''Sends a request to the daemon of the workspace, returns its response or None when no daemon answered'''
+    root = find_project_root()
+    if not root or not hasattr(socket, 'AF_UNIX') or not os.path.exists(os.path.join(root, DAEMON_SOCKET)):
+        return None
+
+    message = dict(args, request=name, version=PROTOCOL_VERSION)
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(DAEMON_TIMEOUT)
+            client.connect(socket_path(root))
+            client.sendall(json.dumps(message).encode('utf-8') + b"\n")
+            with client.makefile('rb') as reader:
+                response = json.loads(reader.readline() or b'null')
+    except (OSError, ValueError) as e:
+        # a daemon that stopped without removing its socket
+        log.perhaps_print("The wtsrc daemon did not answer: {}".format(e))
+        return None
+
+    if not isinstance(response, dict) or 'error' in response:
+        log.perhaps_print("The wtsrc daemon could not answer: {}".format(response and response.get('error')))
+        return None
+    return response
+
+
+def status_to_dict(status):
+    return dict(vars(status))
+
+
+def status_from_dict(data):
+    from wtsrc.WtsrcGitStatus import RepoStatus
+    status = RepoStatus(data['repo'])
+    status.__dict__.update(data)
+    return status
+
+
+def query_status(repos=None):
+    '''The RepoStatus of the repos (all and the manifest without repos) from the daemon, or None'''
+    response = request('status', repos=repos)
+    if response is None:
+        return None
+    return [status_from_dict(data) for data in response['statuses']]
+
+
+def query_selection(groups, matches, excludes, dirty, changed_since, include_manifest):
+    '''The repos and warnings of the repo selection from the daemon, or None'''
+    response = request('select', groups=list(groups), matches=list(matches), excludes=list(excludes), dirty=dirty,
+                       changed_since=changed_since, include_manifest=include_manifest)
+    if response is None:
+        return None
+    return response['repos'], response['warnings']
+
+
+class WorkspaceState:
+    '''What the daemon keeps between requests: the models, the status cache and the status of every repo
+
+    With inotify the status of a repo is answered from memory until something in it changes, without it every
+    request asks the status cache, which saves the git status of repos whose files look the same.
+    '''
+
+    def __init__(self, root, jobs):
+        from wtsrc.WtsrcInotify import Watcher
+        from wtsrc.WtsrcStatusCache import StatusCache
+        self.root = root
+        self.jobs = jobs
+        self.cache = StatusCache.for_workspace()
+        self.statuses = {}
+        self.requests = 0
+        self.watcher = Watcher.create()
+        if self.watcher:
+            self.watcher.watch_dir('models', os.path.join(root, TSRC_DIRECTORY), names=[CONFIG_FILE])
+            self.watcher.watch_dir('models', os.path.join(root, MANIFEST_DIRECTORY), names=[MANIFEST_FILE, WTSRC_FILE])
+
+
+    def manifest(self):
+        '''The manifest, parsed again only after manifest.yml or config.yml changed'''
+        from wtsrc.ManifestModel import ManifestModel
+        from wtsrc.TsrcConfigModel import TsrcConfigModel
+        from wtsrc.WtsrcUtils import invalidate_workspace_context
+        if not self.watcher or self.watcher.take(['models']):
+            ManifestModel.instance = None
+            TsrcConfigModel.instance = None
+            invalidate_workspace_context()
+        return ManifestModel.load()
+
+
+    def read_statuses(self, repos):
+        '''Returns the status of the repos in order, running git only in the ones that changed'''
+        from wtsrc.WtsrcGitStatus import read_status
+        from wtsrc.WtsrcParallel import for_each_repo
+        from wtsrc.WtsrcUtils import repo_directory
+
+        if self.watcher:
+            changed = self.watcher.take(repos)
+            stale = [r for r in repos if r in changed or r not in self.statuses or not self.watcher.is_watched(r)]
+            # watched before git status runs, so a change made while it runs is seen the next time
+            for repo in stale:
+                if not self.watcher.is_watched(repo):
+                    self.watcher.watch_repo(repo, repo_directory(self.root, repo))
+            self.watcher.take(stale)
+        else:
+            stale = list(repos)
+
+        if stale:
+            async def read(repo, repo_dir):
+                # git writing the index would look like a change to the watcher and the repo would be read every time
+                return await read_status(repo, repo_dir, cache=self.cache, optional_locks=False)
+
+            for status in for_each_repo(stale, read, self.jobs):
+                self.statuses[status.repo] = status
+        return [self.statuses[repo] for repo in repos]
+
+
+    def select(self, message):
+        from wtsrc.WtsrcRepoSelector import RepoSelector, has_changes
+        selector = RepoSelector(message['groups'], message['matches'], message['excludes'], message['dirty'],
+                                message['changed_since'])
+        repos = selector.candidates(self.manifest(), message['include_manifest'])
+        if selector.dirty:
+            # the statuses kept here answer it, the selector would run git status
+            repos = [status.repo for status in self.read_statuses(repos) if has_changes(status)]
+            selector.dirty = False
+        repos = selector.filter(repos, self.jobs)
+        return {'repos': repos, 'warnings': selector.warnings}
+
+
+    def handle(self, message):
+        self.requests += 1
+        name = message.get('request')
+        if message.get('version') != PROTOCOL_VERSION:
+            return {'error': "the daemon speaks version {}".format(PROTOCOL_VERSION)}
+        if name == 'ping':
+            return {'pid': os.getpid(), 'root': self.root, 'inotify': self.watcher is not None,
+                    'repos': len(self.statuses), 'requests': self.requests}
+        if name == 'status':
+            repos = message.get('repos')
+            if repos is None:
+                repos = self.manifest().get_repo_dests() + ['manifest']
+            return {'statuses': [status_to_dict(status) for status in self.read_statuses(repos)]}
+        if name == 'select':
+            return self.select(message)
+        return {'error': "unknown request '{}'".format(name)}
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    '''One json request per connection, answered with one json line'''
+
+    def handle(self):
+        start = time.perf_counter()
+        message = None
+        try:
+            message = json.loads(self.rfile.readline())
+            if message.get('request') == 'stop':
+                response = {'pid': os.getpid()}
+                threading.Thread(target=self.server.shutdown).start()
+            else:
+                response = self.server.state.handle(message)
+        except SystemExit:
+            # log.fatal, like for a manifest that can't be read
+            response = {'error': "the request failed, see {}".format(DAEMON_LOG_FILE)}
+        except Exception as e:
+            log.warning("The request failed: {}".format(e))
+            response = {'error': str(e)}
+        self.wfile.write(json.dumps(response).encode('utf-8') + b"\n")
+        log.perhaps_print("{r} answered in {t:.1f}ms".format(r=message.get('request') if isinstance(message, dict) else '?',
+                                                             t=(time.perf_counter() - start) * 1000))
+
+
+def serve(jobs=DEFAULT_JOBS):
+    '''Runs the daemon of the workspace in this process until it is stopped'''
+    import signal
+
+    root = find_project_root()
+    if not root:
+        log.fatal("You must call from within a tsrc directory")
+    if not hasattr(socket, 'AF_UNIX'):
+        log.fatal("The daemon needs unix domain sockets, which this python doesn't have")
+    running = request('ping')
+    if running:
+        log.fatal("The daemon of this workspace is already running (pid {})".format(running['pid']))
+
+    os.chdir(root)
+    if os.path.exists(DAEMON_SOCKET):
+        # left behind by a daemon that didn't stop cleanly
+        os.remove(DAEMON_SOCKET)
+
+    state = WorkspaceState(root, jobs)
+    start = time.perf_counter()
+    # every repo is read and watched before the socket exists, so clients use the daemon once it is warm
+    state.read_statuses(state.manifest().get_repo_dests() + ['manifest'])
+    log.print("Read {n} repos in {t:.1f}s, {w}".format(
+        n=len(state.statuses), t=time.perf_counter() - start,
+        w="watching them with inotify" if state.watcher else "inotify is not available, using the status cache"))
+
+    old_umask = os.umask(0o077)
+    try:
+        server = socketserver.UnixStreamServer(DAEMON_SOCKET, RequestHandler)
+    finally:
+        os.umask(old_umask)
+    server.state = state
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    log.print("Listening on {s} (pid {p})".format(s=os.path.join(root, DAEMON_SOCKET), p=os.getpid()))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            os.remove(DAEMON_SOCKET)
+        except OSError:
+            pass
+        state.cache.save()
+        log.print("Stopped after {} requests".format(state.requests))
+
+
+def start_in_background(jobs):
+    '''Starts the daemon as a detached process writing to the daemon log, returns its pid'''
+    import subprocess
+    root = find_project_root()
+    if not root:
+        log.fatal("You must call from within a tsrc directory")
+    with open(os.path.join(root, DAEMON_LOG_FILE), 'a') as log_file:
+        process = subprocess.Popen([sys.executable, '-m', 'wtsrc.WtsrcDaemon', str(jobs)], cwd=root,
+                                   stdin=subprocess.DEVNULL, stdout=log_file, stderr=subprocess.STDOUT,
+                                   start_new_session=True)
+    return process.pid
+
+
+if __name__ == '__main__':
+    # the process started by start_in_background
+    serve(int(sys.argv[1]))
@@ -0,0 +1,160 @@
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import threading
+import click
+import wtsrc.WtsrcLogger as log
+from wtsrc.WtsrcAsync import run
+from wtsrc.WtsrcParallel import RepoResult, for_each_repo
+from wtsrc.WtsrcProcess import SpoolSink
+from wtsrc.WtsrcSettings import DIFF_SPILL_BYTES
+
+
+class DiffResult(RepoResult):
+    '''The outcome of git diff in one repo, the diff itself is in the spool instead of the output'''
+
+    def __init__(self, repo, exit_code, output, duration, spool=None):
+        super().__init__(repo, exit_code, output, duration, command='git diff')
+        self.spool = spool
+
+
+    def is_empty(self):
+        return self.succeeded() and (self.spool is None or self.spool.size == 0)
+
+
+    def text(self):
+        return self.output + ("".join(self.spool.chunks()) if self.spool else "")
+
+
+async def diff_repo(repo, repo_dir, args):
+    if not os.path.isdir(repo_dir):
+        return DiffResult(repo, None, "The repo path '{}' was not found\n".format(repo_dir), 0.0)
+
+    spool = SpoolSink(DIFF_SPILL_BYTES)
+    # a big diff goes to a temporary file instead of staying in memory until the pager takes it
+    result = await run(['git', 'diff'] + args, cwd=repo_dir, sinks=[spool], keep_output=False)
+    return DiffResult(repo, result.exit_code, "", result.duration, spool)
+
+
+def pager_command():
+    '''The pager git would use, or None when there is none to start'''
+    pager = os.environ.get('GIT_PAGER') or os.environ.get('PAGER')
+    if pager is None:
+        pager = 'less' if shutil.which('less') else None
+    return None if pager in (None, '', 'cat') else pager
+
+
+class DiffWriter:
+    '''Writes the diffs of the repos to one pager (or stdout) from its own thread
+
+    The repos keep running into their spools while the user is still reading what the pager shows.
+    '''
+
+    def __init__(self, use_pager, color):
+        self.color = color
+        self.process = None
+        self.out = sys.stdout
+        self.closed = False
+        self.written = 0
+        pager = pager_command() if use_pager else None
+        if pager:
+            env = dict(os.environ)
+            # like git: quit when it fits on the screen, pass the colors and don't clear the screen
+            env.setdefault('LESS', 'FRX')
+            try:
+                self.process = subprocess.Popen(pager, shell=True, stdin=subprocess.PIPE, env=env, encoding='utf-8',
+                                                errors='replace')
+                self.out = self.process.stdin
+            except OSError as e:
+                log.perhaps_print("The pager '{p}' could not be started: {e}".format(p=pager, e=e))
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.write_all, name='diff writer', daemon=True)
+        self.thread.start()
+
+
+    def add(self, result):
+        self.queue.put(result)
+
+
+    def write_all(self):
+        while True:
+            result = self.queue.get()
+            if result is None:
+                return
+            try:
+                if not self.closed and not result.is_empty():
+                    self.write(result)
+            except (BrokenPipeError, OSError):
+                # the user quit the pager, the rest is thrown away
+                self.closed = True
+            finally:
+                if result.spool:
+                    result.spool.discard()
+
+
+    def write(self, result):
+        header = "* {}\n".format(result.repo)
+        if self.color:
+            header = click.style(header, fg='green' if result.succeeded() else 'red', bold=True)
+        with log.lock:
+            self.out.write(header)
+            self.out.write(result.output)
+            if result.spool:
+                for text in result.spool.chunks():
+                    self.out.write(text)
+            self.out.write("\n")
+            self.out.flush()
+        self.written += 1
+
+
+    def finish(self):
+        '''Waits until everything is written and the user closed the pager'''
+        self.queue.put(None)
+        self.thread.join()
+        if self.process:
+            try:
+                self.process.stdin.close()
+            except (BrokenPipeError, OSError):
+                pass
+            self.process.wait()
+
+
+def diff_repos(repos, args, jobs, use_pager=True):
+    '''Runs git diff in the repos at the same time, each diff is shown as soon as it is done, the manifest's last
+
+    Returns the results of the repos where git diff failed.
+    '''
+    if log.is_json():
+        def on_result(result):
+            log.event('diff', repo=result.repo, command=result.command, exit_code=result.exit_code,
+                      duration=round(result.duration, 3), output=result.text())
+            if result.spool:
+                result.spool.discard()
+
+        results = for_each_repo(repos, lambda repo, repo_dir: diff_repo(repo, repo_dir, args), jobs, on_result=on_result)
+        return [r for r in results if not r.succeeded()]
+
+    color = sys.stdout.isatty()
+    if color:
+        args = ['--color'] + args
+    writer = DiffWriter(use_pager and color, color)
+    held = []
+
+    def on_result(result):
+        if result.repo == 'manifest':
+            held.append(result)
+        else:
+            writer.add(result)
+
+    try:
+        results = for_each_repo(repos, lambda repo, repo_dir: diff_repo(repo, repo_dir, args), jobs, on_result=on_result)
+        for result in held:
+            writer.add(result)
+    finally:
+        writer.finish()
+
+    if not writer.written and not writer.closed:
+        log.print("No differences in {} repos".format(len(repos)), color='green')
+    return [r for r in results if not r.succeeded()]
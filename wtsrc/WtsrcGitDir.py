@@ -0,0 +1,132 @@
+import os
+import string
+
+HEX_DIGITS = set(string.hexdigits)
+
+
+def find_git_dir(repo_dir):
+    '''Returns the .git directory of the repo, following the gitdir: file of worktrees and submodules, or None'''
+    dot_git = os.path.join(repo_dir, '.git')
+    if os.path.isdir(dot_git):
+        return dot_git
+    try:
+        with open(dot_git, encoding='utf-8') as file:
+            line = file.readline().strip()
+    except OSError:
+        return None
+    if not line.startswith('gitdir: '):
+        return None
+    return os.path.normpath(os.path.join(repo_dir, line[len('gitdir: '):]))
+
+
+def find_common_dir(git_dir):
+    '''The directory holding the refs, which is not the git dir for a linked worktree'''
+    try:
+        with open(os.path.join(git_dir, 'commondir'), encoding='utf-8') as file:
+            return os.path.normpath(os.path.join(git_dir, file.readline().strip()))
+    except OSError:
+        return git_dir
+
+
+def is_object_id(text):
+    return len(text) in (40, 64) and all(c in HEX_DIGITS for c in text)
+
+
+def read_ref(common_dir, ref):
+    '''Returns the object id of a loose or packed ref, or None'''
+    try:
+        with open(os.path.join(common_dir, ref), encoding='utf-8') as file:
+            value = file.readline().strip()
+        return value if is_object_id(value) else None
+    except OSError:
+        pass
+
+    try:
+        with open(os.path.join(common_dir, 'packed-refs'), encoding='utf-8') as file:
+            for line in file:
+                if line.endswith(" " + ref + "\n"):
+                    value = line.split(" ", 1)[0]
+                    return value if is_object_id(value) else None
+    except OSError:
+        pass
+    return None
+
+
+def read_head(repo_dir):
+    '''Reads (sha, branch) of HEAD straight from the .git files, branch is None when detached
+
+    Returns None when the files can't answer it (no commit yet, reftable, symbolic refs to symbolic refs),
+    the caller should ask git then.
+    '''
+    git_dir = find_git_dir(repo_dir)
+    if not git_dir:
+        return None
+    try:
+        with open(os.path.join(git_dir, 'HEAD'), encoding='utf-8') as file:
+            head = file.readline().strip()
+    except OSError:
+        return None
+
+    if is_object_id(head):
+        return head, None
+    if not head.startswith('ref: '):
+        return None
+
+    ref = head[len('ref: '):]
+    sha = read_ref(find_common_dir(git_dir), ref)
+    if not sha:
+        return None
+    branch = ref[len('refs/heads/'):] if ref.startswith('refs/heads/') else None
+    return sha, branch
+
+
+def read_index(index_file):
+    '''Returns [(path, mtime_ns, size)] of the entries of a version 2 or 3 index, see gitformat-index(5)
+
+    Returns None for what is not worth reading here: version 4 (prefix compressed paths), conflicts, submodules,
+    split or sparse indexes and sha256 repos. Entries with skip-worktree set are left out, they have no file.
+    '''
+    import struct
+    try:
+        with open(index_file, 'rb') as file:
+            data = file.read()
+    except OSError:
+        return None
+
+    if len(data) < 12 or data[:4] != b'DIRC':
+        return None
+    version, count = struct.unpack_from('>II', data, 4)
+    if version not in (2, 3):
+        return None
+
+    # ctime, mtime, dev, ino, mode, uid, gid and size are 32 bit each, then the 20 byte object id and the flags
+    entry_header = struct.Struct('>8xII8xI8xI20xH')
+    entries = []
+    offset = 12
+    for _ in range(count):
+        if offset + entry_header.size > len(data):
+            return None
+        mtime_s, mtime_ns, mode, size, flags = entry_header.unpack_from(data, offset)
+        name_offset = offset + entry_header.size
+        extended = flags & 0x4000
+        skip_worktree = False
+        if extended:
+            extra = struct.unpack_from('>H', data, name_offset)[0]
+            skip_worktree = bool(extra & 0x4000)
+            name_offset += 2
+        name_end = data.index(b'\0', name_offset)
+        path = data[name_offset:name_end].decode('utf-8', errors='surrogateescape')
+        # entries are padded with 1 to 8 nul bytes to a multiple of 8
+        offset += ((name_end - offset) // 8 + 1) * 8
+
+        stage = (flags >> 12) & 0x3
+        if stage != 0 or mode == 0o160000 or (mode & 0o170000) == 0o040000:
+            # conflicts, submodules and the directories of a sparse index
+            return None
+        if not skip_worktree:
+            entries.append((path, mtime_s * 1000000000 + mtime_ns, size))
+
+    if data[offset:offset + 4] == b'link':
+        # a split index keeps most entries in a shared file
+        return None
+    return entries
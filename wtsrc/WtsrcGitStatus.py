@@ -0,0 +1,131 @@
+import asyncio
+import os
+import time
+import wtsrc.WtsrcLogger as log
+from wtsrc.WtsrcAsync import run
+
+
+class RepoStatus:
+    '''The parsed result of git status --porcelain=v2 --branch for one repo'''
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.branch = None
+        self.upstream = None
+        self.ahead = 0
+        self.behind = 0
+        self.staged = 0
+        self.unstaged = 0
+        self.untracked = 0
+        self.conflicts = 0
+        self.error = None
+        # untracked directories are listed as one entry, the status cache watches them for files coming and going
+        self.untracked_dirs = []
+
+
+    def is_clean(self):
+        return (self.error is None and self.ahead == 0 and self.behind == 0 and self.staged == 0
+                and self.unstaged == 0 and self.untracked == 0 and self.conflicts == 0)
+
+
+    def parse(self, output:str):
+        '''Reads the porcelain v2 lines, see git-status(1)'''
+        for line in output.splitlines():
+            if line.startswith('# branch.head '):
+                self.branch = line[len('# branch.head '):]
+            elif line.startswith('# branch.upstream '):
+                self.upstream = line[len('# branch.upstream '):]
+            elif line.startswith('# branch.ab '):
+                ahead, behind = line[len('# branch.ab '):].split(' ')
+                self.ahead = int(ahead)
+                self.behind = -int(behind)
+            elif line.startswith('1 ') or line.startswith('2 '):
+                xy = line[2:4]
+                if xy[0] != '.':
+                    self.staged += 1
+                if xy[1] != '.':
+                    self.unstaged += 1
+            elif line.startswith('u '):
+                self.conflicts += 1
+            elif line.startswith('? '):
+                self.untracked += 1
+                if line.endswith('/'):
+                    self.untracked_dirs.append(line[2:])
+        return self
+
+
+async def read_status(repo, repo_dir, cache=None, fsmonitor=False, optional_locks=True):
+    '''Returns the parsed RepoStatus, from the cache when the repo didn't change since the last run
+
+    git status always runs with the untracked cache, and with the builtin fsmonitor when asked for.
+    Without optional_locks git doesn't write the refreshed index back, the daemon watching the repo would see that.
+    '''
+
+    status = RepoStatus(repo)
+    if not os.path.isdir(repo_dir):
+        status.error = "missing"
+        return status
+
+    loop = asyncio.get_running_loop()
+    if cache:
+        # the fingerprint stats every tracked file, that happens in a thread so the other repos carry on
+        cached = await loop.run_in_executor(None, cache.lookup, repo, repo_dir)
+        if cached:
+            return cached
+
+    options = [] if optional_locks else ['--no-optional-locks']
+    options += ['-c', 'core.untrackedCache=true']
+    if fsmonitor:
+        options += ['-c', 'core.fsmonitor=true']
+    started = time.time()
+    result = await run(['git'] + options + ['status', '--porcelain=v2', '--branch'], cwd=repo_dir)
+    if result.exit_code != 0:
+        status.error = result.output.strip() or "git status failed"
+        return status
+
+    status.parse(result.output)
+    if cache:
+        await loop.run_in_executor(None, cache.store, repo, repo_dir, status, started)
+    return status
+
+
+def log_status_table(statuses, show_clean=False):
+    '''Prints one row per repo with the branch, ahead/behind and change counts'''
+
+    rows = [s for s in statuses if show_clean or not s.is_clean()]
+    hidden = len(statuses) - len(rows)
+
+    if log.is_json():
+        for s in rows:
+            log.event('status', repo=s.repo, command='git status', branch=s.branch, upstream=s.upstream, ahead=s.ahead,
+                      behind=s.behind, staged=s.staged, unstaged=s.unstaged, untracked=s.untracked,
+                      conflicts=s.conflicts, error=s.error)
+        return
+
+    with log.batch():
+        log_table(rows, hidden)
+
+
+def log_table(rows, hidden):
+
+    if rows:
+        headers = ("repo", "branch", "ahead/behind", "staged", "unstaged", "untracked")
+        table = []
+        for s in rows:
+            if s.error:
+                table.append((s.repo, s.error, "", "", "", ""))
+            else:
+                branch = s.branch if not s.conflicts else "{b} ({c} conflicts)".format(b=s.branch, c=s.conflicts)
+                ab = "+{a}/-{b}".format(a=s.ahead, b=s.behind) if s.upstream else "no upstream"
+                table.append((s.repo, branch, ab, str(s.staged), str(s.unstaged), str(s.untracked)))
+
+        widths = [max(len(row[i]) for row in table + [headers]) for i in range(len(headers))]
+        log.print("  ".join(h.ljust(w) for h, w in zip(headers, widths)), color='cyan')
+        for s, row in zip(rows, table):
+            color = 'red' if s.error or s.conflicts else 'yellow'
+            if s.is_clean():
+                color = 'reset'
+            log.print("  ".join(c.ljust(w) for c, w in zip(row, widths)).rstrip(), color=color)
+
+    if hidden:
+        log.print("{} clean repos not shown".format(hidden), color='green')
@@ -1,14 +1,31 @@
+import bisect
+import json
+import os
 import wtsrc.WtsrcLogger as log
-from wtsrc.WtsrcSettings import GLOBAL_MODEL_DIR, GLOBAL_MODEL_FILE
+from contextlib import contextmanager
+from wtsrc.WtsrcSettings import GLOBAL_MODEL_DIR, GLOBAL_MODEL_FILE, GLOBAL_MODEL_PICKLE_FILE
+from wtsrc.WtsrcUtils import atomic_write, lock_file
 from pathlib import Path
-import os
-import pickle
+
+# bump when the layout of the alias file changes
+MODEL_VERSION = 1
 
 
 class WtsrcGlobalModel:
+    '''The aliases for manifest urls, shared by every workspace of the user
+
+    They are stored as json and replaced atomically, so reading never needs a lock. Changes are made through update
+    which holds a lock file while the aliases are read, changed and written so concurrent changes are not lost.
+    '''
 
-    def __init__(self):
-        self.aliases = {}
+    instance = None
+
+
+    def __init__(self, aliases=None):
+        self.aliases = aliases or {}
+        self.names = None
+        # set when the aliases came from the pickle file and the alias file still has to be written
+        self.migrated = False
 
 
     def get_alias_url(self, alias_name):
@@ -19,12 +36,24 @@ class WtsrcGlobalModel:
             return None
 
 
+    def find_aliases(self, prefix):
+        '''returns the sorted names of the aliases that start with prefix'''
+        if self.names is None:
+            self.names = sorted(self.aliases)
+        start = bisect.bisect_left(self.names, prefix)
+        end = start
+        while end < len(self.names) and self.names[end].startswith(prefix):
+            end += 1
+        return self.names[start:end]
+
+
     def add_alias(self, alias_name, url):
         '''adds an alias if it doesn't exist, throws exception if the alias already exists'''
         if alias_name in self.aliases:
             log.fatal("Alias already exists, you should delete the alias first")
         else:
             self.aliases[alias_name] = url
+            self.names = None
 
 
     def remove_alias(self, alias_name):
@@ -32,39 +61,90 @@ class WtsrcGlobalModel:
         if alias_name not in self.aliases:
             log.warning("'{}' was not found, no changes were made".format(alias_name))
         self.aliases.pop(alias_name, None)
+        self.names = None
+
+
+    @classmethod
+    def model_dir(cls):
+        if GLOBAL_MODEL_DIR == "$HOME":
+            return str(Path.home())
+        return GLOBAL_MODEL_DIR
 
 
     @classmethod
     def model_file_name(cls):
         '''computes the model file name from the settings'''
-        if GLOBAL_MODEL_DIR == "$HOME":
-            model_dir = Path.home()
-        else:
-            model_dir = GLOBAL_MODEL_DIR
+        return os.path.join(WtsrcGlobalModel.model_dir(), GLOBAL_MODEL_FILE)
 
-        model_file = os.path.join(model_dir, GLOBAL_MODEL_FILE)
 
-        return model_file
+    @classmethod
+    def read(cls):
+        '''Reads the alias file, or migrates the pickle file older versions wrote when there is no alias file yet'''
+        model_file = WtsrcGlobalModel.model_file_name()
+        try:
+            with open(model_file, encoding='utf-8') as file:
+                data = json.load(file)
+            return WtsrcGlobalModel(data.get('aliases', {}))
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            log.fatal("The alias file {} is not valid json".format(model_file))
+
+        pickle_file = os.path.join(WtsrcGlobalModel.model_dir(), GLOBAL_MODEL_PICKLE_FILE)
+        if os.path.exists(pickle_file):
+            return WtsrcGlobalModel.migrate(pickle_file)
+        return WtsrcGlobalModel()
+
+
+    @classmethod
+    def migrate(cls, pickle_file):
+        '''Reads the aliases out of the pickle file, the pickle file is left as it is for older versions'''
+        import pickle
+        try:
+            with open(pickle_file, 'rb') as file:
+                old_model = pickle.load(file)
+            aliases = dict(getattr(old_model, 'aliases', {}))
+        except Exception as e:
+            log.warning("The aliases in {f} could not be migrated: {e}".format(f=pickle_file, e=e))
+            return WtsrcGlobalModel()
+
+        log.perhaps_print("Migrating {n} aliases from {f}".format(n=len(aliases), f=pickle_file))
+        model = WtsrcGlobalModel(aliases)
+        model.migrated = True
+        return model
 
 
     @classmethod
     def load(cls):
         '''Returns the persisted model'''
-        model_file = WtsrcGlobalModel.model_file_name()
+        if not WtsrcGlobalModel.instance:
+            model = WtsrcGlobalModel.read()
+            if model.migrated:
+                with lock_file(WtsrcGlobalModel.model_file_name() + '.lock'):
+                    if not os.path.exists(WtsrcGlobalModel.model_file_name()):
+                        model.save()
+            WtsrcGlobalModel.instance = model
+        return WtsrcGlobalModel.instance
 
-        if(os.path.exists(model_file)):
-            model = pickle.load(open(model_file, "rb"))
-        else:
-            model = WtsrcGlobalModel()
-            model.save()
 
-        return model
+    @classmethod
+    @contextmanager
+    def update(cls):
+        '''Yields the current model while holding the lock and saves it when the block finishes'''
+        model_file = WtsrcGlobalModel.model_file_name()
+        with lock_file(model_file + '.lock'):
+            # read again under the lock, another process may have changed the aliases since they were loaded
+            model = WtsrcGlobalModel.read()
+            yield model
+            model.save()
+        WtsrcGlobalModel.instance = model
 
 
     def save(self):
-        '''Saves by overwriting the model file'''
+        '''Saves by writing a new file and renaming it over the model file, only call while holding the lock'''
         model_file = WtsrcGlobalModel.model_file_name()
-        pickle.dump(self, open(model_file, "wb" ))
+        with atomic_write(model_file, encoding='utf-8') as file:
+            json.dump({'version': MODEL_VERSION, 'aliases': self.aliases}, file, indent=1, sort_keys=True)
 
 
     def __str__(self):
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import sys
+import time
+import click
+import wtsrc.WtsrcLogger as log
+import wtsrc.WtsrcTrace as trace
+from wtsrc.WtsrcAsync import run, run_sync
+from wtsrc.WtsrcParallel import RepoResult
+from wtsrc.WtsrcProcess import BufferSink
+from wtsrc.WtsrcUtils import find_project_root, repo_directory
+
+
+class GrepPrinter:
+    '''Prints the matches of every repo as repo/path:line:match while they arrive and stops at max_count'''
+
+    def __init__(self, max_count=None, names_only=False, color=False):
+        self.max_count = max_count
+        self.names_only = names_only
+        self.color = color
+        self.count = 0
+        # the grep of every repo, cancelled once max_count matches were printed
+        self.tasks = []
+
+
+    def is_done(self):
+        return self.max_count is not None and self.count >= self.max_count
+
+
+    def add(self, repo, record):
+        if self.is_done():
+            return
+        if self.names_only:
+            path, line, text = record, None, None
+        else:
+            path, line, text = (record.split('\0', 2) + [None, None])[:3]
+        path = repo + '/' + path if repo != 'manifest' else path
+        self.count += 1
+
+        if log.is_json():
+            log.event('match', repo=repo, path=path, line=int(line) if line else None, text=text)
+        elif self.names_only:
+            log.output((click.style(path, fg='magenta') if self.color else path) + "\n")
+        else:
+            if self.color:
+                path, line = click.style(path, fg='magenta'), click.style(line, fg='green')
+            log.output("{p}:{l}:{t}\n".format(p=path, l=line, t=text))
+
+        if self.is_done():
+            for task in self.tasks:
+                task.cancel()
+
+
+class GrepSink:
+    '''Splits the output of git grep -z into records and hands them to the printer'''
+
+    def __init__(self, repo, printer, ref):
+        self.repo = repo
+        self.printer = printer
+        # with a ref every path starts with ref:
+        self.prefix = ref + ':' if ref else ''
+        self.end = '\0' if printer.names_only else '\n'
+        self.pending = ''
+
+
+    def write(self, text):
+        records = (self.pending + text).split(self.end)
+        self.pending = records.pop()
+        for record in records:
+            if record.startswith(self.prefix):
+                record = record[len(self.prefix):]
+            self.printer.add(self.repo, record)
+
+
+    def close(self):
+        pass
+
+
+async def grep_repo(repo, repo_dir, args, ref, printer):
+    '''Runs git grep in the repo, exit code 1 is no match which is not a failure'''
+    start = time.perf_counter()
+    if not os.path.isdir(repo_dir):
+        return RepoResult(repo, None, "The repo path '{}' was not found".format(repo_dir), 0.0, command='git grep')
+
+    if ref:
+        exists = await run(['git', 'rev-parse', '--verify', '-q', ref + '^{tree}'], cwd=repo_dir)
+        if exists.exit_code != 0:
+            return RepoResult(repo, None, "{} does not exist".format(ref), time.perf_counter() - start, command='git grep')
+
+    sink = GrepSink(repo, printer, ref)
+    # stderr is kept apart, with -l nothing but the NUL would separate its lines from the file names
+    errors = BufferSink()
+    cmd = ['git', 'grep', '-z', '-I'] + args
+    result = await run(cmd, cwd=repo_dir, sinks=[sink], keep_output=False, error_sinks=[errors])
+    if result.exit_code not in (0, 1):
+        message = errors.getvalue().strip()
+        return RepoResult(repo, result.exit_code, message or "git grep failed", result.duration, command='git grep')
+    return RepoResult(repo, 0, "", time.perf_counter() - start, command='git grep')
+
+
+def grep_repos(repos, pattern, options, paths, jobs, ref=None, max_count=None):
+    '''Searches the repos at the same time, printing each match as soon as it is found
+
+    Returns (number of matches, results of the repos that could not be searched).
+    '''
+    root = find_project_root()
+    if not root:
+        log.fatal("You must call from within a tsrc directory")
+
+    names_only = '-l' in options
+    printer = GrepPrinter(max_count, names_only=names_only, color=sys.stdout.isatty() and not log.is_json())
+    args = list(options) + ([] if names_only else ['-n']) + ['-e', pattern] + ([ref] if ref else []) + ['--'] + list(paths)
+
+    async def grep_all():
+        printer.tasks = [asyncio.ensure_future(grep_repo(repo, repo_directory(root, repo), args, ref, printer))
+                         for repo in repos]
+        results = await asyncio.gather(*printer.tasks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException) and not isinstance(result, asyncio.CancelledError):
+                raise result
+        # the cancelled ones stopped because max_count was reached
+        return [r for r in results if not isinstance(r, asyncio.CancelledError)]
+
+    with trace.span("grep", 'phase', repos=len(repos), jobs=jobs):
+        results = run_sync(grep_all(), jobs=jobs)
+    return printer.count, [r for r in results if not r.succeeded()]
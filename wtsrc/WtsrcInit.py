@@ -0,0 +1,223 @@
+import os
+import shutil
+import time
+import wtsrc.WtsrcLogger as log
+from wtsrc.WtsrcAsync import run, run_sync
+from wtsrc.WtsrcMirror import add_user, lock_mirror, update_mirror
+from wtsrc.WtsrcParallel import RepoProgress, RepoResult, for_each_repo, sort_by_repo
+from wtsrc.WtsrcSettings import CONFIG_FILE, MANIFEST_DIRECTORY, TSRC_DIRECTORY
+
+
+class CloneOptions:
+    '''How the repos of the workspace are cloned'''
+
+    def __init__(self, shallow=False, blob_filter=None, sparse=None, mirror=False):
+        self.shallow = shallow
+        self.blob_filter = blob_filter
+        # clone with the host's mirror of each repo as reference
+        self.mirror = mirror
+        # the project model, asked for the sparse-checkout directories of each repo
+        self.sparse = sparse
+
+
+def clone_manifest(manifest_url, branch, root):
+    '''Clones the manifest into .tsrc/manifest and returns the branch it is on'''
+    from wtsrc.WtsrcGitDir import read_head
+
+    manifest_dir = os.path.join(root, MANIFEST_DIRECTORY)
+    cmd = ['git', 'clone', manifest_url, manifest_dir]
+    if branch:
+        cmd += ['--branch', branch]
+    result = run_sync(run(cmd, cwd=root))
+    if result.exit_code != 0:
+        log.print(result.output.rstrip())
+        log.fatal("The manifest {} could not be cloned".format(manifest_url))
+
+    head = read_head(manifest_dir)
+    return head[1] if head and head[1] else branch
+
+
+def write_config(root, manifest_url, manifest_branch, groups, shallow):
+    '''Writes .tsrc/config.yml with the fields tsrc's WorkspaceConfig expects, so tsrc can take over the workspace'''
+    import yaml
+    data = {
+        'manifest_url': manifest_url,
+        'manifest_branch': manifest_branch,
+        'repo_groups': list(groups),
+        'shallow_clones': shallow,
+        'clone_all_repos': False,
+        'singular_remote': None,
+    }
+    with open(os.path.join(root, TSRC_DIRECTORY, CONFIG_FILE), 'w') as file:
+        yaml.dump(data, file)
+
+
+def repos_to_clone(manifest, groups):
+    '''The dests tsrc would clone for the groups: their repos, else the 'default' group if there is one, else all'''
+    if not groups and 'default' in manifest.groups:
+        groups = ['default']
+    if not groups:
+        return manifest.get_repo_dests()
+
+    picked = set()
+    for group in groups:
+        picked.update(manifest.repos_in_group(group))
+    return [dest for dest in manifest.get_repo_dests() if dest in picked]
+
+
+def get_remotes(entry):
+    '''The (name, url) of the repo's remotes, the first one is cloned'''
+    remotes = [(remote['name'], remote['url']) for remote in entry.get('remotes') or []]
+    if 'url' in entry:
+        remotes.insert(0, ('origin', entry['url']))
+    return remotes
+
+
+async def clone_repo(repo, repo_dir, entry, options):
+    '''Clones the repo the way tsrc does, partially and sparsely when the options ask for it'''
+
+    start = time.perf_counter()
+    output = []
+
+    def finish(exit_code):
+        return RepoResult(repo, exit_code, "\n".join(o for o in output if o), time.perf_counter() - start,
+                          command='clone')
+
+    async def git(*args, cwd=repo_dir):
+        result = await run(['git'] + list(args), cwd=cwd)
+        output.append(result.output.rstrip())
+        return result.exit_code == 0
+
+    if os.path.exists(repo_dir):
+        output.append("already exists, not cloned")
+        return finish(0)
+
+    remotes = get_remotes(entry)
+    if not remotes:
+        output.append("The manifest has no url for the repo")
+        return finish(1)
+
+    sha1 = entry.get('sha1')
+    if sha1 and options.shallow:
+        output.append("A repo at a fixed sha1 cannot be cloned shallow")
+        return finish(1)
+
+    sparse_dirs = options.sparse.get_sparse_dirs(repo) if options.sparse else []
+    with_submodules = not entry.get('ignore_submodules', False)
+
+    name, url = remotes[0]
+    args = ['clone', '--origin', name, url]
+    ref = entry.get('tag') or entry.get('branch')
+    if ref:
+        args += ['--branch', ref]
+    if options.shallow:
+        args += ['--depth', '1']
+    if options.blob_filter:
+        args += ['--filter', options.blob_filter]
+    if sparse_dirs:
+        # nothing is checked out until the sparse-checkout directories are set
+        args.append('--no-checkout')
+    elif with_submodules:
+        args.append('--recurse-submodules')
+    parent, base = os.path.split(repo_dir)
+    os.makedirs(parent, exist_ok=True)
+    mirror_dir = await update_mirror(url, output) if options.mirror else None
+    if mirror_dir:
+        # the objects the mirror has are borrowed from it instead of being downloaded and stored again
+        async with lock_mirror(mirror_dir, shared=True):
+            cloned = await git(*(args + ['--reference', mirror_dir]), base, cwd=parent)
+            if cloned:
+                add_user(mirror_dir, repo_dir)
+    else:
+        cloned = await git(*args, base, cwd=parent)
+    if not cloned:
+        return finish(1)
+
+    if sparse_dirs:
+        if not (await git('sparse-checkout', 'set', '--cone', *sparse_dirs) and await git('read-tree', '-mu', 'HEAD')):
+            return finish(1)
+        if with_submodules and os.path.exists(os.path.join(repo_dir, '.gitmodules')):
+            if not await git('submodule', 'update', '--init', '--recursive'):
+                return finish(1)
+
+    for name, url in remotes[1:]:
+        if not await git('remote', 'add', name, url):
+            return finish(1)
+
+    if sha1 and not await git('reset', '--hard', sha1):
+        return finish(1)
+
+    if sparse_dirs:
+        output.append("sparse checkout of {}".format(", ".join(sparse_dirs)))
+    return finish(0)
+
+
+def clone_repos(manifest, repos, options, jobs):
+    '''Clones every repo with at most jobs at once and returns the results in manifest order'''
+
+    async def clone(repo, repo_dir):
+        return await clone_repo(repo, repo_dir, manifest.get_repo(repo), options)
+
+    progress = RepoProgress("Cloning", len(repos))
+    results = for_each_repo(repos, clone, jobs, on_result=progress.update)
+    log.end_progress()
+    return sort_by_repo(results, repos)
+
+
+def perform_file_operations(manifest, repos, root):
+    '''Does the copies and symlinks of the cloned repos that tsrc init does after cloning'''
+
+    for repo in repos:
+        entry = manifest.get_repo(repo)
+        for copy in entry.get('copy') or []:
+            source = os.path.join(root, repo, copy['file'])
+            dest = os.path.join(root, copy.get('dest', copy['file']))
+            try:
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                shutil.copy(source, dest)
+            except OSError as e:
+                log.warning("Could not copy {s} to {d}: {e}".format(s=source, d=dest, e=e))
+
+        for symlink in entry.get('symlink') or []:
+            link = os.path.join(root, symlink['source'])
+            try:
+                os.makedirs(os.path.dirname(link), exist_ok=True)
+                if os.path.islink(link):
+                    os.remove(link)
+                os.symlink(symlink['target'], link)
+            except OSError as e:
+                log.warning("Could not create the symlink {s}: {e}".format(s=link, e=e))
+
+
+def init_workspace(manifest_url, branch, groups, options, jobs):
+    '''Clones the manifest, writes the tsrc config and clones the repos of the groups in parallel'''
+    from wtsrc.ManifestModel import ManifestModel
+    from wtsrc.WtsrcParallel import log_summary
+    from wtsrc.WtsrcProjectModel import WtsrcProjectModel
+    from wtsrc.WtsrcUtils import invalidate_workspace_context
+
+    if not manifest_url:
+        log.fatal("The url of the manifest is needed, pass --alias or --url")
+    root = os.getcwd()
+    if os.path.exists(os.path.join(root, TSRC_DIRECTORY, CONFIG_FILE)):
+        log.fatal("The workspace is already configured, {} exists".format(os.path.join(TSRC_DIRECTORY, CONFIG_FILE)))
+
+    log.print("Cloning the manifest {}".format(manifest_url), color='green')
+    manifest_branch = clone_manifest(manifest_url, branch, root)
+    write_config(root, manifest_url, manifest_branch, groups, options.shallow)
+    # the workspace was just created so any lookups made before are stale
+    invalidate_workspace_context()
+
+    manifest = ManifestModel.load()
+    options.sparse = WtsrcProjectModel.load()
+    repos = repos_to_clone(manifest, groups)
+    log.print("Cloning {n} repos, {j} at a time".format(n=len(repos), j=jobs), color='green')
+    results = clone_repos(manifest, repos, options, jobs)
+    for result in results:
+        if not result.succeeded():
+            result.log()
+    failed = log_summary(results)
+
+    perform_file_operations(manifest, [r.repo for r in results if r.succeeded()], root)
+    if failed:
+        log.fatal("{} repos could not be cloned".format(len(failed)))
@@ -0,0 +1,212 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import sys
+import threading
+
+# the inotify(7) event bits
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW)
+
+EVENT_HEADER = struct.Struct('iIII')
+
+# a repo needing more watches than this is left to the status cache instead of using up the user's inotify watches
+MAX_WATCHES_PER_REPO = 20000
+
+# the files at the top of .git that change the status, git's lock and temporary files next to them don't
+GIT_STATUS_FILES = ['HEAD', 'index', 'packed-refs']
+
+
+def is_watched_path(repo_dir, path):
+    '''The work tree is watched except the .git directory, of which only the top (HEAD, index) and the refs are'''
+    rel = os.path.relpath(path, repo_dir).split(os.sep)
+    if rel[0] != '.git':
+        return True
+    return len(rel) == 1 or rel[1] == 'refs'
+
+
+def is_git_lock_file(path, name):
+    '''git writes a ref to ref.lock and renames it, only the rename matters'''
+    return name.endswith('.lock') and '.git' in path.split(os.sep)
+
+
+class Watcher:
+    '''Watches the directories of repos with inotify and remembers which repos had something change
+
+    The changes are only collected here, the daemon takes them before it decides which repos to look at again.
+    Only available on linux, create returns None elsewhere.
+    '''
+
+    def __init__(self, libc, fd):
+        self.libc = libc
+        self.fd = fd
+        # wd -> [key, path, names the key cares about or None for all]
+        self.watches = {}
+        self.repo_wds = {}
+        self.repo_dirs = {}
+        # the repos that needed too many watches, they are not tried again
+        self.too_big = set()
+        self.changed = set()
+        # reentrant because the reader thread watches new directories while it holds it
+        self.lock = threading.RLock()
+
+
+    @classmethod
+    def create(cls):
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        watcher = Watcher(libc, fd)
+        threading.Thread(target=watcher.read_events, name='inotify', daemon=True).start()
+        return watcher
+
+
+    def add_watch(self, key, path, names=None):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            return None
+        with self.lock:
+            self.watches.setdefault(wd, [])
+            self.watches[wd] = [w for w in self.watches[wd] if w[0] != key] + [(key, path, names)]
+        return wd
+
+
+    def remove_watch(self, key, wd):
+        with self.lock:
+            remaining = [w for w in self.watches.get(wd, []) if w[0] != key]
+            if remaining:
+                self.watches[wd] = remaining
+                return
+            self.watches.pop(wd, None)
+        # the same directory can be watched for two keys, the watch only goes when neither needs it
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+
+    def watch_dir(self, key, path, names=None):
+        '''Watches one directory, for changes to the files called names or to anything without names'''
+        return self.add_watch(key, path, names) is not None
+
+
+    def watch_repo(self, repo, repo_dir):
+        '''Watches every directory of the repo, returns False when it can't be watched'''
+        if repo in self.too_big or not os.path.isdir(os.path.join(repo_dir, '.git')):
+            # worktrees and submodules keep their git files elsewhere, the status cache looks after those
+            return False
+        with self.lock:
+            self.repo_dirs[repo] = repo_dir
+            self.repo_wds[repo] = []
+            if not self.watch_tree(repo, repo_dir):
+                self.unwatch_repo(repo)
+                self.too_big.add(repo)
+                return False
+        return True
+
+
+    def watch_tree(self, repo, top):
+        repo_dir = self.repo_dirs[repo]
+        stack = [top]
+        while stack:
+            path = stack.pop()
+            if len(self.repo_wds[repo]) >= MAX_WATCHES_PER_REPO:
+                return False
+            is_git_dir = os.path.relpath(path, repo_dir) == '.git'
+            wd = self.add_watch(repo, path, names=GIT_STATUS_FILES if is_git_dir else None)
+            if wd is None:
+                if ctypes.get_errno() in (errno.ENOENT, errno.ENOTDIR):
+                    # removed while walking, the event for that is already in
+                    continue
+                # ENOSPC when the user's max_user_watches are used up
+                return False
+            self.repo_wds[repo].append(wd)
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False) and is_watched_path(repo_dir, entry.path):
+                            stack.append(entry.path)
+            except OSError:
+                continue
+        return True
+
+
+    def unwatch_repo(self, repo):
+        with self.lock:
+            for wd in self.repo_wds.pop(repo, []):
+                self.remove_watch(repo, wd)
+            self.repo_dirs.pop(repo, None)
+
+
+    def is_watched(self, repo):
+        with self.lock:
+            return repo in self.repo_wds
+
+
+    def take(self, keys):
+        '''Returns which of the keys changed since they were last taken and forgets those changes'''
+        with self.lock:
+            changed = self.changed.intersection(keys)
+            self.changed.difference_update(changed)
+        return changed
+
+
+    def read_events(self):
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except OSError:
+                return
+            offset = 0
+            new_dirs = []
+            overflowed = False
+            with self.lock:
+                while offset + EVENT_HEADER.size <= len(data):
+                    wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                    name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+                    offset += EVENT_HEADER.size + length
+                    if mask & IN_Q_OVERFLOW:
+                        # events were dropped, anything may have changed and new directories may not be watched
+                        self.changed.update(w[0] for watches in self.watches.values() for w in watches)
+                        overflowed = True
+                        continue
+                    if mask & IN_IGNORED:
+                        self.watches.pop(wd, None)
+                        continue
+                    name = os.fsdecode(name)
+                    for key, path, names in self.watches.get(wd, []):
+                        if (name in names) if names is not None else not is_git_lock_file(path, name):
+                            self.changed.add(key)
+                        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and key in self.repo_dirs:
+                            new_dirs.append((key, os.path.join(path, name)))
+                for repo, path in new_dirs:
+                    if repo in self.repo_wds and is_watched_path(self.repo_dirs[repo], path):
+                        if not self.watch_tree(repo, path):
+                            # the repo is marked changed already, from now on it is treated as unwatched
+                            self.unwatch_repo(repo)
+                            self.too_big.add(repo)
+                if overflowed:
+                    # they are watched again from scratch the next time they are asked for
+                    for repo in list(self.repo_wds):
+                        self.unwatch_repo(repo)
@@ -1,23 +1,105 @@
 import click
-from termcolor import colored
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
 
 verbose = False
 
-indents = []
+# 'text' for people, 'json' for one event object per line
+log_format = 'text'
+
+# every write to the terminal holds the lock so lines from concurrent producers never interleave
+lock = threading.RLock()
+
+# the indents and the lines of an open batch belong to the thread that is producing them
+local = threading.local()
+
+
+def set_format(new_format):
+    global log_format
+    log_format = new_format
+
+
+def is_json():
+    return log_format == 'json'
+
+
+def get_indents():
+    if not hasattr(local, 'indents'):
+        local.indents = []
+    return local.indents
+
+
+def write(text, err=False):
+    '''Adds the text to the thread's open batch or writes it right away'''
+    batch_lines = getattr(local, 'batch', None)
+    if batch_lines is not None and not err:
+        batch_lines.append(text)
+    else:
+        with lock:
+            click.echo(text, nl=False, err=err)
+
+
+@contextmanager
+def batch():
+    '''Collects everything printed inside the block and writes it at the end with a single call'''
+    if getattr(local, 'batch', None) is not None:
+        # already batching, the outer block writes everything
+        yield
+        return
+
+    local.batch = []
+    try:
+        yield
+    finally:
+        text = "".join(local.batch)
+        local.batch = None
+        if text:
+            with lock:
+                click.echo(text, nl=False)
+
+
+def event(name, **fields):
+    '''Writes one json object per line, only in the json format'''
+    if is_json():
+        fields['event'] = name
+        fields['time'] = round(time.time(), 3)
+        write(json.dumps(fields) + "\n")
+
 
 def fatal(message):
-    click.echo(click.style("Fatal Error: " + message, bg='red'))
-    exit()
+    if is_json():
+        event('fatal', message=message)
+    else:
+        write(click.style("Fatal Error: " + message, bg='red') + "\n")
+    sys.exit(1)
 
 
 def warning(message):
-    click.echo(click.style("Warning: " + message, bg='yellow', fg='red'))
+    if is_json():
+        event('warning', message=message)
+    else:
+        write(click.style("Warning: " + message, bg='yellow', fg='red') + "\n")
 
 
 def print(message, color='reset', nl=True, indent=True):
+    if is_json():
+        # the halves of a nl=False message are sent as separate events
+        event('message', message=message)
+        return
     if indent:
-        message = "".join(indents) + message
-    click.echo(click.style(message, bg='reset', fg=color), nl=nl)
+        message = "".join(get_indents()) + message
+    write(click.style(message, bg='reset', fg=color) + ("\n" if nl else ""))
+
+
+def output(text, source=None):
+    '''Passes on what a command printed without indenting or coloring it'''
+    if is_json():
+        event('output', source=source, text=text)
+    else:
+        write(text)
 
 
 def perhaps_print(message, color='reset', nl=True):
@@ -27,15 +109,30 @@ def perhaps_print(message, color='reset', nl=True):
 
 def success():
     if verbose:
-        click.echo(click.style("WTSRC OK", bg='reset', fg='green'))
+        if is_json():
+            event('success')
+        else:
+            write(click.style("WTSRC OK", bg='reset', fg='green') + "\n")
 
 
 def increase_indent(indent="    "):
-    indents.append(indent)
+    get_indents().append(indent)
 
 
 def decrease_indent():
+    indents = get_indents()
     if len(indents) > 0:
         indents.pop()
     else:
         warning("decrease_indent called but no indent is active")
+
+
+def progress(message):
+    '''Overwrites the current terminal line with message, does nothing when the output is not a terminal'''
+    if sys.stdout.isatty() and not is_json():
+        write("\r" + message + "\033[K")
+
+
+def end_progress():
+    if sys.stdout.isatty() and not is_json():
+        write("\n")
@@ -0,0 +1,290 @@
+import asyncio
+import hashlib
+import os
+import re
+import time
+import wtsrc.WtsrcLogger as log
+from contextlib import asynccontextmanager
+from wtsrc.WtsrcAsync import run, run_sync
+from wtsrc.WtsrcGitDir import find_git_dir
+from wtsrc.WtsrcSettings import LOCK_POLL_SECONDS, MIRROR_DIR, MIRROR_FRESH_SECONDS
+from wtsrc.WtsrcUtils import lock_open_file, unlock_open_file
+
+# files kept next to the git data of every mirror
+URL_FILE = "wtsrc_url"
+FETCHED_FILE = "wtsrc_fetched"
+LAST_USED_FILE = "wtsrc_last_used"
+USERS_FILE = "wtsrc_users"
+
+# the workspaces borrow objects that only the mirror has, git must never delete them on its own - after a branch was
+# deleted or force-pushed upstream they are unreachable in the mirror, only evict_mirror gets rid of them
+MIRROR_CONFIG = ['gc.auto=0', 'gc.pruneExpire=never', 'maintenance.auto=false']
+
+def mirror_root():
+    '''The directory holding the mirrors, WTSRC_MIRROR_DIR overrides the setting'''
+    return os.path.expanduser(os.path.expandvars(os.environ.get('WTSRC_MIRROR_DIR') or MIRROR_DIR))
+
+
+def mirror_name(url):
+    '''A readable directory name that is unique for the url'''
+    readable = re.sub(r'[^A-Za-z0-9._-]+', '_', re.sub(r'^[a-z+]+://', '', url)).strip('_')[-60:]
+    return "{n}-{h}.git".format(n=readable, h=hashlib.sha1(url.encode('utf-8')).hexdigest()[:10])
+
+
+@asynccontextmanager
+async def lock_mirror(mirror_dir, shared=False):
+    '''Holds the lock of the mirror, shared while it is read and exclusive while it is changed
+
+    The lock is polled instead of waited for so the other repos keep going meanwhile.
+    Windows has no shared locks so there every lock is exclusive.
+    '''
+    with open(mirror_dir + ".lock", 'a+') as file:
+        while not lock_open_file(file, shared, blocking=False):
+            await asyncio.sleep(LOCK_POLL_SECONDS)
+        try:
+            yield
+        finally:
+            unlock_open_file(file)
+
+
+def touch(path):
+    with open(path, 'a'):
+        pass
+    os.utime(path)
+
+
+def age(path):
+    try:
+        return time.time() - os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def is_fresh(mirror_dir):
+    fetched = age(os.path.join(mirror_dir, FETCHED_FILE))
+    return fetched is not None and fetched < MIRROR_FRESH_SECONDS
+
+
+async def update_mirror(url, output):
+    '''Creates or fetches the mirror of the url and returns its directory, or None when that failed
+
+    Workspaces updating the same mirror at the same time take turns, and a mirror fetched less than
+    MIRROR_FRESH_SECONDS ago is not fetched again so they don't all download the same objects.
+    '''
+    root = mirror_root()
+    mirror_dir = os.path.join(root, mirror_name(url))
+    os.makedirs(root, exist_ok=True)
+
+    async with lock_mirror(mirror_dir):
+        if not os.path.isdir(mirror_dir):
+            # cloned next to it and renamed so a mirror that is there is always complete
+            tmp_dir = "{d}.{p}.tmp".format(d=mirror_dir, p=os.getpid())
+            config = [arg for setting in MIRROR_CONFIG for arg in ('--config', setting)]
+            result = await run(['git', 'clone', '--mirror', '--quiet'] + config + [url, tmp_dir], cwd=root)
+            if result.exit_code != 0:
+                output.append(result.output.rstrip())
+                output.append("The mirror of {} could not be created".format(url))
+                from wtsrc.WtsrcNuke import remove_tree
+                if os.path.isdir(tmp_dir):
+                    remove_tree(tmp_dir)
+                return None
+            with open(os.path.join(tmp_dir, URL_FILE), 'w') as file:
+                file.write(url + "\n")
+            os.replace(tmp_dir, mirror_dir)
+            touch(os.path.join(mirror_dir, FETCHED_FILE))
+        elif not is_fresh(mirror_dir):
+            result = await run(['git', 'fetch', '--prune', '--quiet', 'origin'], cwd=mirror_dir)
+            if result.exit_code != 0:
+                # the mirror is still a good reference, the repo fetches what it lacks itself
+                output.append(result.output.rstrip())
+                output.append("The mirror of {} could not be fetched".format(url))
+            else:
+                touch(os.path.join(mirror_dir, FETCHED_FILE))
+        touch(os.path.join(mirror_dir, LAST_USED_FILE))
+    return mirror_dir
+
+
+def add_user(mirror_dir, repo_dir):
+    '''Remembers that the repo borrows objects from the mirror so it can be made independent before an eviction'''
+    git_dir = find_git_dir(repo_dir)
+    if not git_dir:
+        return
+    users = read_users(mirror_dir)
+    git_dir = os.path.abspath(git_dir)
+    if git_dir not in users:
+        # a single short append, so concurrent workspaces don't mix up their lines
+        with open(os.path.join(mirror_dir, USERS_FILE), 'a') as file:
+            file.write(git_dir + "\n")
+
+
+def read_users(mirror_dir):
+    try:
+        with open(os.path.join(mirror_dir, USERS_FILE), encoding='utf-8') as file:
+            return [line.rstrip("\n") for line in file if line.strip()]
+    except OSError:
+        return []
+
+
+def alternates_file(git_dir):
+    return os.path.join(git_dir, 'objects', 'info', 'alternates')
+
+
+def read_alternates(git_dir):
+    try:
+        with open(alternates_file(git_dir), encoding='utf-8') as file:
+            return [line.rstrip("\n") for line in file if line.strip()]
+    except OSError:
+        return []
+
+
+def add_alternate(repo_dir, mirror_dir):
+    '''Lets a repo cloned without the mirror read its objects from it, returns False when it already did'''
+    git_dir = find_git_dir(repo_dir)
+    objects = os.path.join(mirror_dir, 'objects')
+    if not git_dir or objects in read_alternates(git_dir):
+        return False
+    os.makedirs(os.path.dirname(alternates_file(git_dir)), exist_ok=True)
+    with open(alternates_file(git_dir), 'a') as file:
+        file.write(objects + "\n")
+    return True
+
+
+async def mirror_repo(repo_dir, url, output):
+    '''Brings the mirror of the url up to date and lets the existing repo borrow from it before it fetches'''
+    mirror_dir = await update_mirror(url, output)
+    if not mirror_dir:
+        return
+    async with lock_mirror(mirror_dir, shared=True):
+        if os.path.isdir(mirror_dir) and add_alternate(repo_dir, mirror_dir):
+            output.append("now borrows objects from {}".format(mirror_dir))
+        add_user(mirror_dir, repo_dir)
+
+
+class Mirror:
+    '''A mirror in the mirror directory with what the eviction needs to know about it'''
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        try:
+            with open(os.path.join(path, URL_FILE), encoding='utf-8') as file:
+                self.url = file.readline().strip()
+        except OSError:
+            self.url = None
+        try:
+            self.last_used = os.stat(os.path.join(path, LAST_USED_FILE)).st_mtime
+        except OSError:
+            self.last_used = 0
+        self.size = dir_size(path)
+        self.users = [user for user in read_users(path) if os.path.join(path, 'objects') in read_alternates(user)]
+
+
+def dir_size(path):
+    total = 0
+    stack = [path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    else:
+                        total += entry.stat(follow_symlinks=False).st_size
+        except OSError:
+            pass
+    return total
+
+
+def list_mirrors():
+    '''Returns the mirrors, least recently used first'''
+    root = mirror_root()
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return []
+    mirrors = [Mirror(os.path.join(root, name)) for name in names
+               if name.endswith('.git') and os.path.isdir(os.path.join(root, name))]
+    return sorted(mirrors, key=lambda m: m.last_used)
+
+
+def parse_size(text):
+    '''Reads sizes like 500M or 20G'''
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*', text.upper())
+    if not match:
+        return None
+    return int(float(match.group(1)) * 1024 ** " KMGT".index(match.group(2) or " "))
+
+
+def choose_evictions(mirrors, max_bytes=None, unused_days=None):
+    '''The least recently used mirrors that have to go for the rest to fit in max_bytes, and the unused ones'''
+    total = sum(m.size for m in mirrors)
+    evicted = []
+    for mirror in mirrors:
+        too_big = max_bytes is not None and total > max_bytes
+        unused = unused_days is not None and time.time() - mirror.last_used > unused_days * 24 * 3600
+        if too_big or unused:
+            evicted.append(mirror)
+            total -= mirror.size
+    return evicted
+
+
+async def dissociate(git_dir, mirror_dir):
+    '''Copies the objects the repo borrows from the mirror into the repo and stops it borrowing'''
+    objects = os.path.join(mirror_dir, 'objects')
+    if objects not in read_alternates(git_dir):
+        return None
+    # without -l the objects of the alternates are packed into the repo too, which is what clone --dissociate does
+    result = await run(['git', '--git-dir', git_dir, 'repack', '-a', '-d', '-q'])
+    if result.exit_code != 0:
+        return result.output.strip() or "git repack failed"
+    remaining = [line for line in read_alternates(git_dir) if line != objects]
+    if remaining:
+        with open(alternates_file(git_dir), 'w') as file:
+            file.write("".join(line + "\n" for line in remaining))
+    else:
+        os.remove(alternates_file(git_dir))
+    return None
+
+
+def evict_mirror(mirror):
+    '''Makes the repos using the mirror independent of it and deletes it, returns the problems'''
+    from wtsrc.WtsrcNuke import remove_tree
+
+    async def evict():
+        problems = []
+        async with lock_mirror(mirror.path):
+            for user in read_users(mirror.path):
+                if os.path.isdir(user):
+                    error = await dissociate(user, mirror.path)
+                    if error:
+                        problems.append("{u}: {e}".format(u=user, e=error))
+            if problems:
+                # a repo that still needs the mirror would be broken by deleting it
+                return problems
+            stats = remove_tree(mirror.path)
+            problems += [str(e) for e in stats.errors]
+        # the lock file stays, a workspace may have it open already and would lock a file nobody else sees
+        return problems
+
+    return run_sync(evict())
+
+
+def log_mirrors(mirrors):
+    from wtsrc.WtsrcNuke import format_bytes
+    if log.is_json():
+        for mirror in mirrors:
+            log.event('mirror', name=mirror.name, url=mirror.url, size=mirror.size, last_used=mirror.last_used,
+                      users=len(mirror.users))
+        return
+
+    if not mirrors:
+        log.print("There are no mirrors in {}".format(mirror_root()))
+        return
+    with log.batch():
+        max_len = max(len(m.url or m.name) for m in mirrors)
+        for mirror in mirrors:
+            name = mirror.url or mirror.name
+            log.print("{n} {s} {b:>8} {u:>4} repos  last used {t}".format(
+                n=name, s=" " * (max_len - len(name)), b=format_bytes(mirror.size), u=len(mirror.users),
+                t=time.strftime("%Y-%m-%d %H:%M", time.localtime(mirror.last_used))))
+        log.print("{n} mirrors, {b}".format(n=len(mirrors), b=format_bytes(sum(m.size for m in mirrors))), color='cyan')
@@ -0,0 +1,90 @@
+import os
+import pickle
+import time
+import wtsrc.WtsrcLogger as log
+import wtsrc.WtsrcTrace as trace
+from wtsrc.WtsrcSettings import MODEL_CACHE_DIRECTORY
+from wtsrc.WtsrcUtils import atomic_write, find_project_root
+
+# bump when the layout of a cache entry changes
+CACHE_VERSION = 1
+
+# files modified less than this many seconds before they were parsed are not trusted by mtime alone
+RACY_SECONDS = 2
+
+
+def cache_file_name(file_path):
+    '''The cache entry for a yml file is named after its path relative to the workspace root'''
+    root = find_project_root()
+    if not root:
+        return None
+    key = os.path.relpath(os.path.abspath(file_path), root).replace(os.sep, '__').lstrip('.')
+    return os.path.join(root, MODEL_CACHE_DIRECTORY, key + '.pickle')
+
+
+def read_entry(cache_file):
+    try:
+        with open(cache_file, 'rb') as file:
+            entry = pickle.load(file)
+        if entry.get('version') == CACHE_VERSION:
+            return entry
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError):
+        pass
+    return None
+
+
+def write_entry(cache_file, entry):
+    '''Written atomically so a concurrent reader never sees half an entry'''
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with atomic_write(cache_file, 'wb') as file:
+            pickle.dump(entry, file, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError as e:
+        log.perhaps_print("Could not write the model cache {f}: {e}".format(f=cache_file, e=e))
+
+
+def parse_yaml(content):
+    '''yaml is only imported when a file has to be parsed, a warm start never needs it'''
+    import yaml
+    # the C loader is several times faster, the pure python safe loader is used when libyaml is missing
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    return yaml.load(content, Loader=loader)
+
+
+def load_yaml(file_path):
+    '''Returns the parsed yml file, from the cache in .tsrc when the file has not changed since it was parsed
+
+    The mtime and size are checked first, when they differ the content hash decides if the file really changed.
+    '''
+
+    with trace.span(os.path.basename(file_path), 'model', file=file_path):
+        start = time.perf_counter()
+        stat = os.stat(file_path)
+        cache_file = cache_file_name(file_path)
+        entry = read_entry(cache_file) if cache_file else None
+
+        if entry and entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            log.perhaps_print("Loaded {f} from the cache in {t:.1f}ms".format(f=file_path, t=(time.perf_counter() - start) * 1000))
+            return entry['data']
+
+        import hashlib
+        with open(file_path, 'rb') as file:
+            content = file.read()
+        sha = hashlib.sha1(content).hexdigest()
+
+        if entry and entry['sha'] == sha:
+            # only touched, remember the new stat so the next load doesn't need the hash
+            data = entry['data']
+            state = "unchanged"
+        else:
+            data = parse_yaml(content)
+            state = "parsed"
+
+        if cache_file:
+            # a file changed again within the mtime resolution would look unchanged, so recent files are always hashed
+            mtime_ns = stat.st_mtime_ns if time.time() - stat.st_mtime > RACY_SECONDS else None
+            write_entry(cache_file, {'version': CACHE_VERSION, 'path': file_path, 'mtime_ns': mtime_ns,
+                                     'size': stat.st_size, 'sha': sha, 'data': data})
+
+        log.perhaps_print("Loaded {f} ({s}) in {t:.1f}ms".format(f=file_path, s=state, t=(time.perf_counter() - start) * 1000))
+        return data
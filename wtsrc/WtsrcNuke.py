@@ -0,0 +1,185 @@
+import os
+import stat
+import subprocess
+import sys
+import time
+import wtsrc.WtsrcLogger as log
+from concurrent.futures import ThreadPoolExecutor
+from wtsrc.WtsrcSettings import DEFAULT_JOBS, TSRC_DIRECTORY
+from wtsrc.WtsrcUtils import find_project_root, invalidate_workspace_context
+
+# the top of the tree is split until there are this many subtrees per worker, so one big repo doesn't serialize the rest
+SPLIT_FACTOR = 4
+
+# but no deeper than this
+SPLIT_DEPTH = 3
+
+# the entries moved aside by --trash go into a directory starting with this, in the workspace root
+TRASH_PREFIX = ".wtsrc_trash_"
+
+
+class NukeStats:
+    '''What was removed, every worker counts in its own and they are added up at the end'''
+
+    def __init__(self):
+        self.files = 0
+        self.dirs = 0
+        self.bytes = 0
+        self.errors = []
+
+
+    def add(self, other):
+        self.files += other.files
+        self.dirs += other.dirs
+        self.bytes += other.bytes
+        self.errors += other.errors
+        return self
+
+
+def format_bytes(size):
+    if size < 1024:
+        return "{}B".format(size)
+    for unit in ("KB", "MB", "GB"):
+        size /= 1024
+        if size < 1024 or unit == "GB":
+            return "{s:.1f}{u}".format(s=size, u=unit)
+
+
+def remove_file(entry, stats):
+    try:
+        size = entry.stat(follow_symlinks=False).st_size
+        try:
+            os.unlink(entry.path)
+        except PermissionError:
+            # git makes its objects read-only, which stops the unlink on windows
+            os.chmod(entry.path, stat.S_IWRITE)
+            os.unlink(entry.path)
+        stats.files += 1
+        stats.bytes += size
+    except OSError as e:
+        stats.errors.append(e)
+
+
+def remove_dir(path, stats):
+    try:
+        os.rmdir(path)
+        stats.dirs += 1
+    except OSError as e:
+        stats.errors.append(e)
+
+
+def remove_tree(path):
+    '''Deletes the directory and everything in it reading every directory once, returns the NukeStats'''
+    stats = NukeStats()
+    stack = [(path, False)]
+    while stack:
+        cur_dir, emptied = stack.pop()
+        if emptied:
+            remove_dir(cur_dir, stats)
+            continue
+        stack.append((cur_dir, True))
+        try:
+            with os.scandir(cur_dir) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append((entry.path, False))
+                    else:
+                        remove_file(entry, stats)
+        except OSError as e:
+            stats.errors.append(e)
+    return stats
+
+
+def remove_contents(dir_to_nuke, jobs=DEFAULT_JOBS, keep=None):
+    '''Deletes everything in the directory (but not the directory or its entries keep returns True for) with jobs subtrees being deleted at once
+
+    The top levels are read breadth first until there are enough subtrees for the workers, the files found on the
+    way are deleted right away and the directories that were split are removed after the workers are done.
+    '''
+    stats = NukeStats()
+    split_dirs = []
+    subtrees = [dir_to_nuke]
+    depth = 0
+    while subtrees and len(subtrees) < jobs * SPLIT_FACTOR and depth < SPLIT_DEPTH:
+        next_level = []
+        for cur_dir in subtrees:
+            split_dirs.append(cur_dir)
+            with os.scandir(cur_dir) as it:
+                for entry in it:
+                    if keep and cur_dir == dir_to_nuke and keep(entry):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        next_level.append(entry.path)
+                    else:
+                        remove_file(entry, stats)
+        subtrees = next_level
+        depth += 1
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        for tree_stats in pool.map(remove_tree, subtrees):
+            stats.add(tree_stats)
+
+    # deepest first, the directory that is nuked stays
+    for cur_dir in reversed(split_dirs[1:]):
+        remove_dir(cur_dir, stats)
+    return stats
+
+
+def move_to_trash(root):
+    '''Moves everything in root into a new trash directory in root and starts a process that deletes it'''
+    trash = os.path.join(root, "{p}{t}_{i}".format(p=TRASH_PREFIX, t=int(time.time()), i=os.getpid()))
+    os.mkdir(trash)
+    moved = 0
+    with os.scandir(root) as it:
+        for entry in it:
+            if entry.name.startswith(TRASH_PREFIX):
+                continue
+            os.rename(entry.path, os.path.join(trash, entry.name))
+            moved += 1
+
+    options = {}
+    if os.name == 'nt':
+        options['creationflags'] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        options['start_new_session'] = True
+    subprocess.Popen([sys.executable, '-m', 'wtsrc.WtsrcNuke', trash], stdin=subprocess.DEVNULL,
+                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **options)
+    return trash, moved
+
+
+def nuke_root(jobs=DEFAULT_JOBS, trash=False):
+    '''Deletes everything in the project root, which has to be the cwd'''
+
+    root = find_project_root()
+    if not root:
+        log.fatal("Could not find the project root")
+    if not os.path.exists(os.path.join(os.getcwd(), TSRC_DIRECTORY)):
+        log.fatal("You must call from the root of the project for safety.  The .tsrc directory was not found in the cwd")
+
+    start = time.perf_counter()
+    if trash:
+        trash_dir, moved = move_to_trash(root)
+        invalidate_workspace_context()
+        log.event('nuke', trash=trash_dir, entries=moved, duration=round(time.perf_counter() - start, 3))
+        log.print("Moved {n} entries to {t}, they are deleted in the background".format(n=moved, t=trash_dir))
+        return
+
+    # trash directories being emptied by a background process are left to it
+    stats = remove_contents(root, jobs, keep=lambda entry: entry.name.startswith(TRASH_PREFIX))
+    invalidate_workspace_context()
+    duration = time.perf_counter() - start
+
+    log.event('nuke', files=stats.files, dirs=stats.dirs, bytes=stats.bytes, errors=[str(e) for e in stats.errors],
+              duration=round(duration, 3))
+    log.print("Removed {f} files and {d} directories ({b}) in {t:.1f}s".format(
+        f=stats.files, d=stats.dirs, b=format_bytes(stats.bytes), t=duration))
+    for error in stats.errors[:10]:
+        log.warning(str(error))
+    if len(stats.errors) > 10:
+        log.warning("... and {} more errors".format(len(stats.errors) - 10))
+
+
+if __name__ == '__main__':
+    # the background deletion started by move_to_trash
+    remove_contents(sys.argv[1])
+    os.rmdir(sys.argv[1])
@@ -0,0 +1,133 @@
+import asyncio
+import os
+import wtsrc.WtsrcLogger as log
+import wtsrc.WtsrcTrace as trace
+from wtsrc.WtsrcAsync import run, run_sync
+from wtsrc.WtsrcUtils import find_project_root, repo_directory
+
+
+class RepoResult:
+    '''The outcome of running a command in a single repo'''
+
+    def __init__(self, repo, exit_code, output, duration, command=None):
+        self.repo = repo
+        self.exit_code = exit_code
+        self.output = output
+        self.duration = duration
+        self.command = command
+
+
+    def succeeded(self):
+        return self.exit_code == 0
+
+
+    def log(self):
+        '''Prints the buffered output of the repo as one block'''
+        if log.is_json():
+            log.event('repo', repo=self.repo, command=self.command, exit_code=self.exit_code,
+                      duration=round(self.duration, 3), output=self.output)
+            return
+
+        color = 'green' if self.succeeded() else 'red'
+        with log.batch():
+            log.print("* {r}".format(r=self.repo), color=color)
+            log.increase_indent()
+            for line in self.output.splitlines():
+                log.print(line)
+            log.decrease_indent()
+
+
+async def run_in_repo(repo, repo_dir, command, timeout=None):
+    '''Runs the shell command in the repo directory and buffers everything it prints'''
+
+    if not os.path.isdir(repo_dir):
+        return RepoResult(repo, None, "The repo path '{}' was not found".format(repo_dir), 0.0, command)
+
+    result = await run(command, cwd=repo_dir, timeout=timeout)
+    output = result.output
+    if result.timed_out:
+        output += "\nKilled after {} seconds".format(timeout)
+    return RepoResult(repo, result.exit_code, output, result.duration, command)
+
+
+def for_each_repo(repos, func, jobs, on_result=None):
+    '''Awaits func(repo, repo_dir) for every repo with at most jobs commands running at once
+
+    on_result is called with each result as it finishes, the results are returned in completion order
+    '''
+
+    root = find_project_root()
+    if not root:
+        log.fatal("You must call from within a tsrc directory")
+
+    async def gather():
+        results = []
+        for next_result in asyncio.as_completed([func(repo, repo_directory(root, repo)) for repo in repos]):
+            result = await next_result
+            # the callbacks all run on the loop's thread so printed blocks never interleave
+            if on_result:
+                on_result(result)
+            results.append(result)
+        return results
+
+    with trace.span("for each repo", 'phase', repos=len(repos), jobs=jobs):
+        return run_sync(gather(), jobs=jobs)
+
+
+class RepoProgress:
+    '''Keeps the done/total/failed line up to date while the repos finish, pass its update as on_result'''
+
+    def __init__(self, label, total):
+        self.label = label
+        self.total = total
+        self.done = 0
+        self.failed = 0
+
+
+    def update(self, result):
+        self.done += 1
+        if not result.succeeded():
+            self.failed += 1
+        log.progress("{l}: {d}/{t} done, {f} failed".format(l=self.label, d=self.done, t=self.total, f=self.failed))
+
+
+def sort_by_repo(results, repos):
+    '''Puts the results back in the order of the repos list regardless of completion order'''
+    order = {repo: i for i, repo in enumerate(repos)}
+    return sorted(results, key=lambda r: order[r.repo])
+
+
+def run_in_repos(repos, command, jobs, timeout=None):
+    '''Runs the command in every repo with at most jobs at once, printing each repo's output as it finishes'''
+
+    results = for_each_repo(repos, lambda repo, repo_dir: run_in_repo(repo, repo_dir, command, timeout),
+                            jobs, on_result=lambda result: result.log())
+    return sort_by_repo(results, repos)
+
+
+def log_summary(results):
+    '''Prints a table with the exit code and wall time of each repo'''
+
+    failed = [r for r in results if not r.succeeded()]
+    if log.is_json():
+        log.event('summary', repos=len(results), failed=[r.repo for r in failed],
+                  duration=round(sum(r.duration for r in results), 3))
+        return failed
+
+    with log.batch():
+        log_summary_table(results, failed)
+    return failed
+
+
+def log_summary_table(results, failed):
+    max_len = max([len(r.repo) for r in results] + [len("repo")])
+    log.print("")
+    log.print("{r} {s} exit  time".format(r="repo", s=" " * (max_len - len("repo"))), color='cyan')
+    for result in results:
+        spaces = " " * (max_len - len(result.repo))
+        code = "-" if result.exit_code is None else str(result.exit_code)
+        color = 'reset' if result.succeeded() else 'red'
+        log.print("{r} {s} {c:>4} {t:>6.2f}s".format(r=result.repo, s=spaces, c=code, t=result.duration), color=color)
+
+    log.print("")
+    log.print("{n} repos, {f} failed".format(n=len(results), f=len(failed)), color='red' if failed else 'green')
@@ -0,0 +1,85 @@
+import wtsrc.WtsrcLogger as log
+
+# how much is read from the pipe at once
+READ_SIZE = 64 * 1024
+
+
+class TerminalSink:
+    '''Writes the output to the terminal (through the logger) as it arrives'''
+
+    def __init__(self, source=None):
+        self.source = source
+
+
+    def write(self, text):
+        log.output(text, source=self.source)
+
+
+    def close(self):
+        pass
+
+
+class FileSink:
+    '''Appends the output to a log file'''
+
+    def __init__(self, path):
+        self.file = open(path, 'a', encoding='utf-8')
+
+
+    def write(self, text):
+        self.file.write(text)
+
+
+    def close(self):
+        self.file.close()
+
+
+class BufferSink:
+    '''Keeps the output in memory'''
+
+    def __init__(self):
+        self.parts = []
+
+
+    def write(self, text):
+        self.parts.append(text)
+
+
+    def close(self):
+        pass
+
+
+    def getvalue(self):
+        return "".join(self.parts)
+
+
+class SpoolSink:
+    '''Keeps the output in memory until it grows past max_size and in a temporary file after that'''
+
+    def __init__(self, max_size):
+        import tempfile
+        self.file = tempfile.SpooledTemporaryFile(max_size=max_size, mode='w+', encoding='utf-8', newline='')
+        self.size = 0
+
+
+    def write(self, text):
+        self.file.write(text)
+        self.size += len(text)
+
+
+    def close(self):
+        pass
+
+
+    def chunks(self):
+        '''Yields the output from the start in READ_SIZE pieces'''
+        self.file.seek(0)
+        while True:
+            text = self.file.read(READ_SIZE)
+            if not text:
+                return
+            yield text
+
+
+    def discard(self):
+        self.file.close()
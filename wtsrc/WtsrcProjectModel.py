@@ -1,5 +1,6 @@
-import yaml
 import wtsrc.WtsrcLogger as log
+from wtsrc.WtsrcActionPlan import ActionPlan
+from wtsrc.WtsrcModelCache import load_yaml
 from wtsrc.WtsrcSettings import WTSRC_FILE, MANIFEST_DIRECTORY
 from wtsrc.WtsrcUtils import find_file_in_manifest_dir, find_manifest_directory, obj_dump
 
@@ -18,17 +19,27 @@ def get_from_dict(dict, field, field_description, is_required, type=None):
 class WtsrcProjectModel:
 
     class Action:
-        def __init__(self, name, action, comment):
+        def __init__(self, name, action, comment, inputs=None, outputs=None):
             self.name = name
             self.action = action
             self.comment = comment
+            self.inputs = inputs or []
+            self.outputs = outputs or []
 
 
         @classmethod
         def create_from_dict(cls, name:str, data:dict):
-            action = get_from_dict(data, 'action', 'action field for {}'.format(name), True, str)
+            action = get_from_dict(data, 'action', 'action field for {}'.format(name), True, (str, list))
             comment = get_from_dict(data, 'comment', 'comment field for {}'.format(name), False, str)
-            return WtsrcProjectModel.Action(name, action, comment)
+            # optional glob patterns relative to the manifest directory, declaring inputs makes the result cacheable
+            inputs = get_from_dict(data, 'inputs', 'inputs field for {}'.format(name), False, list)
+            outputs = get_from_dict(data, 'outputs', 'outputs field for {}'.format(name), False, list)
+            return WtsrcProjectModel.Action(name, ActionPlan.create_from_data("action {}".format(name), action), comment,
+                                            inputs, outputs)
+
+
+        def is_cacheable(self):
+            return len(self.inputs) > 0
 
 
         def log(self):
@@ -36,6 +47,14 @@ class WtsrcProjectModel:
             log.increase_indent(" -")
             log.print("comment: {}".format(self.comment))
             log.print("action:  {}".format(self.action))
+            if self.inputs:
+                log.print("inputs:  {}".format(", ".join(self.inputs)))
+            if self.outputs:
+                log.print("outputs: {}".format(", ".join(self.outputs)))
+            if not self.action.is_single_command():
+                log.increase_indent("  ")
+                self.action.log()
+                log.decrease_indent()
             log.decrease_indent()
 
 
@@ -48,9 +67,11 @@ class WtsrcProjectModel:
 
         @classmethod
         def create_from_dict(cls, name:str, data:dict):
-            pre = get_from_dict(data, 'pre', 'pre field for command {}'.format(name), False, str)
-            post = get_from_dict(data, 'post', 'pre field for command {}'.format(name), False, str)
-            return WtsrcProjectModel.Command(name, pre, post)
+            pre = get_from_dict(data, 'pre', 'pre field for command {}'.format(name), False, (str, list))
+            post = get_from_dict(data, 'post', 'post field for command {}'.format(name), False, (str, list))
+            return WtsrcProjectModel.Command(name,
+                                             ActionPlan.create_from_data("pre-action of {}".format(name), pre),
+                                             ActionPlan.create_from_data("post-action of {}".format(name), post))
 
 
         def log(self):
@@ -70,6 +91,7 @@ class WtsrcProjectModel:
     def __init__(self, data:dict):
         self.commands = {}
         self.actions = {}
+        self.sparse = {}
 
         # parse the 'commands' section of the dictionary
         if 'commands' in data:
@@ -83,6 +105,10 @@ class WtsrcProjectModel:
         else:
             log.warning("'actions' section not found in {} file".format(WTSRC_FILE))
 
+        # the optional 'sparse' section - the directories wtsrc init --native checks out of the matching repos
+        if 'sparse' in data:
+            self.process_sparse_dict(data['sparse'])
+
 
     def process_actions_dict(self, actions:dict):
         if isinstance(actions, dict):
@@ -92,6 +118,25 @@ class WtsrcProjectModel:
             log.fatal("{} - 'actions' is not a dictionary".format(WTSRC_FILE))
 
 
+    def process_sparse_dict(self, sparse:dict):
+        if not isinstance(sparse, dict):
+            log.fatal("{} - 'sparse' is not a dictionary".format(WTSRC_FILE))
+        for pattern, dirs in sparse.items():
+            if not isinstance(dirs, list) or not all(isinstance(d, str) for d in dirs):
+                log.fatal("{f} - the sparse directories of '{p}' are not a list of paths".format(f=WTSRC_FILE, p=pattern))
+            self.sparse[pattern] = dirs
+
+
+    def get_sparse_dirs(self, repo:str):
+        '''Returns the directories to check out of the repo, from every sparse pattern matching its dest'''
+        import fnmatch
+        dirs = []
+        for pattern, pattern_dirs in self.sparse.items():
+            if fnmatch.fnmatchcase(repo, pattern):
+                dirs += [d for d in pattern_dirs if d not in dirs]
+        return dirs
+
+
     def add_action(self, name:str, action:dict):
         if name in self.actions:
             log.fatal("'{a}' action is defined in {f} more than once".format(a=name, f=WTSRC_FILE))
@@ -136,11 +181,8 @@ class WtsrcProjectModel:
             return cmd
 
 
-    def get_action_action(self, action_name:str):
-            action = self.actions.get(action_name, None)
-            if action:
-                action = action.action
-            return action
+    def get_action(self, action_name:str):
+            return self.actions.get(action_name, None)
 
 
     @staticmethod
@@ -171,9 +213,8 @@ class WtsrcProjectModel:
 
             if file_path:
                 log.perhaps_print("Attempting to load project model: {}".format(file_path))
-                with open(file_path) as file:
-                    yml_data = yaml.load(file, Loader=yaml.FullLoader)
-                    WtsrcProjectModel.instance = WtsrcProjectModel(yml_data)
+                yml_data = load_yaml(file_path)
+                WtsrcProjectModel.instance = WtsrcProjectModel(yml_data)
             else:
                 manifest_dir = find_manifest_directory()
                 log.warning("The wtsrc project file could not be found at: {}".format(MANIFEST_DIRECTORY))
@@ -198,3 +239,10 @@ class WtsrcProjectModel:
             self.actions[action_name].log()
             log.print("", indent=False)
         log.decrease_indent()
+
+        if self.sparse:
+            log.print("Sparse:")
+            log.increase_indent("  ")
+            for pattern in self.sparse:
+                log.print("{p}: {d}".format(p=pattern, d=", ".join(self.sparse[pattern])))
+            log.decrease_indent()
@@ -0,0 +1,98 @@
+import fnmatch
+import os
+from wtsrc.WtsrcAsync import run
+from wtsrc.WtsrcParallel import for_each_repo
+
+
+def has_changes(status):
+    '''True for a repo with staged, unstaged or untracked changes, or whose status could not be read'''
+    return bool(status.error or status.staged or status.unstaged or status.untracked or status.conflicts)
+
+
+class RepoSelector:
+    '''Picks the repos a command works on from the manifest
+
+    The groups and match patterns say which repos are candidates (all of them when neither is given), the exclude
+    patterns take repos away and the dirty and changed-since predicates keep only the repos they are true for.
+    '''
+
+    def __init__(self, groups=(), matches=(), excludes=(), dirty=False, changed_since=None):
+        self.groups = list(groups)
+        self.matches = list(matches)
+        self.excludes = list(excludes)
+        self.dirty = dirty
+        self.changed_since = changed_since
+        self.status_cache = None
+        # collected instead of printed so the daemon can hand them to the client that asked
+        self.warnings = []
+
+
+    def is_filtered(self):
+        return bool(self.groups or self.matches or self.excludes or self.dirty or self.changed_since)
+
+
+    def candidates(self, manifest, include_manifest=False):
+        '''The repos picked by the groups, match and exclude patterns in manifest order'''
+        dests = manifest.get_repo_dests()
+        if include_manifest:
+            dests.append('manifest')
+
+        if self.groups or self.matches:
+            picked = set()
+            for group in self.groups:
+                picked.update(manifest.repos_in_group(group))
+            for pattern in self.matches:
+                matched = [d for d in dests if fnmatch.fnmatchcase(d, pattern)]
+                if not matched:
+                    self.warnings.append("No repo matches '{}'".format(pattern))
+                picked.update(matched)
+            dests = [d for d in dests if d in picked]
+
+        return [d for d in dests if not any(fnmatch.fnmatchcase(d, pattern) for pattern in self.excludes)]
+
+
+    async def check(self, repo, repo_dir):
+        '''Returns (repo, True when the predicates hold, why it was kept anyway or None)'''
+        if not os.path.isdir(repo_dir):
+            return repo, False, None
+
+        if self.dirty:
+            from wtsrc.WtsrcGitStatus import read_status
+            status = await read_status(repo, repo_dir, cache=self.status_cache)
+            if not has_changes(status):
+                return repo, False, None
+
+        if self.changed_since:
+            result = await run(['git', 'diff', '--quiet', self.changed_since, 'HEAD', '--'], cwd=repo_dir)
+            if result.exit_code == 0:
+                return repo, False, None
+            if result.exit_code != 1:
+                # rather run in a repo too many than skip one that changed
+                return repo, True, "{} is not known".format(self.changed_since)
+
+        return repo, True, None
+
+
+    def select(self, manifest, jobs, include_manifest=False):
+        '''Returns the selected repos, the predicates are evaluated in all candidates at the same time'''
+        return self.filter(self.candidates(manifest, include_manifest), jobs)
+
+
+    def filter(self, repos, jobs):
+        '''Keeps the repos the dirty and changed-since predicates hold for'''
+        if not (self.dirty or self.changed_since) or not repos:
+            return repos
+
+        from wtsrc.WtsrcStatusCache import StatusCache
+        self.status_cache = StatusCache.for_workspace() if self.dirty else None
+        checks = for_each_repo(repos, self.check, jobs)
+        if self.status_cache:
+            self.status_cache.save()
+
+        kept = set()
+        for repo, keep, reason in checks:
+            if keep:
+                kept.add(repo)
+            if reason:
+                self.warnings.append("{r} was selected because {w}".format(r=repo, w=reason))
+        return [repo for repo in repos if repo in kept]
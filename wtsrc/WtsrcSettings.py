@@ -17,8 +17,55 @@ MANIFEST_FILE = "manifest.yml"
 # Project tsrc config file
 CONFIG_FILE = "config.yml"
 
+# the lockfile wtsrc snapshot writes into the tsrc directory
+SNAPSHOT_FILE = "wtsrc_lock.yml"
+
+# where the parsed manifest.yml, wtsrc.yml and config.yml are cached
+MODEL_CACHE_DIRECTORY = ".tsrc/wtsrc_cache"
+
+# the status of every repo from the last wtsrc status with what it depended on
+STATUS_CACHE_FILE = ".tsrc/wtsrc_cache/status.pickle"
+
+# the unix socket the wtsrc daemon of the workspace listens on, and where a daemon started with --background logs
+DAEMON_SOCKET = ".tsrc/wtsrc_daemon.sock"
+DAEMON_LOG_FILE = ".tsrc/wtsrc_daemon.log"
+
+# seconds a command waits for the daemon to answer before doing the work itself
+DAEMON_TIMEOUT = 30
+
+# the diff of a repo is kept in memory up to this many characters and in a temporary file after that
+DIFF_SPILL_BYTES = 1024 * 1024
+
+# where the results of actions that declare inputs are cached
+ACTION_CACHE_DIRECTORY = ".tsrc/wtsrc_cache/actions"
+
+# the least recently used action results are deleted when the action cache grows past this many bytes
+ACTION_CACHE_MAX_BYTES = 50 * 1024 * 1024
+
 # set to $HOME to use python's home directory, else enter a file location
 GLOBAL_MODEL_DIR = "$HOME"
 
-# the name of the file where model will be stored
-GLOBAL_MODEL_FILE = ".wtsrcdata"
+# the name of the file where the aliases are stored
+GLOBAL_MODEL_FILE = ".wtsrc_aliases.json"
+
+# the pickle file older versions stored the aliases in, its aliases are migrated when there is no alias file
+GLOBAL_MODEL_PICKLE_FILE = ".wtsrcdata"
+
+# the bare mirrors shared by the workspaces of the host, overridden by the WTSRC_MIRROR_DIR environment variable
+MIRROR_DIR = "$HOME/.wtsrc_mirrors"
+
+# a mirror fetched less than this many seconds ago is not fetched again, so workspaces syncing together fetch once
+MIRROR_FRESH_SECONDS = 60
+
+# how long to wait between tries to get a file lock that is held by another process
+LOCK_POLL_SECONDS = 0.1
+
+
+# default number of repos that are worked on at the same time by the parallel commands
+DEFAULT_JOBS = 8
+
+# how many times a fetch that failed because of the network is tried again by the native sync
+SYNC_RETRIES = 3
+
+# seconds to wait before the first retry, doubled for every retry after that
+SYNC_RETRY_DELAY = 1.0
@@ -0,0 +1,140 @@
+import os
+import time
+import wtsrc.WtsrcLogger as log
+from wtsrc.WtsrcAsync import run
+from wtsrc.WtsrcGitDir import is_object_id, read_head
+from wtsrc.WtsrcParallel import RepoResult, for_each_repo, sort_by_repo
+from wtsrc.WtsrcUtils import atomic_write
+
+
+class RepoHead:
+    '''The commit a repo is at when the snapshot is taken'''
+
+    def __init__(self, repo, sha, branch, error=None):
+        self.repo = repo
+        self.sha = sha
+        self.branch = branch
+        self.error = error
+
+
+async def read_repo_head(repo, repo_dir):
+    '''Reads HEAD from the .git files and only runs git when they can't tell'''
+
+    if not os.path.isdir(repo_dir):
+        return RepoHead(repo, None, None, error="missing")
+
+    head = read_head(repo_dir)
+    if head:
+        return RepoHead(repo, head[0], head[1])
+
+    result = await run(['git', 'rev-parse', 'HEAD', '--abbrev-ref', 'HEAD'], cwd=repo_dir)
+    lines = result.output.split()
+    if result.exit_code != 0 or len(lines) != 2:
+        return RepoHead(repo, None, None, error=result.output.strip() or "git rev-parse failed")
+    return RepoHead(repo, lines[0], None if lines[1] == 'HEAD' else lines[1])
+
+
+def take_snapshot(manifest, config, jobs):
+    '''Returns the lockfile data with the HEAD of the manifest and every repo, and the repos it could not read'''
+
+    repos = ['manifest'] + manifest.get_repo_dests()
+    heads = sort_by_repo(for_each_repo(repos, read_repo_head, jobs), repos)
+
+    entries = []
+    failed = []
+    for head in heads:
+        if head.error:
+            failed.append(head)
+            continue
+        entry = {'dest': head.repo, 'sha1': head.sha, 'branch': head.branch}
+        repo = manifest.get_repo(head.repo)
+        if repo and 'url' in repo:
+            entry['url'] = repo['url']
+        entries.append(entry)
+
+    data = {
+        'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'manifest_branch': config.get_manifest_branch(),
+        'repos': entries,
+    }
+    return data, failed
+
+
+def save_lockfile(data, file_path):
+    import yaml
+    with atomic_write(file_path) as file:
+        file.write("# written by wtsrc snapshot, check the commits out again with wtsrc restore\n")
+        yaml.dump(data, file, sort_keys=False)
+
+
+def load_lockfile(file_path):
+    from wtsrc.WtsrcModelCache import parse_yaml
+    with open(file_path, 'rb') as file:
+        data = parse_yaml(file.read())
+    if not isinstance(data, dict) or not isinstance(data.get('repos'), list):
+        log.fatal("{} is not a wtsrc lockfile".format(file_path))
+    for entry in data['repos']:
+        if 'dest' not in entry or not isinstance(entry.get('sha1'), str) or not is_object_id(entry['sha1']):
+            log.fatal("{f} has an invalid entry: {e}".format(f=file_path, e=entry))
+    return {entry['dest']: entry for entry in data['repos']}
+
+
+async def has_commit(repo_dir, sha):
+    result = await run(['git', 'cat-file', '-e', sha + '^{commit}'], cwd=repo_dir)
+    return result.exit_code == 0
+
+
+async def restore_repo(repo, repo_dir, entry):
+    '''Checks out the locked commit, fetching only when the repo doesn't have it'''
+
+    start = time.perf_counter()
+    sha = entry['sha1']
+    branch = entry.get('branch')
+    output = []
+
+    def finish(exit_code):
+        return RepoResult(repo, exit_code, "\n".join(o for o in output if o), time.perf_counter() - start,
+                          command='restore')
+
+    if not os.path.isdir(repo_dir):
+        output.append("The repo path '{}' was not found".format(repo_dir))
+        return finish(None)
+
+    head = read_head(repo_dir)
+    if head and head[0] == sha and head[1] == branch:
+        output.append("already at {}".format(sha[:10]))
+        return finish(0)
+
+    if not await has_commit(repo_dir, sha):
+        fetch = await run(['git', 'fetch', 'origin'], cwd=repo_dir)
+        output.append(fetch.output.rstrip())
+        if not await has_commit(repo_dir, sha):
+            # the commit may not be on a branch anymore, servers that allow it can still send it by id
+            fetch = await run(['git', 'fetch', 'origin', sha], cwd=repo_dir)
+            output.append(fetch.output.rstrip())
+            if not await has_commit(repo_dir, sha):
+                output.append("The commit {} could not be fetched".format(sha))
+                return finish(1)
+
+    target = ['--detach', sha]
+    if branch:
+        local = await run(['git', 'rev-parse', '--verify', '-q', 'refs/heads/' + branch], cwd=repo_dir)
+        if local.output.strip() == sha:
+            # the branch still points at the commit, check it out so the repo isn't left detached
+            target = [branch]
+
+    checkout = await run(['git', 'checkout', '-q'] + target, cwd=repo_dir)
+    output.append(checkout.output.rstrip())
+    output.append("checked out {}".format(" ".join(target)))
+    return finish(checkout.exit_code)
+
+
+def restore_snapshot(entries, jobs):
+    '''Checks out every repo of the lockfile at the same time, returns the results in lockfile order'''
+
+    repos = list(entries)
+
+    async def restore(repo, repo_dir):
+        return await restore_repo(repo, repo_dir, entries[repo])
+
+    return sort_by_repo(for_each_repo(repos, restore, jobs), repos)
@@ -0,0 +1,60 @@
+import atexit
+import builtins
+import sys
+import time
+
+# how many modules are listed in the report
+REPORT_SIZE = 20
+
+original_import = builtins.__import__
+started = None
+import_time = {}
+# one [name, start, time spent in nested imports] per import in progress
+stack = []
+
+
+def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    '''Wraps __import__ to measure the time each module takes to load, excluding the modules it imports'''
+
+    if level or name in sys.modules:
+        return original_import(name, globals, locals, fromlist, level)
+
+    frame = [name, time.perf_counter(), 0.0]
+    stack.append(frame)
+    try:
+        return original_import(name, globals, locals, fromlist, level)
+    finally:
+        stack.pop()
+        total = time.perf_counter() - frame[1]
+        import_time[name] = import_time.get(name, 0.0) + total - frame[2]
+        if stack:
+            stack[-1][2] += total
+
+
+def start():
+    '''Starts timing the imports and prints the report when the process exits'''
+    global started
+    started = time.perf_counter()
+    builtins.__import__ = timed_import
+    atexit.register(report)
+
+
+def report():
+    builtins.__import__ = original_import
+    import wtsrc.WtsrcLogger as log
+
+    elapsed = time.perf_counter() - started
+    total = sum(import_time.values())
+    slowest = sorted(import_time.items(), key=lambda item: item[1], reverse=True)[:REPORT_SIZE]
+    max_len = max([len(name) for name, t in slowest] + [len("module")])
+
+    log.print("")
+    log.print("Startup profile:", color='cyan')
+    log.increase_indent()
+    log.print("{m} {s}  self ms".format(m="module", s=" " * (max_len - len("module"))))
+    for name, t in slowest:
+        log.print("{m} {s} {t:8.1f}".format(m=name, s=" " * (max_len - len(name)), t=t * 1000))
+    log.print("")
+    log.print("{n} modules imported in {t:.1f}ms".format(n=len(import_time), t=total * 1000))
+    log.print("{t:.1f}ms from the start of wtsrc to exit".format(t=elapsed * 1000))
+    log.decrease_indent()
@@ -0,0 +1,141 @@
+import os
+import pickle
+import threading
+import wtsrc.WtsrcLogger as log
+from wtsrc.WtsrcGitDir import find_common_dir, find_git_dir, read_head, read_index, read_ref
+from wtsrc.WtsrcSettings import STATUS_CACHE_FILE
+from wtsrc.WtsrcUtils import atomic_write, find_project_root
+
+# bump when the layout of the cache changes
+CACHE_VERSION = 1
+
+# files and directories modified less than this many seconds before git status started may have changed while it ran
+RACY_SECONDS = 2
+
+
+def fingerprint(repo_dir, upstream, untracked_dirs):
+    '''Everything git status looks at that can change without it being run again, or None if it can't be read
+
+    That is the index, HEAD, the upstream ref, the stat of every tracked file that doesn't match its index entry
+    (the unstaged changes) and the mtime of every directory holding tracked files or untracked directories,
+    which changes when an untracked file is added or removed. Returns (fingerprint, newest mtime seen).
+    '''
+    git_dir = find_git_dir(repo_dir)
+    head = read_head(repo_dir)
+    if not git_dir or not head or len(head[0]) != 40:
+        return None
+    entries = read_index(os.path.join(git_dir, 'index'))
+    if entries is None:
+        return None
+    try:
+        index_stat = os.stat(os.path.join(git_dir, 'index'))
+    except OSError:
+        return None
+
+    newest = 0
+    changed = {}
+    dirs = {''}
+    for path, mtime_ns, size in entries:
+        parent = os.path.dirname(path)
+        while parent not in dirs:
+            dirs.add(parent)
+            parent = os.path.dirname(parent)
+        try:
+            stat = os.lstat(os.path.join(repo_dir, path))
+        except OSError:
+            changed[path] = None
+            continue
+        newest = max(newest, stat.st_mtime_ns)
+        # the index keeps the low 32 bits of the size, and only seconds when git was built without nanoseconds
+        same_time = stat.st_mtime_ns == mtime_ns or (mtime_ns % 1000000000 == 0 and stat.st_mtime_ns // 1000000000 == mtime_ns // 1000000000)
+        if not same_time or stat.st_size & 0xffffffff != size:
+            changed[path] = (stat.st_mtime_ns, stat.st_size)
+
+    for path in untracked_dirs:
+        dirs.add(path.rstrip('/'))
+    dir_mtimes = {}
+    for path in dirs:
+        try:
+            dir_mtimes[path] = os.stat(os.path.join(repo_dir, path)).st_mtime_ns
+            newest = max(newest, dir_mtimes[path])
+        except OSError:
+            dir_mtimes[path] = None
+
+    upstream_sha = read_ref(find_common_dir(git_dir), 'refs/remotes/' + upstream) if upstream else None
+    return {
+        'index': (index_stat.st_mtime_ns, index_stat.st_size),
+        'head': head,
+        'upstream': upstream_sha,
+        'changed': changed,
+        'dirs': dir_mtimes,
+    }, newest
+
+
+class StatusCache:
+    '''The status of every repo from the last run with the fingerprint of the repo at that time
+
+    A repo whose fingerprint didn't change since gets its status from here instead of running git status.
+    '''
+
+    def __init__(self, cache_file, entries=None):
+        self.cache_file = cache_file
+        self.entries = entries or {}
+        self.hits = 0
+        # lookup and store are called from the worker threads of several repos at once
+        self.lock = threading.Lock()
+
+
+    @classmethod
+    def for_workspace(cls):
+        root = find_project_root()
+        if not root:
+            return None
+        cache_file = os.path.join(root, STATUS_CACHE_FILE)
+        try:
+            with open(cache_file, 'rb') as file:
+                data = pickle.load(file)
+            if data.get('version') == CACHE_VERSION:
+                return StatusCache(cache_file, data['entries'])
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError):
+            pass
+        return StatusCache(cache_file)
+
+
+    def lookup(self, repo, repo_dir):
+        '''Returns the cached RepoStatus when nothing git status would notice changed, else None'''
+        with self.lock:
+            entry = self.entries.get(repo)
+        if not entry:
+            return None
+        status = entry['status']
+        current = fingerprint(repo_dir, status.upstream, status.untracked_dirs)
+        if current is None or current[0] != entry['fingerprint']:
+            return None
+        with self.lock:
+            self.hits += 1
+        return status
+
+
+    def store(self, repo, repo_dir, status, started):
+        '''Remembers the status unless something was modified so close to when git status ran that it may be missing'''
+        with self.lock:
+            self.entries.pop(repo, None)
+        if status.error:
+            return
+        current = fingerprint(repo_dir, status.upstream, status.untracked_dirs)
+        if current is None:
+            return
+        state, newest = current
+        if newest >= (started - RACY_SECONDS) * 1000000000:
+            return
+        with self.lock:
+            self.entries[repo] = {'fingerprint': state, 'status': status}
+
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            with atomic_write(self.cache_file, 'wb') as file:
+                pickle.dump({'version': CACHE_VERSION, 'entries': self.entries}, file, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError as e:
+            log.perhaps_print("Could not write the status cache {f}: {e}".format(f=self.cache_file, e=e))
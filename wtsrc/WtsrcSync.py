@@ -0,0 +1,155 @@
+import asyncio
+import os
+import re
+import time
+import wtsrc.WtsrcLogger as log
+from wtsrc.WtsrcAsync import run, run_sync
+from wtsrc.WtsrcParallel import RepoProgress, RepoResult, for_each_repo, sort_by_repo
+from wtsrc.WtsrcSettings import SYNC_RETRIES, SYNC_RETRY_DELAY
+
+# git messages of network failures, the fetch may work if it is tried again
+# "unable to access" is not one of them, git also prints it for a 403, 404, bad credentials or a bad certificate
+TRANSIENT_ERRORS = (
+    "connection timed out",
+    "connection reset",
+    "connection refused",
+    "operation timed out",
+    "temporary failure in name resolution",
+    "the remote end hung up unexpectedly",
+    "early eof",
+)
+
+# a 5xx answer of the server, like "The requested URL returned error: 503" or "RPC failed; HTTP 502"
+SERVER_ERROR = re.compile(r"(returned error:|http) 5\d\d")
+
+
+class SyncResult(RepoResult):
+    '''The outcome of syncing one repo, problem says why it did not end up up to date'''
+
+    def __init__(self, repo, problem, output, duration):
+        super().__init__(repo, 0 if problem is None else 1, output, duration, command='sync')
+        self.problem = problem
+
+
+def is_transient(output):
+    output = output.lower()
+    return any(error in output for error in TRANSIENT_ERRORS) or SERVER_ERROR.search(output) is not None
+
+
+async def fetch(repo_dir, output):
+    '''Fetches, trying again with a growing delay when the failure looks like a network problem'''
+
+    delay = SYNC_RETRY_DELAY
+    for attempt in range(SYNC_RETRIES + 1):
+        result = await run(['git', 'fetch', '--prune', 'origin'], cwd=repo_dir)
+        output.append(result.output.rstrip())
+        if result.exit_code == 0:
+            return True
+        if attempt == SYNC_RETRIES or not is_transient(result.output):
+            return False
+        output.append("fetch failed, trying again in {:.0f}s".format(delay))
+        await asyncio.sleep(delay)
+        delay *= 2
+    return False
+
+
+def pinned_ref(entry):
+    '''The sha1 or tag the manifest pins the repo to, or None when it follows a branch'''
+    if not entry:
+        return None
+    return entry.get('sha1') or entry.get('tag')
+
+
+async def sync_repo(repo, repo_dir, mirror=False, pinned=None):
+    '''Fetches the repo and fast-forwards the checked out branch to its upstream
+
+    With mirror the host's mirror of origin is fetched first and the repo borrows its objects, so only
+    what the other workspaces haven't fetched yet is downloaded.
+    A repo pinned to a sha1 or tag is only fetched, it is detached on purpose like tsrc sync leaves it.
+    '''
+
+    start = time.perf_counter()
+    output = []
+
+    def finish(problem):
+        return SyncResult(repo, problem, "\n".join(o for o in output if o), time.perf_counter() - start)
+
+    if not os.path.isdir(repo_dir):
+        return finish("missing")
+
+    if mirror:
+        from wtsrc.WtsrcMirror import mirror_repo
+        url = await run(['git', 'config', '--get', 'remote.origin.url'], cwd=repo_dir)
+        if url.exit_code == 0:
+            await mirror_repo(repo_dir, url.output.strip(), output)
+
+    if not await fetch(repo_dir, output):
+        return finish("fetch failed")
+
+    if pinned:
+        output.append("pinned to {}, not fast-forwarded".format(pinned))
+        return finish(None)
+
+    upstream = await run(['git', 'rev-parse', '--abbrev-ref', '--symbolic-full-name', '@{upstream}'], cwd=repo_dir)
+    if upstream.exit_code != 0:
+        return finish("no upstream")
+
+    merge = await run(['git', 'merge', '--ff-only', '@{upstream}'], cwd=repo_dir)
+    output.append(merge.output.rstrip())
+    if merge.exit_code != 0:
+        return finish("not fast-forward")
+
+    return finish(None)
+
+
+def sync_manifest(manifest_dir):
+    '''The manifest is synced first so the repo list is up to date'''
+    result = run_sync(sync_repo('manifest', manifest_dir))
+    if not result.succeeded():
+        result.log()
+        log.warning("The manifest could not be synced ({}), using the current one".format(result.problem))
+
+
+def sync_repos(repos, jobs, mirror=False, pins=None):
+    '''Syncs every repo with at most jobs at once and returns the results in repo order
+
+    pins has the sha1 or tag of the repos the manifest pins.
+    '''
+    pins = pins or {}
+
+    async def sync(repo, repo_dir):
+        return await sync_repo(repo, repo_dir, mirror=mirror, pinned=pins.get(repo))
+
+    progress = RepoProgress("Syncing", len(repos))
+    results = for_each_repo(repos, sync, jobs, on_result=progress.update)
+    log.end_progress()
+    return sort_by_repo(results, repos)
+
+
+def log_sync_report(results):
+    '''Prints the repos that are not up to date and why, returns the ones that are missing'''
+
+    problems = [r for r in results if not r.succeeded()]
+    if log.is_json():
+        for result in results:
+            log.event('repo', repo=result.repo, command=result.command, exit_code=result.exit_code,
+                      duration=round(result.duration, 3), problem=result.problem, output=result.output)
+        return [r.repo for r in problems if r.problem == "missing"]
+
+    for result in problems:
+        if result.problem != "missing":
+            result.log()
+
+    if problems:
+        max_len = max(len(r.repo) for r in problems)
+        log.print("")
+        log.print("Repos that were not synced:", color='red')
+        log.increase_indent()
+        for result in problems:
+            spaces = " " * (max_len - len(result.repo))
+            log.print("{r} {s}=> {p}".format(r=result.repo, s=spaces, p=result.problem), color='red')
+        log.decrease_indent()
+    else:
+        log.print("All {} repos are up to date".format(len(results)), color='green')
+
+    return [r.repo for r in problems if r.problem == "missing"]
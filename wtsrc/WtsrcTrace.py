@@ -0,0 +1,135 @@
+import atexit
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# how many rows the summary tables show
+SUMMARY_SIZE = 10
+
+enabled = False
+trace_file = None
+started = None
+events = []
+lock = threading.Lock()
+# lanes are the rows of the trace viewer, concurrent spans each get their own so they don't have to nest
+busy_lanes = set()
+
+
+def start(file_path):
+    '''Records spans from now on, the trace file and the summary are written when the process exits'''
+    global enabled, trace_file, started
+    enabled = True
+    trace_file = os.path.abspath(file_path)
+    started = time.perf_counter()
+    atexit.register(finish)
+
+
+def acquire_lane():
+    with lock:
+        lane = 1
+        while lane in busy_lanes:
+            lane += 1
+        busy_lanes.add(lane)
+        return lane
+
+
+def release_lane(lane):
+    with lock:
+        busy_lanes.discard(lane)
+
+
+@contextmanager
+def span(name, category='phase', concurrent=False, **args):
+    '''Times the block as a complete event, concurrent spans (like the commands run in parallel) get their own lane'''
+    if not enabled:
+        yield
+        return
+
+    lane = acquire_lane() if concurrent else 0
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        end_time = time.perf_counter()
+        if concurrent:
+            release_lane(lane)
+        with lock:
+            events.append({'name': name, 'cat': category, 'ph': 'X', 'pid': os.getpid(), 'tid': lane,
+                           'ts': (start_time - started) * 1e6, 'dur': (end_time - start_time) * 1e6, 'args': args})
+
+
+def finish():
+    import json
+    import wtsrc.WtsrcLogger as log
+
+    total = (time.perf_counter() - started) * 1e6
+    with lock:
+        trace_events = list(events)
+    trace_events.insert(0, {'name': 'wtsrc', 'cat': 'process', 'ph': 'X', 'pid': os.getpid(), 'tid': 0,
+                            'ts': 0, 'dur': total, 'args': {}})
+
+    try:
+        with open(trace_file, 'w') as file:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, file)
+    except OSError as e:
+        log.warning("Could not write the trace file {f}: {e}".format(f=trace_file, e=e))
+        return
+
+    log_summary(trace_events)
+
+
+def add_up(trace_events, category, key):
+    '''Sums the durations of the category's spans by key, returns [(key, ms, count)] slowest first'''
+    totals = {}
+    for e in trace_events:
+        if e['cat'] == category:
+            k = key(e)
+            total, count = totals.get(k, (0.0, 0))
+            totals[k] = (total + e['dur'] / 1000, count + 1)
+    rows = [(k, total, count) for k, (total, count) in totals.items()]
+    return sorted(rows, key=lambda row: row[1], reverse=True)[:SUMMARY_SIZE]
+
+
+def repo_of(event):
+    from wtsrc.WtsrcSettings import MANIFEST_DIRECTORY
+    from wtsrc.WtsrcUtils import find_project_root
+    cwd = event['args'].get('cwd') or '.'
+    root = find_project_root()
+    if not root:
+        return cwd
+    repo = os.path.relpath(cwd, root)
+    return 'manifest' if repo == os.path.normpath(MANIFEST_DIRECTORY) else repo
+
+
+def log_summary(trace_events):
+    import wtsrc.WtsrcLogger as log
+
+    phases = []
+    for category in ('model', 'fs', 'action', 'phase'):
+        phases += add_up(trace_events, category, lambda e: "{c}: {n}".format(c=e['cat'], n=e['name']))
+    phases = sorted(phases, key=lambda row: row[1], reverse=True)[:SUMMARY_SIZE]
+    repos = add_up(trace_events, 'command', repo_of)
+
+    if log.is_json():
+        log.event('trace', file=trace_file, total_ms=round(trace_events[0]['dur'] / 1000, 1),
+                  phases=[{'name': n, 'ms': round(t, 1), 'count': c} for n, t, c in phases],
+                  repos=[{'repo': r, 'ms': round(t, 1), 'commands': c} for r, t, c in repos])
+        return
+
+    with log.batch():
+        log.print("")
+        log.print("Trace written to {f} ({t:.0f}ms total)".format(f=trace_file, t=trace_events[0]['dur'] / 1000), color='cyan')
+        log_table("slowest phases", phases, "calls")
+        log_table("slowest repos", repos, "commands")
+
+
+def log_table(title, rows, count_name):
+    import wtsrc.WtsrcLogger as log
+
+    if not rows:
+        return
+    max_len = max([len(name) for name, total, count in rows] + [len(title)])
+    log.print("{t} {s}       ms  {c}".format(t=title, s=" " * (max_len - len(title)), c=count_name), color='cyan')
+    for name, total, count in rows:
+        log.print("{n} {s} {t:8.1f}  {c}".format(n=name, s=" " * (max_len - len(name)), t=total, c=count))
@@ -1,61 +1,170 @@
 import os
-import shutil
-from wtsrc.WtsrcSettings import MANIFEST_DIRECTORY, TSRC_DIRECTORY
+import threading
+import time
+from contextlib import contextmanager
+from wtsrc.WtsrcSettings import LOCK_POLL_SECONDS, MANIFEST_DIRECTORY, TSRC_DIRECTORY
 import wtsrc.WtsrcLogger as log
+import wtsrc.WtsrcTrace as trace
 
 
-def find_tsrc_directory():
-    '''Tries to walk up the directory tree until the folder containing .tsrc directory is found'''
+class WorkspaceContext:
+    '''The workspace paths resolved once for a starting directory - lookups are memoized so each path is stat'ed once'''
+
+    def __init__(self, start_dir):
+        self.start_dir = start_dir
+        self.root = WorkspaceContext.walk_to_root(start_dir)
+        self.tsrc_dir = os.path.join(self.root, TSRC_DIRECTORY) if self.root else None
+        self.paths = {}
+
+
+    @staticmethod
+    def walk_to_root(cur_dir):
+        '''Walks up the directory tree until the folder containing .tsrc directory is found'''
+        with trace.span("find workspace root", 'fs', start_dir=cur_dir):
+            while os.path.ismount(cur_dir) is False:
+                if os.path.exists(os.path.join(cur_dir, TSRC_DIRECTORY)):
+                    return cur_dir # we have found the directory - stop the loop
+                else:
+                    head, tail = os.path.split(cur_dir)
+                    cur_dir = head
+            return None
+
+
+    def find(self, *parts):
+        '''Returns the path relative to the project root if it exists or None
+
+        Only the paths that exist are remembered, so a file created later in the same process is still found.
+        '''
+        if not self.root:
+            return None
+        if parts not in self.paths:
+            path = os.path.join(self.root, *parts)
+            if not os.path.exists(path):
+                return None
+            self.paths[parts] = path
+        return self.paths[parts]
+
+
+# the resolved workspaces keyed by the directory they were resolved from
+contexts = {}
+
+
+def get_workspace_context():
+    '''Returns the workspace context for the cwd, only walking the directory tree the first time'''
 
-    tsrc_dir = None # assume we can't find the directory
     try:
         cur_dir = os.getcwd()
     except FileNotFoundError:
         log.fatal("Cannot be called from a deleted directory")
 
-    while os.path.ismount(cur_dir) is False:
-        test_path = os.path.join(cur_dir, TSRC_DIRECTORY)
-        if os.path.exists(test_path):
-            tsrc_dir = test_path
-            break # we have found the directory - stop the loop
-        else:
-            head, tail = os.path.split(cur_dir)
-            cur_dir = head
+    if cur_dir in contexts:
+        return contexts[cur_dir]
+    context = WorkspaceContext(cur_dir)
+    # outside of a workspace the tree is walked again the next time, init may have created one since
+    if context.root:
+        contexts[cur_dir] = context
+    return context
+
+
+def invalidate_workspace_context():
+    '''Forgets every resolved path, call after creating or deleting files in the workspace'''
+    contexts.clear()
 
-    return tsrc_dir
+
+def chdir(path):
+    '''Changes directories and forgets the resolved workspaces, the new directory is resolved when it is first needed'''
+
+    os.chdir(path)
+    invalidate_workspace_context()
+
+
+def find_tsrc_directory():
+    '''Tries to walk up the directory tree until the folder containing .tsrc directory is found'''
+    return get_workspace_context().tsrc_dir
 
 
 def find_project_root():
     '''Tries to walk up the director until the root of the tsrc workspace is found'''
-
-    tsrc_dir = find_tsrc_directory()
-    if tsrc_dir:
-        head, tail = os.path.split(tsrc_dir)
-        return head
-    else:
-        return None
+    return get_workspace_context().root
 
 
 def find_directory_in_project(proj_dir):
     '''Tries the path in the project or returns None'''
-    path = None
-    root = find_project_root()
-    if root:
-        file_path = os.path.join(root, proj_dir)
-        if os.path.exists(file_path):
-            path = file_path
-    return path
+    return get_workspace_context().find(proj_dir)
 
 
 def find_file_in_project(proj_dir, file_name):
     '''Tries to find the path to a file in a directory relative to the project root'''
-    path = None
-    proj_dir_path = find_directory_in_project(proj_dir)
-    if proj_dir_path:
-        file_path = os.path.join(proj_dir_path, file_name)
-        if os.path.exists(file_path):
-            path = file_path
-    return path
+    context = get_workspace_context()
+    if not context.find(proj_dir):
+        return None
+    return context.find(proj_dir, file_name)
+
+
+@contextmanager
+def atomic_write(path, mode='w', encoding=None):
+    '''Yields a temporary file next to path that is renamed over it when the block finishes
+
+    A concurrent reader sees the old file or the new one but never half of it, the temporary file is removed again
+    when the block fails.
+    '''
+    # the thread is part of the name too, the daemon's threads can write the same file at once
+    tmp_file = "{f}.{p}.{t}.tmp".format(f=path, p=os.getpid(), t=threading.get_ident())
+    try:
+        with open(tmp_file, mode, encoding=encoding) as file:
+            yield file
+        os.replace(tmp_file, path)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+
+def lock_open_file(file, shared=False, blocking=True):
+    '''Locks the open file, returns False when blocking is off and another process holds the lock
+
+    Windows has no shared locks so there every lock is exclusive.
+    '''
+    if os.name == 'nt':
+        import msvcrt
+        file.seek(0)
+        while True:
+            try:
+                # polled because LK_LOCK gives up after 10 seconds
+                msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+                return True
+            except OSError:
+                if not blocking:
+                    return False
+                time.sleep(LOCK_POLL_SECONDS)
+
+    import fcntl
+    try:
+        fcntl.flock(file.fileno(), (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB))
+        return True
+    except BlockingIOError:
+        return False
+
+
+def unlock_open_file(file):
+    if os.name == 'nt':
+        import msvcrt
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+@contextmanager
+def lock_file(path, shared=False):
+    '''Holds a lock on path (created if needed) for the duration of the block'''
+    with open(path, 'a+') as file:
+        lock_open_file(file, shared)
+        try:
+            yield
+        finally:
+            unlock_open_file(file)
 
 
 def obj_dump(obj, name='obj'):
@@ -68,33 +177,45 @@ def chdir_to_proj_root():
     root = find_project_root()
     if not root:
         log.fatal("Cannot change to project root: you must call from within a tsrc directory")
-    os.chdir(root)
+    chdir(root)
 
 
-def chdir_to_repo(repo_path, overide_manifest=True):
-    '''Tries to change to the repo directory'''
+def find_repo_directory(repo_path, overide_manifest=True):
+    '''Returns the absolute path of the repo directory, exits when it cannot be found'''
 
     special_paths={}
     if(overide_manifest):
         special_paths['manifest'] = MANIFEST_DIRECTORY
 
-    # find the workspace root and change directories to that
-    root = find_project_root()
-    if not root:
+    # find the workspace root, the repo path is relative to that
+    context = get_workspace_context()
+    if not context.root:
         log.fatal("Cannot change to repo: you must call from within a tsrc directory")
-    os.chdir(root)
 
     # override the path if needed
     if(repo_path in special_paths):
         new_path = special_paths[repo_path]
-        if(os.path.exists(repo_path)):
+        if(context.find(repo_path)):
             log.warning("'{0}' path was overriden to '{1}'".format(repo_path, new_path))
         repo_path = new_path
 
-    if(not os.path.exists(repo_path)):
+    repo_dir = context.find(repo_path)
+    if(not repo_dir):
         log.fatal("The repo path '{}' was not found".format(repo_path))
 
-    os.chdir(repo_path)
+    return repo_dir
+
+
+def chdir_to_repo(repo_path, overide_manifest=True):
+    '''Tries to change to the repo directory'''
+    chdir(find_repo_directory(repo_path, overide_manifest))
+
+
+def repo_directory(root, repo_path):
+    '''Returns the absolute directory of a repo - 'manifest' is the manifest repo like it is for chdir_to_repo'''
+    if repo_path == 'manifest':
+        repo_path = MANIFEST_DIRECTORY
+    return os.path.join(root, repo_path)
 
 
 def chdir_to_proj_dir(proj_dir):
@@ -104,7 +225,7 @@ def chdir_to_proj_dir(proj_dir):
     if not proj_dir_path:
         log.fatal("Could not find the specified path {p}".format(p=proj_dir))
 
-    os.chdir(proj_dir_path)
+    chdir(proj_dir_path)
 
 
 def find_manifest_directory():
@@ -121,23 +242,3 @@ def find_file_in_tsrc_dir(file_name):
 
 def chdir_to_manifest_dir():
     chdir_to_proj_dir(MANIFEST_DIRECTORY)
-
-
-def nuke_dir(dir_to_nuke):
-
-    if not os.path.exists(TSRC_DIRECTORY):
-        log.fatal("You must call from the root of the project for safety.  The .tsrc directory was not found in the cwd")
-
-    files = [f for f in os.listdir(dir_to_nuke) if os.path.isfile(os.path.join(dir_to_nuke, f))]
-    dirs = [d for d in os.listdir(dir_to_nuke) if os.path.isdir(os.path.join(dir_to_nuke, d))]
-    for file in files:
-        os.unlink(file)
-    for cur_dir in dirs:
-        shutil.rmtree(cur_dir)
-
-
-def nuke_root():
-    root = find_project_root()
-    if not root:
-        log.fatal("Could not find the project root")
-    nuke_dir(root)
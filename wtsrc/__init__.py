@@ -1,23 +1,68 @@
+import sys
+
+# the profile has to be set up before anything else is imported to see where the startup time goes
+if '--startup-profile' in sys.argv:
+    import wtsrc.WtsrcStartupProfile as startup_profile
+    startup_profile.start()
+
 import click
 import os
-import pexpect
-import subprocess
-import sys
 import wtsrc.WtsrcLogger as log
-from termcolor import colored
 from wtsrc.version import __version__
-from wtsrc.ManifestModel import ManifestModel
-from wtsrc.TsrcConfigModel import TsrcConfigModel
-from wtsrc.WtsrcGlobalModel import WtsrcGlobalModel
-from wtsrc.WtsrcProjectModel import WtsrcProjectModel
-from wtsrc.WtsrcUtils import chdir_to_manifest_dir, chdir_to_repo, chdir_to_proj_root, nuke_root, obj_dump
+from wtsrc.WtsrcSettings import DEFAULT_JOBS
+
+# the modules the commands need are imported inside the commands so that a command only pays for what it uses
 
 
 # some commands cannot have a pre/post action
 # for instance the init cannot have a pre action because the manifest isn't cloned yet
 # and the alias related commands cannot have any actions because they be called from anywhere (the model might not exist)
-pre_action_not_allowed = ['add-alias','init', 'ls-manifest', 'nuke', 'remove-alias', 'show']
-post_action_not_allowed = ['add-alias', 'ls-manifest', 'nuke', 'remove-alias', 'show']
+pre_action_not_allowed = ['add-alias', 'daemon', 'init', 'ls-alias', 'ls-manifest', 'ls-mirrors', 'nuke', 'prune-mirrors', 'remove-alias', 'show']
+post_action_not_allowed = ['add-alias', 'daemon', 'ls-alias', 'ls-manifest', 'ls-mirrors', 'nuke', 'prune-mirrors', 'remove-alias', 'show']
+
+
+def repo_selection(func):
+    '''Adds the options of the commands that work on a selection of the manifest's repos'''
+    options = [
+        click.option('--group', '-g', 'groups', type=str, multiple=True, help="the repos of the manifest group"),
+        click.option('--match', '-m', 'matches', type=str, multiple=True, help="the repos whose path matches the glob, like 'libs/*'"),
+        click.option('--exclude', '-x', 'excludes', type=str, multiple=True, help="leave out the repos whose path matches the glob"),
+        click.option('--dirty', type=bool, default=False, is_flag=True, help="only the repos with staged, unstaged or untracked changes"),
+        click.option('--changed-since', type=str, default=None, help="only the repos whose HEAD differs from the ref"),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+class PathsAfterDoubleDash(click.Command):
+    '''A command whose arguments after -- are paths, click would drop the -- and mix them into the other arguments'''
+
+    def parse_args(self, ctx, args):
+        if '--' in args:
+            index = args.index('--')
+            ctx.meta['paths'] = args[index + 1:]
+            args = args[:index]
+        return super().parse_args(ctx, args)
+
+
+def select_repos(groups, matches, excludes, dirty, changed_since, jobs=DEFAULT_JOBS, include_manifest=False):
+    '''Returns the repos picked by the repo_selection options, all of the manifest's repos without any'''
+    from wtsrc.WtsrcDaemon import query_selection
+    from wtsrc.WtsrcRepoSelector import RepoSelector
+    selector = RepoSelector(groups, matches, excludes, dirty, changed_since)
+    selection = query_selection(groups, matches, excludes, dirty, changed_since, include_manifest)
+    if selection:
+        repos, warnings = selection
+    else:
+        from wtsrc.ManifestModel import ManifestModel
+        repos = selector.select(ManifestModel.load(), jobs, include_manifest=include_manifest)
+        warnings = selector.warnings
+    for warning in warnings:
+        log.warning(warning)
+    if selector.is_filtered():
+        log.perhaps_print("Selected {n} repos: {r}".format(n=len(repos), r=", ".join(repos)))
+    return repos
 
 
 def choose_alias_or_url(alias, url):
@@ -25,9 +70,13 @@ def choose_alias_or_url(alias, url):
     if alias and url:
         log.fatal("You cannot pass both an alias and a url, choose one option or the other")
     elif alias:
+        from wtsrc.WtsrcGlobalModel import WtsrcGlobalModel
         model = WtsrcGlobalModel.load()
         manifest_url = model.get_alias_url(alias)
         if(manifest_url == None):
+            similar = model.find_aliases(alias)
+            if similar:
+                log.fatal("The alias '{a}' is not known, did you mean: {s}".format(a=alias, s=", ".join(similar[:10])))
             log.fatal("The alias '{}' is not known".format(alias))
     else:
         manifest_url = url
@@ -35,58 +84,46 @@ def choose_alias_or_url(alias, url):
     return manifest_url
 
 
-def run_commands(commands, preview=False, as_sub_process=False):
-
-    for command in commands:
-        if preview:
-            log.print("This action will run the following commands:", color="green")
-            log.print(command)
-        else:
-            run_command(command, as_sub_process=as_sub_process)
-
-
-def run_command(command, as_sub_process=False):
-    '''Executes a command on the command line and shows the results and returns the exit code'''
-
-    log.print("Running Command: ", nl=False)
-    log.print(command, 'green')
-
-    if sys.platform.lower().startswith('win') or as_sub_process:
-        p = subprocess.Popen(command.split(' '), env=os.environ, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        while(True):
-            print(p.stdout.readline().decode("utf-8"), end="")
-            if(p.poll() is not None):
-                break
-        return p.returncode
-    else:
-        process = pexpect.spawn(command)
-        process.interact()
-        process.close()
-        return process.exitstatus
+def run_in_terminal(command, cwd=None):
+    '''Runs the command in cwd on the async executor with the terminal attached and returns the exit code'''
+    from wtsrc.WtsrcAsync import run_attached
+    return run_attached(command, cwd=cwd).exit_code
 
 
 def perhaps_run_action(action, heading):
-    '''Manages running an action and exiting if the process fails'''
+    '''Manages running an action plan in the manifest directory and exiting if any step fails'''
+    import wtsrc.WtsrcTrace as trace
+    from wtsrc.WtsrcUtils import find_manifest_directory
 
-    restore_cwd = os.getcwd()
-    chdir_to_manifest_dir()
     if action:
         log.print("{h} {a}".format(h=heading, a=action))
-        result = run_command(action)
-        if result != 0:
-            log.fatal("{a} exited unsuccessfully ({e})".format(a=action, e=result))
-    os.chdir(restore_cwd)
+        with trace.span(heading, 'action', action=str(action)):
+            succeeded, output = action.execute(cwd=find_manifest_directory())
+        if not succeeded:
+            log.fatal("{a} exited unsuccessfully".format(a=action))
 
 
 @click.group()
 @click.option('-v', default=False, is_flag=True, help="if you want everything printed")
+@click.option('--startup-profile', default=False, is_flag=True, help="print how long wtsrc spent importing each module")
+@click.option('--log-format', type=click.Choice(['text', 'json']), default='text', help="json prints one event object per line")
+@click.option('--trace', 'trace_file', envvar='WTSRC_TRACE', type=click.Path(dir_okay=False),
+              help="write a chrome trace of where the time went to this file and print the slowest repos and phases")
 @click.pass_context
-def run(ctx, v):
+def run(ctx, v, startup_profile, log_format, trace_file):
     '''Entry point - not real command - executes before all commands'''
 
+    log.verbose = v
+    log.set_format(log_format)
+    if trace_file:
+        import wtsrc.WtsrcTrace as trace
+        trace.start(trace_file)
+
     if(ctx.invoked_subcommand in pre_action_not_allowed):
         return
 
+    from wtsrc.WtsrcProjectModel import WtsrcProjectModel
+
     for cmd_name in ctx.command.commands:
         WtsrcProjectModel.register_known_command(cmd_name)
     
@@ -97,6 +134,8 @@ def run(ctx, v):
         WtsrcProjectModel.register_post_action_not_possible_cmd(cmd)
 
     model = WtsrcProjectModel.load()
+    # the post action is resolved now too so the result callback doesn't need the model again
+    ctx.obj = {'post_action': model.get_command_post_action(ctx.invoked_subcommand)}
     pre_action = model.get_command_pre_action(ctx.invoked_subcommand)
     perhaps_run_action(pre_action, 'Running pre-action:')
 
@@ -109,8 +148,13 @@ def post_command(ctx, result, **kwargs):
     if(ctx.invoked_subcommand in post_action_not_allowed):
         return
 
-    model = WtsrcProjectModel.load()
-    post_action = model.get_command_post_action(ctx.invoked_subcommand)
+    if ctx.obj and 'post_action' in ctx.obj:
+        post_action = ctx.obj['post_action']
+    else:
+        # commands without a pre-action (like init) haven't loaded the model
+        from wtsrc.WtsrcProjectModel import WtsrcProjectModel
+        model = WtsrcProjectModel.load()
+        post_action = model.get_command_post_action(ctx.invoked_subcommand)
     perhaps_run_action(post_action, 'Running post-action:')
     log.success()
 
@@ -121,15 +165,34 @@ def post_command(ctx, result, **kwargs):
 @click.option('--branch', '-b', type=str, default=None, help="which branch to clone (without is master)")
 @click.option('--group', '-g', type=str, default=None, help="which group to clone (without is all repos)")
 @click.option('--shallow', '-s', type=bool, default=False, is_flag=True, help="set this flag if you want a shallow copy")
-def init(alias:str, url:str, branch:str, group:str, shallow:bool):
+@click.option('--native', '-n', type=bool, default=False, is_flag=True, help="clone the repos in parallel instead of calling tsrc init")
+@click.option('--jobs', '-j', type=int, default=DEFAULT_JOBS, help="with --native how many repos to clone at the same time")
+@click.option('--blobless', type=bool, default=False, is_flag=True, help="with --native make partial clones that fetch file contents when needed (--filter=blob:none)")
+@click.option('--filter', 'blob_filter', type=str, default=None, help="with --native the git clone --filter spec, like blob:limit=1m")
+@click.option('--mirror', type=bool, default=False, is_flag=True, envvar='WTSRC_MIRROR',
+              help="with --native clone from the host's shared mirrors of the repos, updating them first")
+def init(alias:str, url:str, branch:str, group:str, shallow:bool, native:bool, jobs:int, blobless:bool, blob_filter:str, mirror:bool):
     '''Clone the manifest and all repos'''
 
     manifest_url = choose_alias_or_url(alias, url)
+    if native:
+        from wtsrc.WtsrcInit import CloneOptions, init_workspace
+        if blobless and blob_filter:
+            log.fatal("--blobless and --filter cannot be used together")
+        options = CloneOptions(shallow=shallow, blob_filter='blob:none' if blobless else blob_filter, mirror=mirror)
+        init_workspace(manifest_url, branch, [group] if group else [], options, jobs)
+        return
+    if mirror:
+        log.fatal("--mirror can only be used with --native")
+
     cmd = "tsrc init {r}{b}{u}{s}".format(r=manifest_url,
                                           b=" --branch {}".format(branch) if branch else "",
                                           u=" --group {}".format(group) if group else "",
                                           s=" -s" if shallow else "")
-    run_command(cmd)
+    run_in_terminal(cmd)
+    from wtsrc.WtsrcUtils import invalidate_workspace_context
+    # the workspace was just created so any lookups made before are stale
+    invalidate_workspace_context()
 
 
 @run.command()
@@ -141,9 +204,9 @@ def add_alias(alias:str, url:str):
     if(alias is None or alias.isidentifier() == False):
         log.fatal("'{}' is not a valid alias".format(alias))
 
-    model = WtsrcGlobalModel.load()
-    model.add_alias(alias, url)
-    model.save()
+    from wtsrc.WtsrcGlobalModel import WtsrcGlobalModel
+    with WtsrcGlobalModel.update() as model:
+        model.add_alias(alias, url)
     log.print("Added alias: {a} => {u}".format(a=alias, u=url), color='green')
 
 
@@ -151,42 +214,180 @@ def add_alias(alias:str, url:str):
 @click.option('--alias', '-a', type=str, help="The name of the alias you want to delete")
 def remove_alias(alias: str):
     '''Will try to remove an alias and save the model'''
+    from wtsrc.WtsrcGlobalModel import WtsrcGlobalModel
+    with WtsrcGlobalModel.update() as model:
+        model.remove_alias(alias)
+
+
+@run.command()
+@click.argument('prefix', default="")
+def ls_alias(prefix: str):
+    '''Lists the aliases that start with prefix'''
+    from wtsrc.WtsrcGlobalModel import WtsrcGlobalModel
     model = WtsrcGlobalModel.load()
-    model.remove_alias(alias)
-    model.save()
+    names = model.find_aliases(prefix)
+    if not names:
+        log.print("No aliases start with '{}'".format(prefix))
+    max_len = max([len(name) for name in names] + [0])
+    for name in names:
+        log.print("{a} {s}=> {u}".format(a=name, s=" " * (max_len - len(name)), u=model.get_alias_url(name)))
 
 
 @run.command()
-def sync():
+@click.option('--native', '-n', type=bool, default=False, is_flag=True, help="fetch and fast-forward the repos in parallel instead of calling tsrc sync")
+@click.option('--jobs', '-j', type=int, default=DEFAULT_JOBS, help="with --native how many repos to sync at the same time")
+@click.option('--mirror', type=bool, default=False, is_flag=True, envvar='WTSRC_MIRROR',
+              help="with --native fetch the host's shared mirror of each repo first and borrow its objects")
+def sync(native:bool, jobs:int, mirror:bool):
     '''Pulls all repos - wraps tsrc sync'''
-    cmd = "tsrc sync"
-    run_command(cmd)
+    if not native:
+        if mirror:
+            log.fatal("--mirror can only be used with --native")
+        cmd = "tsrc sync"
+        run_in_terminal(cmd)
+        return
+
+    from wtsrc.ManifestModel import ManifestModel
+    from wtsrc.WtsrcSync import log_sync_report, pinned_ref, sync_manifest, sync_repos
+    from wtsrc.WtsrcUtils import find_project_root, find_repo_directory
+
+    sync_manifest(find_repo_directory('manifest'))
+    # the manifest may have changed so read it again
+    ManifestModel.instance = None
+    manifest = ManifestModel.load()
+    repos = manifest.get_repo_dests()
+    pins = {repo: pinned_ref(manifest.get_repo(repo)) for repo in repos}
+    missing = log_sync_report(sync_repos(repos, jobs, mirror=mirror, pins=pins))
+    if missing:
+        log.print("")
+        log.print("Letting tsrc clone the missing repos: {}".format(", ".join(missing)))
+        run_in_terminal("tsrc sync", cwd=find_project_root())
 
 
 @run.command()
 @click.option('--repo', '-r', type=str, default=None, required=False)
-def status(repo:str):
+@click.option('--clean', type=bool, default=False, is_flag=True, help="with 'all' also list the repos that have no changes")
+@click.option('--jobs', '-j', type=int, default=DEFAULT_JOBS, help="with 'all' how many repos to check at the same time")
+@click.option('--no-cache', type=bool, default=False, is_flag=True, help="with 'all' run git status in every repo even if it didn't change since the last time")
+@click.option('--fsmonitor', type=bool, default=False, is_flag=True, help="with 'all' let git start its file system monitor in every repo (macOS and Windows)")
+@repo_selection
+def status(repo:str, clean:bool, jobs:int, no_cache:bool, fsmonitor:bool, groups, matches, excludes, dirty, changed_since):
     '''Shows the status of a repo at the specified path or "all"'''
-    if repo == None or repo == 'all':
-        chdir_to_manifest_dir()
+    from wtsrc.WtsrcRepoSelector import RepoSelector
+    from wtsrc.WtsrcUtils import find_project_root, find_repo_directory
+    if repo == None and RepoSelector(groups, matches, excludes, dirty, changed_since).is_filtered():
+        # choosing repos only makes sense for the table
+        repo = 'all'
+
+    if repo == None:
         log.print("Status of manifest", color='green')
         cmd = 'git status'
-        run_command(cmd)
-        if repo == None:
-            cmd = 'tsrc status'
-        else:
-            cmd = 'tsrc foreach git status'
-        run_command(cmd)
+        run_in_terminal(cmd, cwd=find_repo_directory('manifest'))
+        cmd = 'tsrc status'
+        run_in_terminal(cmd, cwd=find_project_root())
+    elif repo == 'all':
+        from wtsrc.WtsrcGitStatus import log_status_table, read_status
+        from wtsrc.WtsrcParallel import for_each_repo, sort_by_repo
+        from wtsrc.WtsrcStatusCache import StatusCache
+        repos = select_repos(groups, matches, excludes, dirty, changed_since, jobs, include_manifest=True)
+        if not (no_cache or fsmonitor):
+            from wtsrc.WtsrcDaemon import query_status
+            statuses = query_status(repos)
+            if statuses is not None:
+                log.perhaps_print("The status came from the wtsrc daemon")
+                log_status_table(statuses, show_clean=clean)
+                return
+        cache = None if no_cache else StatusCache.for_workspace()
+
+        async def read(repo, repo_dir):
+            return await read_status(repo, repo_dir, cache=cache, fsmonitor=fsmonitor)
+
+        statuses = sort_by_repo(for_each_repo(repos, read, jobs), repos)
+        if cache:
+            cache.save()
+            log.perhaps_print("{h} of {n} repos were unchanged since the last status".format(h=cache.hits, n=len(repos)))
+        log_status_table(statuses, show_clean=clean)
     else:
-        log.print("Changing to repo {0}".format(repo))
-        chdir_to_repo(repo, overide_manifest=True)
         cmd = "git status"
-        run_command(cmd)
+        run_in_terminal(cmd, cwd=find_repo_directory(repo, overide_manifest=True))
+
+
+@run.command(cls=PathsAfterDoubleDash)
+@click.argument('revisions', nargs=-1)
+@click.option('--stat', type=bool, default=False, is_flag=True, help="only the changed files with their number of changed lines")
+@click.option('--name-only', type=bool, default=False, is_flag=True, help="only the names of the changed files")
+@click.option('--cached', '--staged', 'cached', type=bool, default=False, is_flag=True, help="the staged changes instead of the unstaged ones")
+@click.option('--no-pager', type=bool, default=False, is_flag=True, help="print the diffs instead of showing them in the pager")
+@click.option('--jobs', '-j', type=int, default=DEFAULT_JOBS, help="how many repos to diff at the same time")
+@repo_selection
+def diff(revisions, stat:bool, name_only:bool, cached:bool, no_pager:bool, jobs:int, groups, matches, excludes, dirty, changed_since):
+    '''Shows the git diff of the repos and the manifest in one pager, like git diff [REVISIONS] [-- PATHS]'''
+    from wtsrc.WtsrcDiff import diff_repos
+    repos = select_repos(groups, matches, excludes, dirty, changed_since, jobs, include_manifest=True)
+    args = (['--stat'] if stat else []) + (['--name-only'] if name_only else []) + (['--cached'] if cached else [])
+    # the -- keeps git from taking a revision that a repo doesn't have for a path
+    paths = click.get_current_context().meta.get('paths', [])
+    failed = diff_repos(repos, args + list(revisions) + ['--'] + paths, jobs, use_pager=not no_pager)
+    if failed:
+        log.fatal("git diff failed in {} repos".format(len(failed)))
+
+
+@run.command()
+@click.argument('pattern')
+@click.argument('paths', nargs=-1)
+@click.option('--ignore-case', '-i', type=bool, default=False, is_flag=True, help="ignore the case of the pattern")
+@click.option('--word-regexp', '-w', type=bool, default=False, is_flag=True, help="only match whole words")
+@click.option('--fixed-strings', '-F', type=bool, default=False, is_flag=True, help="the pattern is a string, not a regex")
+@click.option('--extended-regexp', '-E', type=bool, default=False, is_flag=True, help="the pattern is an extended regex")
+@click.option('--files-with-matches', '-l', type=bool, default=False, is_flag=True, help="only the names of the files that match")
+@click.option('--max-count', type=int, default=None, help="stop every repo after this many matches in all of them")
+@click.option('--ref', type=str, default=None, help="search the tree of the ref instead of the work tree")
+@click.option('--manifest-branch', type=bool, default=False, is_flag=True, help="search the manifest branch instead of the work tree")
+@click.option('--jobs', '-j', type=int, default=DEFAULT_JOBS, help="how many repos to search at the same time")
+@repo_selection
+def grep(pattern, paths, ignore_case:bool, word_regexp:bool, fixed_strings:bool, extended_regexp:bool, files_with_matches:bool,
+         max_count:int, ref:str, manifest_branch:bool, jobs:int, groups, matches, excludes, dirty, changed_since):
+    '''Searches the repos and the manifest for PATTERN with git grep, printing repo/path:line:match'''
+    from wtsrc.WtsrcGrep import grep_repos
+    if ref and manifest_branch:
+        log.fatal("You cannot pass both --ref and --manifest-branch, choose one option or the other")
+    if max_count is not None and max_count < 1:
+        log.fatal("--max-count must be at least 1")
+    if manifest_branch:
+        from wtsrc.TsrcConfigModel import TsrcConfigModel
+        ref = TsrcConfigModel.load().get_manifest_branch()
+        if not ref:
+            log.fatal("The tsrc config has no manifest branch")
+    repos = select_repos(groups, matches, excludes, dirty, changed_since, jobs, include_manifest=True)
+    options = [flag for flag, used in [('-i', ignore_case), ('-w', word_regexp), ('-F', fixed_strings),
+                                       ('-E', extended_regexp), ('-l', files_with_matches)] if used]
+    found, failed = grep_repos(repos, pattern, options, paths, jobs, ref=ref, max_count=max_count)
+    # a bad pattern fails the same way in every repo, so each message is shown once
+    messages = {}
+    for result in failed:
+        messages.setdefault(result.output, []).append(result)
+    for message, results in messages.items():
+        if len(results) == 1 or log.is_json():
+            for result in results:
+                result.log()
+        else:
+            log.print("* {n} repos: {r}".format(n=len(results), r=", ".join(r.repo for r in results[:5]) +
+                                                 (", ..." if len(results) > 5 else "")), color='red')
+            log.increase_indent()
+            log.print(message)
+            log.decrease_indent()
+    if not found and not log.is_json():
+        log.print("No matches in {} repos".format(len(repos)), color='yellow')
+    errors = [r for r in failed if r.exit_code is not None]
+    if errors:
+        log.fatal("git grep failed in {} repos".format(len(errors)))
 
 
 @run.command()
 def show():
     '''Shows the model'''
+    from wtsrc.WtsrcGlobalModel import WtsrcGlobalModel
+    from wtsrc.WtsrcProjectModel import WtsrcProjectModel
     gmodel = WtsrcGlobalModel.load()
     log.print("Global Model:", color="green")
     log.print(str(gmodel))
@@ -197,35 +398,77 @@ def show():
 
 
 @run.command()
-@click.option('--command', '-c', type=str, help="The text of the command to run including options")
-def foreach(command:str):
-    '''wraps tsrc foreach, runs the "command text" for all repos'''
-    cmd = "tsrc foreach -c '{c}'".format(c=command)
-    run_command(cmd)
+@click.option('--command', '-c', type=str, required=True, help="The text of the command to run including options")
+@click.option('--jobs', '-j', type=int, default=DEFAULT_JOBS, help="how many repos to run the command in at the same time")
+@click.option('--timeout', '-t', type=float, default=None, help="kill the command in a repo after this many seconds")
+@repo_selection
+def foreach(command:str, jobs:int, timeout:float, groups, matches, excludes, dirty, changed_since):
+    '''runs the "command text" for all repos in parallel'''
+    from wtsrc.WtsrcParallel import log_summary, run_in_repos
+    repos = select_repos(groups, matches, excludes, dirty, changed_since, jobs)
+    if not repos:
+        log.print("No repos were selected")
+        return
+    log.print("Running Command: ", nl=False)
+    log.print(command, 'green')
+    results = run_in_repos(repos, command, jobs, timeout=timeout)
+    failed = log_summary(results)
+    if failed:
+        log.fatal("The command failed in {} repos".format(len(failed)))
 
 
 @run.command()
-@click.option('--repo', '-r', type=str, help="The repo path")
+@click.option('--repo', '-r', 'repo_paths', type=str, multiple=True, help="The repo path")
 @click.option('--command', '-c', type=str, help="The text of the command to run including options")
-def forsingle(repo:str, command:str):
+@repo_selection
+def forsingle(repo_paths, command:str, groups, matches, excludes, dirty, changed_since):
     '''Will run "command text" for the specified repo'''
-    log.print("Changing to repo {0}".format(repo))
-    chdir_to_repo(repo, overide_manifest=True)
-    run_command(command)
+    from wtsrc.WtsrcRepoSelector import RepoSelector
+    from wtsrc.WtsrcUtils import find_repo_directory
+    repos = list(repo_paths)
+    if RepoSelector(groups, matches, excludes, dirty, changed_since).is_filtered():
+        repos += [r for r in select_repos(groups, matches, excludes, dirty, changed_since) if r not in repos]
+    if not repos:
+        log.fatal("Give the repo with --repo or choose repos with the selection options")
+    # one after the other with the terminal attached, the command may be interactive
+    for repo in repos:
+        run_in_terminal(command, cwd=find_repo_directory(repo, overide_manifest=True))
 
 
 @run.command()
 @click.argument("action", type=str)
-def run_action(action):
+@click.option('--force', '-f', type=bool, default=False, is_flag=True, help="run the action even if its inputs didn't change")
+def run_action(action, force):
     '''Tries to run an action defined in wtsrc.yml'''
+    from wtsrc.WtsrcProjectModel import WtsrcProjectModel
     model = WtsrcProjectModel.load()
 
     action_name = action
-    action = model.get_action_action(action_name)
+    action = model.get_action(action_name)
     if not action:
         log.fatal("The action '{}' was not found".format(action_name))
 
-    perhaps_run_action(action, "Action: ")
+    if not action.is_cacheable():
+        perhaps_run_action(action.action, "Action: ")
+        return
+
+    from wtsrc.WtsrcActionCache import ActionCache
+    from wtsrc.WtsrcUtils import find_manifest_directory
+    cache = ActionCache.for_workspace()
+    cwd = find_manifest_directory()
+    key = cache.key(action, cwd)
+
+    output = None if force else cache.lookup(key, cwd)
+    if output is not None:
+        log.print("Action: {a} (inputs unchanged, replaying the cached output)".format(a=action.action))
+        log.output(output, source=action.name)
+        return
+
+    log.print("Action: {a}".format(a=action.action))
+    succeeded, output = action.action.execute(cwd=cwd, capture=True)
+    if not succeeded:
+        log.fatal("{a} exited unsuccessfully".format(a=action.action))
+    cache.store(key, action, cwd, output)
 
 
 @run.command()
@@ -235,16 +478,15 @@ def ls_manifest(alias, url):
     '''Lists all branches for the manifest repo'''
     manifest_url = choose_alias_or_url(alias, url)
     cmd = "git ls-remote {}".format(manifest_url)
-    run_command(cmd)
+    run_in_terminal(cmd)
 
 
 @run.command()
 @click.option('--repo', '-r', type=str, default=None, required=True, help="The path of the repo relative to the project root")
 def ls_repo(repo):
     '''Shows all the available branches for a repo's remote'''
-    log.print("Changing to repo {0}".format(repo))
-    chdir_to_repo(repo, overide_manifest=True)
-    run_command("git branch -a")
+    from wtsrc.WtsrcUtils import find_repo_directory
+    run_in_terminal("git branch -a", cwd=find_repo_directory(repo, overide_manifest=True))
 
 
 @run.command()
@@ -252,15 +494,20 @@ def ls_repo(repo):
 @click.option('--branch', '-b', type=str, default=None, required=True, help="the name of the branch to checkout")
 def checkout_for(repo, branch):
     '''Checks out an existing branch for a repo'''
-    chdir_to_repo(repo, overide_manifest=True)
-    run_command("git checkout {0}".format(branch))
+    from wtsrc.WtsrcUtils import find_repo_directory
+    run_in_terminal("git checkout {0}".format(branch), cwd=find_repo_directory(repo, overide_manifest=True))
 
 
 @run.command()
 @click.option('--repos', '-r', type=str, default=None, multiple=True, required=True, help="The set of repos to create the repo for")
 @click.option('--branch', '-b', type=str, default=None, required=True, help="the name branch for the configuration")
-def create_config(repos, branch):
+@click.option('--jobs', '-j', type=int, default=DEFAULT_JOBS, help="how many repos to branch and push at the same time")
+def create_config(repos, branch, jobs):
     '''Creates a new configuration with the given name'''
+    from wtsrc.ManifestModel import ManifestModel
+    from wtsrc.TsrcConfigModel import TsrcConfigModel
+    from wtsrc.WtsrcConfigTransaction import ConfigTransaction
+    from wtsrc.WtsrcUtils import find_directory_in_project, find_manifest_directory
 
     manifest = ManifestModel.load()
     config = TsrcConfigModel.load()
@@ -270,31 +517,77 @@ def create_config(repos, branch):
         found = manifest.has_repo(repo)
         if not found:
             log.fatal("Could not find repo {r}".format(r=repo))
-        chdir_to_repo(repo) # this will also error if the repo directory doesn't exist
+        if not find_directory_in_project(repo):
+            log.fatal("The repo path '{}' was not found".format(repo))
 
-    for repo in repos:
-        log.print("Changing to repo directory: {r}".format(r=repo))
-        chdir_to_repo(repo)
-        run_command("git checkout -b {0}".format(branch))
-        run_command("git push --set-upstream origin {0}".format(branch))
-        manifest.update_branch(repo, branch)
-        log.print("")
+    manifest_dir = find_manifest_directory()
+    if not manifest_dir:
+        log.fatal("The manifest directory could not be found")
+
+    transaction = ConfigTransaction(list(repos), branch, jobs)
+    log.print("Creating branch {b} in {n} repos".format(b=branch, n=len(repos)))
+    failed = transaction.create_branches()
+    if failed:
+        transaction.rollback()
+        log.fatal("Could not create the configuration, failed in: {}".format(", ".join(failed)))
 
     log.print("")
-    log.print("Changing to manifest directory")
-    chdir_to_manifest_dir()
-    run_command("git checkout -b {0}".format(branch))
     log.print("Saving updated tsrc manifest")
-    manifest.save()
-    run_command('git add manifest.yml')
-    run_command('git commit -m "creating configuration {0}"'.format(branch))
-    run_command("git push --set-upstream origin {0}".format(branch))
+    if not transaction.commit_manifest(manifest, manifest_dir):
+        transaction.rollback()
+        log.fatal("Could not push the updated manifest, the configuration was rolled back")
 
     log.print("")
     log.print("Saving updated tsrc configuration file")
     config.change_branch(branch)
     config.save()
 
+
+@run.command()
+@click.option('--output', '-o', type=click.Path(dir_okay=False), default=None, help="where to write the lockfile, .tsrc/wtsrc_lock.yml by default")
+@click.option('--jobs', '-j', type=int, default=DEFAULT_JOBS, help="how many repos to read at the same time")
+def snapshot(output, jobs):
+    '''Records the commit every repo is at in a lockfile'''
+    from wtsrc.ManifestModel import ManifestModel
+    from wtsrc.TsrcConfigModel import TsrcConfigModel
+    from wtsrc.WtsrcSettings import SNAPSHOT_FILE
+    from wtsrc.WtsrcSnapshot import save_lockfile, take_snapshot
+    from wtsrc.WtsrcUtils import find_tsrc_directory
+
+    data, failed = take_snapshot(ManifestModel.load(), TsrcConfigModel.load(), jobs)
+    for head in failed:
+        log.warning("{r} was left out of the snapshot: {e}".format(r=head.repo, e=head.error))
+
+    file_path = output or os.path.join(find_tsrc_directory(), SNAPSHOT_FILE)
+    save_lockfile(data, file_path)
+    log.event('snapshot', file=file_path, repos=len(data['repos']), failed=[h.repo for h in failed])
+    log.print("Saved the commits of {n} repos to {f}".format(n=len(data['repos']), f=file_path), color='green')
+
+
+@run.command()
+@click.argument('lockfile', type=click.Path(dir_okay=False), required=False)
+@click.option('--jobs', '-j', type=int, default=DEFAULT_JOBS, help="how many repos to check out at the same time")
+def restore(lockfile, jobs):
+    '''Checks out the commits recorded by snapshot, fetching only what is missing'''
+    from wtsrc.WtsrcParallel import log_summary
+    from wtsrc.WtsrcSettings import SNAPSHOT_FILE
+    from wtsrc.WtsrcSnapshot import load_lockfile, restore_snapshot
+    from wtsrc.WtsrcUtils import find_tsrc_directory
+
+    if not lockfile and not find_tsrc_directory():
+        log.fatal("You must call from within a tsrc directory or give the lockfile")
+    file_path = lockfile or os.path.join(find_tsrc_directory(), SNAPSHOT_FILE)
+    if not os.path.isfile(file_path):
+        log.fatal("The lockfile {} was not found".format(file_path))
+
+    results = restore_snapshot(load_lockfile(file_path), jobs)
+    for result in results:
+        if not result.succeeded():
+            result.log()
+    failed = log_summary(results)
+    if failed:
+        log.fatal("{} repos could not be restored".format(len(failed)))
+
 """
 @run.command()
 def destroy_config():
@@ -317,17 +610,79 @@ def destroy_config():
 """
 
 @run.command()
-def nuke():
+@click.option('--jobs', '-j', type=int, default=DEFAULT_JOBS, help="how many directory trees to delete at the same time")
+@click.option('--trash', '-t', is_flag=True, default=False, help="move everything aside and delete it in the background so the command returns right away")
+def nuke(jobs, trash):
     """Deletes everything, including the .tsrc director"""
+    from wtsrc.WtsrcNuke import nuke_root
     if click.confirm('This will attempt to delete all files in\n{0}\n...\nAre you sure you want to continue?'.format(os.getcwd())):
-        nuke_root()
+        nuke_root(jobs, trash)
         log.print("Nuked", color="green")
     else:
         log.warning("You've canceled")
 
 
+@run.command()
+@click.option('--background', '-b', type=bool, default=False, is_flag=True, help="start it as a detached process logging to .tsrc/wtsrc_daemon.log")
+@click.option('--stop', type=bool, default=False, is_flag=True, help="stop the daemon of the workspace")
+@click.option('--jobs', '-j', type=int, default=DEFAULT_JOBS, help="how many repos it checks at the same time")
+def daemon(background, stop, jobs):
+    '''Keeps the workspace's models and repo statuses in memory, status and the repo selection ask it when it runs'''
+    from wtsrc.WtsrcDaemon import request, serve, start_in_background
+    if stop:
+        response = request('stop')
+        if not response:
+            log.fatal("The daemon of this workspace is not running")
+        log.print("Stopped the daemon (pid {})".format(response['pid']))
+    elif background:
+        log.print("Started the daemon (pid {}), it answers once it has read every repo".format(start_in_background(jobs)))
+    else:
+        serve(jobs)
+
+
+@run.command()
+def ls_mirrors():
+    '''Lists the host's shared mirrors, least recently used first'''
+    from wtsrc.WtsrcMirror import list_mirrors, log_mirrors
+    log_mirrors(list_mirrors())
+
+
+@run.command()
+@click.option('--max-size', type=str, default=None, help="delete the least recently used mirrors until the rest fit, like 20G")
+@click.option('--unused-days', type=float, default=None, help="delete the mirrors not used for this many days")
+@click.option('--dry-run', type=bool, default=False, is_flag=True, help="only list the mirrors that would be deleted")
+def prune_mirrors(max_size, unused_days, dry_run):
+    '''Deletes least recently used mirrors, the repos borrowing from them get their own copy of the objects first'''
+    from wtsrc.WtsrcMirror import choose_evictions, evict_mirror, list_mirrors, log_mirrors, parse_size
+    max_bytes = None
+    if max_size is not None:
+        max_bytes = parse_size(max_size)
+        if max_bytes is None:
+            log.fatal("'{}' is not a size like 500M or 20G".format(max_size))
+    if max_bytes is None and unused_days is None:
+        log.fatal("Pass --max-size or --unused-days")
+
+    evicted = choose_evictions(list_mirrors(), max_bytes, unused_days)
+    if dry_run or not evicted:
+        log.print("{n} mirrors would be deleted".format(n=len(evicted)))
+        if evicted:
+            log_mirrors(evicted)
+        return
+
+    failed = 0
+    for mirror in evicted:
+        log.print("Deleting {}".format(mirror.url or mirror.name))
+        problems = evict_mirror(mirror)
+        if problems:
+            failed += 1
+            log.warning("The mirror {m} could not be deleted: {p}".format(m=mirror.path, p="; ".join(problems)))
+    if failed:
+        log.fatal("{} mirrors could not be deleted".format(failed))
+    log.print("Deleted {} mirrors".format(len(evicted)), color='green')
+
+
 @run.command()
 def version():
     '''prints both tsrc's and wtsrc's version'''
-    run_command("tsrc version")
+    run_in_terminal("tsrc version")
     log.print("wtsrc version: {}".format(__version__))